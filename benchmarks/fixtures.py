@@ -0,0 +1,217 @@
+"""HTML fixtures of the websites, and a local server standing in for them
+
+The fixtures follow the structure of the real pages: the highlights, the
+feed containers with the fields of the SiteSpec of each website, the
+'load more' button, and the menus, scripts and ads that make most of the
+weight of a scrolled page. Each website has two variants:
+
+    small   the first screen of the page
+    huge    the page after 50 scrolls
+
+They are written to benchmarks/fixtures as <font>_<variant>.html. A saved
+page_source of the real website with the same name takes their place.
+
+The LocalSites server serves the same pages, with the pagination followed
+by the HTTP scraping, so the fetch path runs end to end without network.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+import threading
+import os
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# news loaded by each scroll, and scrolls of the huge variant
+NEWS_PER_SCROLL = 10
+VARIANTS = {'small': 1, 'huge': 51}
+HIGHLIGHTS = 5
+
+
+def _filler(n_links: int = 200, n_scripts: int = 20) -> str:
+    """Menus and scripts, with nothing to scrap"""
+    links = ''.join(f'<li class="menu-item"><a href="/secao/{i}">Seção {i}</a></li>' for i in range(n_links))
+    scripts = ''.join(f'<script>window.dataLayer.push({{"event": "view", "slot": {i}, "payload": "{"x" * 400}"}});</script>'
+                      for i in range(n_scripts))
+    return f'<header><nav><ul class="menu">{links}</ul></nav></header>{scripts}'
+
+
+def _ad(i: int) -> str:
+    return f'<div class="ad-slot"><script>googletag.display("ad-{i}");</script><iframe src="/ads/{i}"></iframe></div>'
+
+
+def _relative_time(i: int) -> str:
+    return f'Há {i % 50 + 1} minutos' if i % 3 else f'Há {i % 12 + 1} horas'
+
+
+def g1_news(start: int, n: int, page: str = '') -> str:
+    return ''.join(
+        f'<div class="bastian-feed-item"><div class="feed-post-body">'
+        f'<span class="feed-post-header-chapeu">Chapéu {i}</span>'
+        f'<a class="feed-post-link gui-color-primary gui-color-hover" href="https://g1.globo.com/noticia/{i}.ghtml">'
+        f'G1 notícia {page} {i} sobre economia e política</a>'
+        f'<div class="feed-post-body-resumo">Resumo da notícia {i}, com algumas palavras a mais.</div>'
+        f'<span class="feed-post-datetime">{_relative_time(i)}</span>'
+        f'<span class="feed-post-metadata-section"> Economia </span></div></div>{_ad(i)}'
+        for i in range(start, start + n)
+    )
+
+
+def cnn_news(start: int, n: int, page: str = '') -> str:
+    section = f'{page}/' if page else ''
+    return ''.join(
+        f'<li class="home__list__item"><a href="https://www.cnnbrasil.com.br/{section}noticia-{i}/">'
+        f'<h3 class="news-item-header__title"> CNN notícia {page} {i} </h3></a>'
+        f'<span class="home__title__date">{i % 28 + 1:02d}/07/2024 às {i % 24:02d}:{i % 60:02d}</span></li>{_ad(i)}'
+        for i in range(start, start + n)
+    )
+
+
+def uol_news(start: int, n: int, page: str = '') -> str:
+    return ''.join(
+        f'<div class="thumbnails-item"><a href="https://noticias.uol.com.br/noticia-{i}.htm">'
+        f'<div class="thumb-caption"><h3 class="thumb-title">UOL notícia {i}</h3>'
+        f'<p class="thumb-description">Descrição da notícia {i}.</p>'
+        f'<time class="thumb-date">{i % 28 + 1:02d}/07/2024 {i % 24:02d}h{i % 60:02d}</time></div></a></div>{_ad(i)}'
+        for i in range(start, start + n)
+    )
+
+
+def _g1_page(n_news: int, page: str, next_url: str, items_only: bool) -> str:
+    more = '' if next_url is None else f'<div class="load-more gui-color-primary-bg"><a href="{next_url}">Veja mais</a></div>'
+    feed = f'<div class="_evg">{g1_news(0, n_news, page)}</div>{more}'
+    if items_only:
+        return f'<html><body>{feed}</body></html>'
+
+    highlights = ''.join(
+        f'<ul class="bstn-hl-list"><li><a class="bstn-hl-link" href="https://g1.globo.com/destaque/{i}.ghtml">'
+        f'<span class="bstn-hl-chapeu">Tema {i}</span><span class="bstn-hl-title">G1 destaque {i}</span></a></li></ul>'
+        for i in range(HIGHLIGHTS)
+    )
+    return (f'<html><body>{_filler()}<div class="row small-collapse large-uncollapse">{highlights}</div>'
+            f'{feed}</body></html>')
+
+
+def _cnn_page(n_news: int, page: str, next_url: str, items_only: bool) -> str:
+    more = '' if next_url is None else f'<button class="block-list-get-more-btn" data-url="{next_url}">Ver mais</button>'
+    feed = f'<div class="col__l--9 col--12"><ul class="home__list">{cnn_news(0, n_news, page)}</ul>{more}</div>'
+    if items_only:
+        return f'<html><body>{feed}</body></html>'
+
+    section = f'{page}/' if page else ''
+    highlights = ''.join(
+        f'<li><div class="three__highlights__titles"><a href="https://www.cnnbrasil.com.br/{section}destaque-{i}/">'
+        f'<h2 class="block__news__title"> CNN destaque {page} {i} </h2></a></div></li>'
+        for i in range(3)
+    )
+    return (f'<html><body>{_filler()}<ul class="three__highlights__list row">{highlights}</ul>'
+            f'{feed}</body></html>')
+
+
+def _uol_page(n_news: int, page: str, next_url: str, items_only: bool) -> str:
+    more = '' if next_url is None else f'<button class="btn-search" data-request="{next_url}">Ver mais</button>'
+    feed = f'<section class="latest-news">{uol_news(0, n_news, page)}{more}</section>'
+    if items_only:
+        return f'<html><body>{feed}</body></html>'
+
+    return (f'<html><body>{_filler()}<a href="https://noticias.uol.com.br/manchete.htm"><h2>UOL manchete</h2></a>'
+            f'{feed}</body></html>')
+
+
+PAGES = {'G1': _g1_page, 'CNN': _cnn_page, 'UOL': _uol_page}
+
+
+def page_html(font: str, n_scrolls: int = 1, page: str = '', next_url: str = None, items_only: bool = False) -> str:
+    """HTML of a page of a website with the news of n_scrolls scrolls"""
+    return PAGES[font](NEWS_PER_SCROLL * n_scrolls, page, next_url, items_only)
+
+
+def load_fixture(font: str, variant: str, folder: str = FIXTURES_PATH) -> str:
+    """HTML of a fixture, generating it on the first use"""
+    path = os.path.join(folder, f'{font.lower()}_{variant}.html')
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(page_html(font, VARIANTS[variant]))
+
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+class LocalSites():
+    """Local HTTP server standing in for the websites
+
+    Each website is served on /<font>/<page>, and its 'load more' button
+    points to /<font>/<page>/feed/<n>, with the next news, up to n_pages.
+
+    Examples
+    --------
+    >>> with LocalSites() as sites:
+    ...     spec = dataclasses.replace(SITES['G1'], url=sites.url('G1'))
+    """
+
+    def __init__(self, n_pages: int = 50, port: int = 0):
+        self.n_pages = n_pages
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = server.render(urlsplit(self.path).path)
+                server.requests += 1
+                if body is None:
+                    self.send_error(404)
+                    return
+
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+
+    def url(self, font: str) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}/{font.lower()}/'
+
+
+    def render(self, path: str) -> str:
+        """HTML of a path of the server, None if it does not exist"""
+        parts = path.strip('/').split('/')
+        font = parts[0].upper()
+        if font not in PAGES:
+            return None
+
+        if 'feed' not in parts:
+            page = '/'.join(parts[1:])
+            return page_html(font, 1, page, self._next_url(font, page, 2))
+
+        feed = parts.index('feed')
+        page = '/'.join(parts[1:feed])
+        n = int(parts[feed + 1])
+        if n > self.n_pages + 1:
+            return None
+
+        html_source = page_html(font, 1, page, self._next_url(font, page, n + 1), items_only=True)
+        # the news of the next pages are different ones
+        return html_source.replace(' notícia ', f' notícia p{n} ')
+
+
+    def _next_url(self, font: str, page: str, n: int) -> str:
+        if n > self.n_pages + 1:
+            return None
+        return '/' + '/'.join(part for part in [font.lower(), page, 'feed', str(n)] if part)
+
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,80 @@
+"""Benchmark of the page parsing of the scrapers on saved page snapshots
+
+Save the HTML of scrolled pages with `driver.page_source` as g1.html,
+cnn.html and uol.html in a folder, then run
+
+    python benchmarks/parse_benchmark.py --snapshots path/to/folder
+
+or use the last page of each website kept on the HTML cache, with --cache.
+
+Each snapshot is parsed with the whole tree, as the scrapers used to do,
+and with the strainers of the scrapers, reporting time and peak memory.
+"""
+from bs4 import BeautifulSoup
+from time import perf_counter
+import argparse
+import os
+import tracemalloc
+
+from src.extraction import ExtractionEngine
+from src.html_cache import HtmlCache
+from src.parsing import parse_html
+from src.sites import SITES
+
+
+def measure(function, repeat: int) -> tuple[float, float, int]:
+    """Best time in seconds, peak memory in MB and the number of news"""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        rows = function()
+        times.append(perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak / 2**20, len(rows)
+
+
+def benchmark_site(font: str, html_source: str, repeat: int):
+    engine = ExtractionEngine(SITES[font])
+    page = engine.spec.pages[0]
+
+    full = measure(lambda: list(engine.iter_rows(BeautifulSoup(html_source, 'lxml'), page)), repeat)
+    strained = measure(lambda: list(engine.iter_rows(parse_html(html_source, engine.page_strainer), page)), repeat)
+
+    print(f"{font}: {len(html_source) / 2**20:.1f} MB of HTML")
+    print(f"  full tree: {full[0] * 1000:8.1f} ms {full[1]:8.1f} MB peak  {full[2]} news")
+    print(f"  strained:  {strained[0] * 1000:8.1f} ms {strained[1]:8.1f} MB peak  {strained[2]} news")
+    print(f"  speedup {full[0] / strained[0]:.1f}x, memory {full[1] / strained[1]:.1f}x smaller")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the parsing of saved page snapshots')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--snapshots', help='folder with g1.html, cnn.html and uol.html')
+    source.add_argument('--cache', nargs='?', const='', help='HTML cache folder, by default data/html_cache')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs of each parser')
+    args = parser.parse_args()
+
+    if args.cache is not None:
+        cache = HtmlCache(args.cache or None)
+        for font, spec in SITES.items():
+            url = f'{spec.url}{spec.pages[0]}'
+            entries = [entry for entry in cache.entries(url) if entry[0] == url]
+            if len(entries) == 0:
+                print(f"{font}: no page on the cache, skipping")
+                continue
+
+            benchmark_site(font, cache.get(*entries[-1]), args.repeat)
+    else:
+        for font in SITES:
+            path = os.path.join(args.snapshots, f'{font.lower()}.html')
+            if not os.path.exists(path):
+                print(f"{font}: no snapshot at {path}, skipping")
+                continue
+
+            with open(path, encoding='utf-8') as f:
+                benchmark_site(font, f.read(), args.repeat)
@@ -0,0 +1,229 @@
+"""Benchmark of the stages of the scraping, without a browser or network
+
+Runs on the HTML fixtures of benchmarks/fixtures.py, for each website and
+variant (small, huge):
+
+    parse      NewsScraper._get_scraped_rows on the page_source
+    cleaning   NewsScraper._data_cleaning of the parsed news
+    save       application.save_output of one run, into the store and the
+               CSV, over synthetic histories of growing size
+    fetch      NewsScraper.scrap_page_http against a local server standing
+               in for the website, following the pagination
+
+Each measure is the best time of --repeat runs and the peak memory traced
+on one more run. The results are saved as JSON in benchmarks/results, and
+compared with a previous file with --compare:
+
+    python benchmarks/pipeline_benchmark.py
+    python benchmarks/pipeline_benchmark.py --compare benchmarks/results/<previous>.json
+"""
+from datetime import datetime, timedelta
+from time import perf_counter
+import argparse
+import dataclasses
+import json
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from fixtures import LocalSites, VARIANTS, load_fixture
+from src import http_fetch
+from src.metrics import Metrics
+from src.scrapers import NewsScraper
+from src.sites import SITES
+from src.store import NewsStore
+
+# application.py imports the modules of src directly, as when it runs as a script
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+import application
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'results')
+
+# words of the synthetic titles
+VOCABULARY = 5000
+TITLE_WORDS = 10
+
+
+class FixtureDriver():
+    """Stands in for the webdriver after the scrolls, giving a saved page_source"""
+
+    def __init__(self, page_source: str):
+        self.page_source = page_source
+
+
+def measure(function, repeat: int) -> dict:
+    """Best time in seconds and peak memory in MB of a function, with the size of its result"""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        times.append(perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'peak_mb': peak / 2**20, 'news': len(result)}
+
+
+def synthetic_history(n_news: int, seed: int = 0) -> pd.DataFrame:
+    """A dataset of n_news distinct news, spread over the last days
+
+    The titles are random words of a vocabulary, so, as the real ones, only
+    a few share enough words to be clustered in the same story.
+    """
+    now = datetime.now()
+    fonts = list(SITES)
+    words = np.random.RandomState(seed).randint(0, VOCABULARY, size=(n_news, TITLE_WORDS))
+    return pd.DataFrame({
+        'Title': [' '.join(f'palavra{word}' for word in title) + f' {seed}-{i}' for i, title in enumerate(words)],
+        'Time': [now - timedelta(minutes=7 * i) for i in range(n_news)],
+        'Theme': 'Economia',
+        'Header': None,
+        'Resume': 'Resumo',
+        'Font': [fonts[i % len(fonts)] for i in range(n_news)],
+        'Highlighted': 0,
+        'Link': [f'https://example.com/{seed}/{i}' for i in range(n_news)],
+    })
+
+
+def benchmark_scraping(repeat: int) -> list[dict]:
+    """Parse and cleaning of each website and variant"""
+    results = []
+    for font, spec in SITES.items():
+        scraper = NewsScraper(spec=spec, metrics=Metrics())
+        page = spec.pages[0]
+
+        for variant in VARIANTS:
+            driver = FixtureDriver(load_fixture(font, variant))
+
+            parse = measure(lambda: scraper._get_scraped_rows(driver, page), repeat)
+            news_df = scraper.engine.build_dataframe(scraper._get_scraped_rows(driver, page))
+            cleaning = measure(lambda: scraper._data_cleaning(news_df.copy(), page), repeat)
+
+            results.append({'stage': 'parse', 'site': font, 'variant': variant, **parse})
+            results.append({'stage': 'cleaning', 'site': font, 'variant': variant, **cleaning})
+
+    return results
+
+
+def benchmark_save(histories: list[int], run_size: int, repeat: int) -> list[dict]:
+    """save_output of one run into the store and the CSV, over datasets of growing size"""
+    results = []
+    for n_history in histories:
+        with tempfile.TemporaryDirectory() as folder:
+            store = NewsStore(os.path.join(folder, 'store'))
+            history = synthetic_history(n_history)
+            if n_history > 0:
+                store.append(history)
+                history.to_csv(os.path.join(folder, 'news.csv'), index=False)
+
+            # the CSV dataset is written in the temporary folder
+            application._get_data_folder = lambda: folder
+
+            for output, output_store in [('store', store), ('csv', None)]:
+                # new news in each run, as in the real scraping
+                runs = iter(range(1, 2 * repeat + 2))
+
+                def save_run():
+                    news_df = synthetic_history(run_size, next(runs))
+                    application.save_output(news_df, output_store)
+                    return news_df
+
+                save = measure(save_run, repeat)
+                results.append({'stage': 'save', 'site': output, 'variant': f'history={n_history}', **save})
+
+    return results
+
+
+def benchmark_fetch(n_pages: int, repeat: int) -> list[dict]:
+    """HTTP scraping of each website from the local server, following n_pages pages"""
+    results = []
+    with LocalSites(n_pages) as local_sites:
+        session = http_fetch.create_session()
+        for font, spec in SITES.items():
+            scraper = NewsScraper(n_scrolls=n_pages, spec=dataclasses.replace(spec, url=local_sites.url(font)),
+                                  metrics=Metrics())
+            page = spec.pages[0]
+
+            fetch = measure(lambda: scraper.scrap_page_http(session, page), repeat)
+            results.append({'stage': 'fetch', 'site': font, 'variant': f'pages={n_pages + 1}', **fetch})
+
+    return results
+
+
+def _key(result: dict) -> tuple:
+    return result['stage'], result['site'], result['variant']
+
+
+def compare(results: list[dict], previous_path: str, tolerance: float):
+    """Print the change of each measure from a previous results file, flagging the regressions"""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = {_key(result): result for result in json.load(f)['results']}
+
+    print(f"\nCompared with {previous_path}")
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+
+        ratio = result['seconds'] / before['seconds']
+        flag = '  REGRESSION' if ratio > tolerance else ''
+        print(f"  {' '.join(_key(result)):40} {before['seconds'] * 1000:9.1f} -> {result['seconds'] * 1000:9.1f} ms"
+              f"  {ratio:5.2f}x{flag}")
+
+
+def save_results(results: list[dict], folder: str = RESULTS_PATH) -> str:
+    """Write the results with the commit they measure"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'time': datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'results': results}, f, indent=1)
+
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the scraping on local fixtures')
+    parser.add_argument('--stages', nargs='*', choices=['scraping', 'save', 'fetch'], default=['scraping', 'save', 'fetch'],
+                        help='stages to benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs of each measure')
+    parser.add_argument('--histories', type=int, nargs='*', default=[0, 10000, 50000],
+                        help='number of news already on the dataset, for the save stage')
+    parser.add_argument('--run-size', type=int, default=600, help='number of news saved by each run')
+    parser.add_argument('--pages', type=int, default=50, help='pagination pages followed by the fetch stage')
+    parser.add_argument('--compare', default=None, help='previous results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='slowdown ratio flagged as a regression')
+    args = parser.parse_args()
+
+    # the scrapers log every page
+    logging.disable(logging.INFO)
+
+    results = []
+    if 'scraping' in args.stages:
+        results += benchmark_scraping(args.repeat)
+    if 'save' in args.stages:
+        results += benchmark_save(args.histories, args.run_size, args.repeat)
+    if 'fetch' in args.stages:
+        results += benchmark_fetch(args.pages, args.repeat)
+
+    for result in results:
+        print(f"{' '.join(_key(result)):40} {result['seconds'] * 1000:9.1f} ms {result['peak_mb']:8.1f} MB peak"
+              f"  {result['news']} news")
+
+    print(f"\nResults saved on {save_results(results)}")
+
+    if args.compare is not None:
+        compare(results, args.compare, args.tolerance)
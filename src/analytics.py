@@ -0,0 +1,295 @@
+import pandas as pd
+from collections import Counter
+import argparse
+import json
+import re
+import sqlite3
+import threading
+import os
+import logging
+
+import src.logging_config
+from src.dedup_index import title_hash
+logger = logging.getLogger(__name__)
+
+# the stopwords of the word clouds of notebooks/data_analysis.ipynb
+PORTUGUESE_STOPWORDS = frozenset({
+    'de', 'a', 'o', 'que', 'e', 'do', 'da', 'em', 'um', 'para', 'com',
+    'não', 'uma', 'os', 'no', 'se', 'na', 'por', 'mais', 'as', 'dos',
+    'como', 'mas', 'foi', 'ao', 'ele', 'das', 'tem', 'à', 'seu', 'sua',
+    'ou', 'ser', 'quando', 'muito', 'há', 'nos', 'já', 'está', 'eu',
+    'também', 'só', 'pelo', 'pela', 'até', 'isso', 'ela', 'entre', 'era',
+    'depois', 'sem', 'mesmo', 'aos', 'ter', 'seus', 'quem', 'nas', 'me',
+    'esse', 'eles', 'estão', 'você', 'tinha', 'foram', 'essa', 'num',
+    'nem', 'suas', 'meu', 'às', 'minha', 'têm', 'numa', 'pelos', 'elas',
+    'havia', 'seja', 'qual', 'será', 'nós', 'tenho', 'lhe', 'deles',
+    'essas', 'esses', 'pelas', 'este', 'fosse', 'dele', 'tu', 'te',
+    'vocês', 'vos', 'lhes', 'meus', 'minhas', 'teu', 'tua', 'teus',
+    'tuas', 'nosso', 'nossa', 'nossos', 'nossas', 'dela', 'delas',
+    'esta', 'estes', 'estas', 'aquele', 'aquela', 'aqueles', 'aquelas',
+    'isto', 'aquilo', 'estou', 'estamos', 'estive', 'esteve', 'estivemos',
+    'estiveram', 'estava', 'estávamos', 'estavam', 'estivera', 'estivéramos',
+    'esteja', 'estejamos', 'estejam', 'estivesse', 'estivéssemos',
+    'estivessem', 'estiver', 'estivermos', 'estiverem', 'hei', 'havemos',
+    'hão', 'houve', 'houvemos', 'houveram', 'houvera', 'houvéramos', 'haja',
+    'hajamos', 'hajam', 'houvesse', 'houvéssemos', 'houvessem', 'houver',
+    'houvermos', 'houverem', 'houverei', 'houverá', 'houveremos', 'houverão',
+    'houveria', 'houveríamos', 'houveriam', 'sou', 'somos', 'são', 'éramos',
+    'eram', 'fui', 'fomos', 'fora', 'fôramos', 'sejamos', 'sejam',
+    'fôssemos', 'fossem', 'for', 'formos', 'forem', 'serei', 'seremos',
+    'serão', 'seria', 'seríamos', 'seriam', 'temos', 'tém', 'tínhamos',
+    'tinham', 'tive', 'teve', 'tivemos', 'tiveram', 'tivera', 'tivéramos',
+    'tenha', 'tenhamos', 'tenham', 'tivesse', 'tivéssemos', 'tivessem',
+    'tiver', 'tivermos', 'tiverem', 'terei', 'terá', 'teremos', 'terão',
+    'teria', 'teríamos', 'teriam', 'diz', 'é', 'após', 'sobre', 'veja',
+    'entenda', 'r', 'alta', 'ano', 'anos', 'x',
+})
+
+# words, keeping the hyphenated ones like sexta-feira together
+TOKEN = re.compile(r'\w+(?:-\w+)*')
+
+
+def tokenize(title: str) -> list[str]:
+    """Words of a title for the word clouds, in lower case and without the stopwords and numbers"""
+    return [
+        token for token in TOKEN.findall(title.casefold())
+        if token not in PORTUGUESE_STOPWORDS and not token.isdigit()
+    ]
+
+
+def default_analytics_path() -> str:
+    """Path of the analytics tables of the news store"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'store', '_analytics.sqlite')
+
+
+class AnalyticsIndex():
+    """Pre-aggregated tables of the news, updated incrementally
+
+    Each new news of the store adds to the number of news of its day and
+    font, and to the frequency of the words of its title on that day and
+    font. A dashboard or a word cloud of any date range sums these small
+    tables, instead of reading and tokenizing the whole dataset.
+
+    The tokens of each title are cached, keyed like the DedupIndex by font
+    and title hash, so a rebuild does not tokenize the titles again.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = default_analytics_path() if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS daily_counts (
+                    day TEXT NOT NULL,
+                    font TEXT NOT NULL,
+                    n_news INTEGER NOT NULL,
+                    n_highlighted INTEGER NOT NULL,
+                    PRIMARY KEY (day, font)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS daily_tokens (
+                    day TEXT NOT NULL,
+                    font TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (day, font, token)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS title_tokens (
+                    font TEXT NOT NULL,
+                    title_hash INTEGER NOT NULL,
+                    tokens TEXT NOT NULL,
+                    PRIMARY KEY (font, title_hash)
+                ) WITHOUT ROWID
+            ''')
+
+
+    def __len__(self) -> int:
+        """Number of news aggregated"""
+        with self._lock:
+            return self._connection.execute('SELECT COALESCE(SUM(n_news), 0) FROM daily_counts').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def _cached_tokens(self, keys: list[tuple]) -> dict:
+        """Tokens of the (font, title hash) keys already tokenized"""
+        with self._lock:
+            rows = self._connection.execute('''
+                SELECT font, title_hash, tokens FROM title_tokens
+                WHERE (font, title_hash) IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]')
+                                             FROM json_each(?))
+            ''', (json.dumps(list(set(keys))),)).fetchall()
+        return {(font, key): tokens.split(' ') if tokens else [] for font, key, tokens in rows}
+
+
+    def add(self, news_df: pd.DataFrame, days: pd.Series):
+        """Aggregate new news
+
+        Parameters
+        ----------
+        news_df : pd.DataFrame
+            News not aggregated yet, with the Title, Font and Highlighted columns
+        days : pd.Series
+            Day of each news, in YYYY-MM-DD format, as the partitions of the store
+        """
+        if len(news_df) == 0:
+            return
+
+        keys = [(font, title_hash(title)) for title, font in zip(news_df['Title'], news_df['Font'])]
+        cached = self._cached_tokens(keys)
+
+        news_counts = Counter()
+        highlighted_counts = Counter()
+        token_counts = Counter()
+        new_tokens = {}
+
+        for key, title, day, highlighted in zip(keys, news_df['Title'], days, news_df['Highlighted'].fillna(0)):
+            font = key[0]
+            tokens = cached.get(key)
+            if tokens is None:
+                tokens = new_tokens.setdefault(key, tokenize(title))
+
+            news_counts[day, font] += 1
+            highlighted_counts[day, font] += int(highlighted > 0)
+            for token in tokens:
+                token_counts[day, font, token] += 1
+
+        with self._lock, self._connection:
+            self._connection.executemany('''
+                INSERT INTO daily_counts (day, font, n_news, n_highlighted) VALUES (?, ?, ?, ?)
+                ON CONFLICT (day, font) DO UPDATE SET
+                    n_news = n_news + excluded.n_news,
+                    n_highlighted = n_highlighted + excluded.n_highlighted
+            ''', [(day, font, n_news, highlighted_counts[day, font]) for (day, font), n_news in news_counts.items()])
+            self._connection.executemany('''
+                INSERT INTO daily_tokens (day, font, token, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT (day, font, token) DO UPDATE SET count = count + excluded.count
+            ''', [(*key, count) for key, count in token_counts.items()])
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO title_tokens (font, title_hash, tokens) VALUES (?, ?, ?)',
+                [(*key, ' '.join(tokens)) for key, tokens in new_tokens.items()]
+            )
+
+
+    @staticmethod
+    def _filters(start_date: str, end_date: str, fonts: list[str]) -> tuple[str, list]:
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append('day >= ?')
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append('day <= ?')
+            params.append(end_date)
+        if fonts is not None:
+            conditions.append('font IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(fonts)))
+
+        return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+
+    def daily_counts(self, start_date: str = None, end_date: str = None, fonts: list[str] = None) -> pd.DataFrame:
+        """Number of news and of highlights of each day and font
+
+        Parameters
+        ----------
+        start_date : str, optional
+            First day, in YYYY-MM-DD format
+        end_date : str, optional
+            Last day, in YYYY-MM-DD format
+        fonts : list[str], optional
+            Fonts to count, by default all
+
+        Returns
+        -------
+        pd.DataFrame
+            The columns Date, Font, News and Highlighted
+        """
+        where, params = self._filters(start_date, end_date, fonts)
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT day, font, n_news, n_highlighted FROM daily_counts {where} ORDER BY day, font', params
+            ).fetchall()
+
+        counts_df = pd.DataFrame(rows, columns=['Date', 'Font', 'News', 'Highlighted'])
+        counts_df['Date'] = pd.to_datetime(counts_df['Date']).dt.date
+        return counts_df
+
+
+    def token_frequencies(self, start_date: str = None, end_date: str = None, fonts: list[str] = None,
+                          top: int = None) -> pd.Series:
+        """Frequency of the words of the titles over a date range, the most frequent first
+
+        The result can be given to WordCloud.generate_from_frequencies.
+
+        Parameters
+        ----------
+        start_date : str, optional
+            First day, in YYYY-MM-DD format
+        end_date : str, optional
+            Last day, in YYYY-MM-DD format
+        fonts : list[str], optional
+            Fonts to count, by default all
+        top : int, optional
+            Number of words returned, by default all
+        """
+        where, params = self._filters(start_date, end_date, fonts)
+        query = f'SELECT token, SUM(count) AS total FROM daily_tokens {where} GROUP BY token ORDER BY total DESC, token'
+        if top is not None:
+            query += ' LIMIT ?'
+            params.append(top)
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+
+        return pd.Series(dict(rows), dtype='int64', name='Frequency')
+
+
+    def tokens(self, news_df: pd.DataFrame) -> pd.Series:
+        """Tokens of the titles of news, from the cache when available"""
+        keys = [(font, title_hash(title)) for title, font in zip(news_df['Title'], news_df['Font'])]
+        cached = self._cached_tokens(keys)
+        return pd.Series(
+            [cached[key] if key in cached else tokenize(title) for key, title in zip(keys, news_df['Title'])],
+            index=news_df.index, dtype=object
+        )
+
+
+    def rebuild(self, news_df: pd.DataFrame, days: pd.Series):
+        """Aggregate again a whole dataset, keeping the cache of the tokens"""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM daily_counts')
+            self._connection.execute('DELETE FROM daily_tokens')
+
+        self.add(news_df, days)
+        logger.info(f"Aggregated {len(news_df)} news on {self.path}")
+
+
+if __name__ == '__main__':
+    from src.store import NewsStore
+
+    parser = argparse.ArgumentParser(description='Summaries of the news of the store from the pre-aggregated tables')
+    parser.add_argument('command', choices=['rebuild', 'counts', 'words'])
+    parser.add_argument('--root', default=None, help='folder of the store, by default data/store')
+    parser.add_argument('--start-date', default=None, help='first day, in YYYY-MM-DD format')
+    parser.add_argument('--end-date', default=None, help='last day, in YYYY-MM-DD format')
+    parser.add_argument('--fonts', nargs='*', default=None, help='websites to summarize, by default all')
+    parser.add_argument('--top', type=int, default=30, help='number of words of the words command')
+    args = parser.parse_args()
+
+    store = NewsStore(args.root)
+    if args.command == 'rebuild':
+        store.rebuild_analytics()
+    elif args.command == 'counts':
+        print(store.analytics.daily_counts(args.start_date, args.end_date, args.fonts).to_string(index=False))
+    else:
+        print(store.analytics.token_frequencies(args.start_date, args.end_date, args.fonts, args.top).to_string())
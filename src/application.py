@@ -1,23 +1,85 @@
 from selenium import webdriver
-from selenium.webdriver.firefox.service import Service
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import pandas as pd
+import argparse
+import contextlib
+import functools
+import threading
 import os
 import logging
 
 import scrapers
+import sites
+import drivers
+import http_fetch
+from store import NewsStore
+from html_cache import HtmlCache
+from metrics import Metrics
+from records import BatchWriter
+from enrichment import Enricher
+from search import SearchIndex
+from change_detection import ChangeDetector
+from scheduler import SiteScheduler
 
 import src.logging_config
 logger = logging.getLogger('application')
 
 
-def scrap_websites(driver: webdriver) -> pd.DataFrame:
-    """Scrap the news for the given websites"""
+def _get_data_folder() -> str:
+    """Path of the data folder, created if it does not exist"""
+    # Get the directory of the current file (application.py)
+    current_dir = os.path.dirname(__file__)
+
+    # Construct the path to the data folder
+    data_folder = os.path.join(current_dir, '..', 'data')
+
+    # Ensure the data folder exists
+    os.makedirs(data_folder, exist_ok=True)
+    
+    return data_folder
+
+
+def load_known_titles(store: NewsStore = None) -> dict:
+    """Titles already on the dataset, as a set for each font"""
+    if store is not None:
+        return {font: store.known_titles(font) for font in sites.SITES}
+    
+    csv_file_path = os.path.join(_get_data_folder(), 'news.csv')
+    if not os.path.exists(csv_file_path):
+        return {}
+    
+    # only the key columns are needed
+    keys_df = pd.read_csv(csv_file_path, usecols=['Title', 'Font'])
+    keys_df['Title'] = keys_df['Title'].str.strip()
+    
+    return {font: set(titles) for font, titles in keys_df.groupby('Font')['Title']}
+
+
+def _get_scrapers(known_titles: dict = None, stop_fraction: float = 0.8, cache: HtmlCache = None,
+                  metrics: Metrics = None) -> dict:
+    """The scrapers of each website in sites.SITES, indexed by the font name
+
+    With known_titles, the scrapers run in incremental mode, stopping the
+    scroll when the news are already on the dataset. With a cache, the HTML
+    of the pages is kept to be parsed again offline. With metrics, the
+    stages of the scraping are timed on it.
+    """
+    if known_titles is None:
+        return {font: scrapers.NewsScraper(spec=spec, cache=cache, metrics=metrics) for font, spec in sites.SITES.items()}
     
-    scraper_dict = {
-        'G1': scrapers.G1NewsScraper(),
-        'CNN': scrapers.CNNNewsScraper(),
-        'UOL': scrapers.UolNewsScraper()
+    return {
+        font: scrapers.NewsScraper(known_titles=known_titles.get(font, set()), stop_fraction=stop_fraction,
+                                   spec=spec, cache=cache, metrics=metrics)
+        for font, spec in sites.SITES.items()
     }
+
+
+def scrap_websites(driver: webdriver, known_titles: dict = None, stop_fraction: float = 0.8,
+                   cache: HtmlCache = None, metrics: Metrics = None) -> pd.DataFrame:
+    """Scrap the news for the given websites"""
+    
+    scraper_dict = _get_scrapers(known_titles, stop_fraction, cache, metrics)
     
     scraped_news_dfs = []
 
@@ -37,20 +99,229 @@ def scrap_websites(driver: webdriver) -> pd.DataFrame:
     return news_df
 
 
-def save_output(news_df: pd.DataFrame):
-    """ save on memory, appending the results to the anterior data saved
+def _scrap_with_pool(pool: drivers.DriverPool, scrap, *args) -> pd.DataFrame:
+    """Run one scraping function with a driver borrowed from the pool"""
+    with pool.driver() as driver:
+        return scrap(driver, *args)
+
+
+def scrap_websites_parallel(pool: drivers.DriverPool, known_titles: dict = None,
+                            stop_fraction: float = 0.8, cache: HtmlCache = None,
+                            metrics: Metrics = None) -> pd.DataFrame:
+    """Scrap the news for the given websites, each page on its own driver
+
+    The subpages of a website, like the CNN themes, are split in separate
+    tasks, so they also run in parallel. The resulting dataframe is the
+    same as the one of scrap_websites.
     """
-    # Get the directory of the current file (application.py)
-    current_dir = os.path.dirname(__file__)
+    
+    scraper_dict = _get_scrapers(known_titles, stop_fraction, cache, metrics)
+    
+    logger.info(f"Scraping websites {' '.join(scraper_dict.keys())} with {pool.size} drivers")
+    
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        # submit all the pages at once, keeping the order of the websites
+        futures = {
+            font: [(page, executor.submit(_scrap_with_pool, pool, scraper.scrap_page, page))
+                   for page in scraper.pages]
+            for font, scraper in scraper_dict.items()
+        }
+        
+        scraped_news_dfs = []
+        for font, page_futures in futures.items():
+            scraper = scraper_dict[font]
+            try:
+                page_dfs = []
+                for page, page_future in page_futures:
+                    try:
+                        page_dfs.append(page_future.result())
+                    except Exception as e:
+                        logger.error(f"Error scraping {scraper.url}{page}: {e}")
+                
+                news_df = scraper.merge_pages(page_dfs)
+                news_df['Font'] = font
+                scraped_news_dfs.append(news_df)
+            except Exception as e:
+                logger.error(f"Error on scraping {font}: {e}")
+    
+    # create one dataframe with all the data
+    news_df = pd.concat(scraped_news_dfs, axis='rows', join='outer', ignore_index=True)
+    logger.info(f"Scraped all websites. Total news {len(news_df)}")
+    return news_df
 
-    # Construct the path to the data folder
-    data_folder = os.path.join(current_dir, '..', 'data')
 
-    # Ensure the data folder exists
-    os.makedirs(data_folder, exist_ok=True)
+def scrap_websites_http(session, pool: drivers.DriverPool = None, known_titles: dict = None,
+                        stop_fraction: float = 0.8, cache: HtmlCache = None,
+                        metrics: Metrics = None) -> pd.DataFrame:
+    """Scrap the news for the given websites over plain HTTP, without a browser
+
+    When the HTTP scraping of a website fails and a pool is given, that
+    website is scraped with a webdriver instead, as are the websites whose
+    'load more' can not be followed over HTTP. The drivers of the pool are
+    only started if needed.
+    """
+    
+    scraper_dict = _get_scrapers(known_titles, stop_fraction, cache, metrics)
+    
+    scraped_news_dfs = []
+
+    logger.info(f"Scraping websites {' '.join(scraper_dict.keys())} over HTTP")
+    for font, scraper in scraper_dict.items():
+        try:
+            try:
+                if pool is not None and not scraper.spec.http_pagination:
+                    # over HTTP only the first page of the feed
+                    news_df = _scrap_with_pool(pool, scraper.scrap_news)
+                else:
+                    news_df = scraper.scrap_news_http(session)
+            except Exception as e:
+                if pool is None:
+                    raise
+                
+                logger.warning(f"HTTP scraping of {font} failed, falling back to the webdriver: {e}")
+                news_df = _scrap_with_pool(pool, scraper.scrap_news)
+            
+            news_df['Font'] = font
+            scraped_news_dfs.append(news_df)
+        except Exception as e:
+            logger.error(f"Error on scraping {font}: {e}")
+    
+    # create one dataframe with all the data
+    news_df = pd.concat(scraped_news_dfs, axis='rows', join='outer', ignore_index=True)
+    logger.info(f"Scraped all websites. Total news {len(news_df)}")
+    return news_df
+
+
+def stream_websites(writer: BatchWriter, driver: webdriver, known_titles: dict = None, stop_fraction: float = 0.8,
+                    cache: HtmlCache = None, metrics: Metrics = None) -> int:
+    """Scrap the news for the given websites, writing them as each page is parsed
+
+    The streaming version of scrap_websites: the news of a page go to the
+    writer before the next page is loaded, so a failure keeps the news
+    already scraped. Returns the number of news scraped.
+    """
+    
+    scraper_dict = _get_scrapers(known_titles, stop_fraction, cache, metrics)
+    
+    n_news = 0
+
+    logger.info(f"Scraping websites {' '.join(scraper_dict.keys())}")
+    for font, scraper in scraper_dict.items():
+        try:
+            n_news += writer.write_all(scraper.iter_news(driver))
+        except Exception as e:
+            logger.error(f"Error on scraping {font}: {e}")
+    
+    logger.info(f"Scraped all websites. Total news {n_news}")
+    return n_news
+
+
+def stream_websites_parallel(writer: BatchWriter, pool: drivers.DriverPool, known_titles: dict = None,
+                             stop_fraction: float = 0.8, cache: HtmlCache = None, metrics: Metrics = None) -> int:
+    """Scrap the news for the given websites, each page on its own driver, writing the pages in their order
+
+    The pages are written in the order of the websites and their pages, not
+    as they finish, so the ranks of the timeline follow the front pages.
+    """
+    
+    scraper_dict = _get_scrapers(known_titles, stop_fraction, cache, metrics)
+    
+    logger.info(f"Scraping websites {' '.join(scraper_dict.keys())} with {pool.size} drivers")
+    
+    n_news = 0
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {
+            executor.submit(_scrap_with_pool, pool, scraper.scrap_page_articles, page): f'{scraper.url}{page}'
+            for scraper in scraper_dict.values() for page in scraper.pages
+        }
+        
+        # the writer is only used from this thread, in the order the pages were submitted
+        for future in futures:
+            try:
+                n_news += writer.write_all(future.result())
+            except Exception as e:
+                logger.error(f"Error scraping {futures[future]}: {e}")
+    
+    logger.info(f"Scraped all websites. Total news {n_news}")
+    return n_news
+
+
+def stream_websites_http(writer: BatchWriter, session, pool: drivers.DriverPool = None, known_titles: dict = None,
+                         stop_fraction: float = 0.8, cache: HtmlCache = None, metrics: Metrics = None) -> int:
+    """Scrap the news for the given websites over plain HTTP, writing them as each page is parsed
+
+    As in scrap_websites_http, a website whose pages all fail over HTTP, or
+    whose 'load more' can not be followed, is scraped with a webdriver of
+    the pool, if given.
+    """
+    
+    scraper_dict = _get_scrapers(known_titles, stop_fraction, cache, metrics)
+    
+    n_news = 0
+
+    logger.info(f"Scraping websites {' '.join(scraper_dict.keys())} over HTTP")
+    for font, scraper in scraper_dict.items():
+        try:
+            try:
+                if pool is not None and not scraper.spec.http_pagination:
+                    n_news += writer.write_all(_scrap_with_pool(pool, lambda driver: list(scraper.iter_news(driver))))
+                else:
+                    n_news += writer.write_all(scraper.iter_news_http(session))
+            except Exception as e:
+                if pool is None:
+                    raise
+                
+                logger.warning(f"HTTP scraping of {font} failed, falling back to the webdriver: {e}")
+                n_news += writer.write_all(_scrap_with_pool(pool, lambda driver: list(scraper.iter_news(driver))))
+        except Exception as e:
+            logger.error(f"Error on scraping {font}: {e}")
+    
+    logger.info(f"Scraped all websites. Total news {n_news}")
+    return n_news
+
+
+def open_store() -> NewsStore:
+    """Open the news store, importing data/news.csv on the first use"""
+    store = NewsStore()
+    
+    csv_file_path = os.path.join(_get_data_folder(), 'news.csv')
+    if store.is_empty() and os.path.exists(csv_file_path):
+        store.import_csv(csv_file_path)
+    
+    return store
+
+
+def save_output(news_df: pd.DataFrame, store: NewsStore = None, metrics: Metrics = None, enricher: Enricher = None,
+                timeline: bool = True):
+    """ save on memory, appending the results to the anterior data saved
+    
+    With a store, the news are appended as new partitions, without reading
+    the data already saved. Otherwise the whole CSV dataset is rewritten.
+    The new and duplicated news of each website are counted on metrics.
+    With an enricher, the article pages are downloaded first, giving the
+    news their exact publish time. Without timeline, the positions of the
+    news are left for the caller to observe.
+    """
+    metrics = Metrics() if metrics is None else metrics
+    
+    if enricher is not None:
+        with metrics.timer('enrich'):
+            news_df = enricher.enrich(news_df)
+    
+    with metrics.timer('save'):
+        _save_output(news_df, store, metrics, timeline)
+
 
+def _save_output(news_df: pd.DataFrame, store: NewsStore, metrics: Metrics, timeline: bool = True):
+    if store is not None:
+        for font, font_df in news_df.groupby('Font', sort=False):
+            n_new = store.append(font_df, timeline=timeline)
+            metrics.count('news_new', n_new, site=font)
+            metrics.count('news_duplicated', len(font_df) - n_new, site=font)
+        return
+    
     # Define the path for the CSV file
-    csv_file_path = os.path.join(data_folder, 'news.csv')
+    csv_file_path = os.path.join(_get_data_folder(), 'news.csv')
     
     # if the file already exists, merge dropping the duplicates
     if os.path.exists(csv_file_path):
@@ -60,38 +331,356 @@ def save_output(news_df: pd.DataFrame):
         # Merge the existing data with the new data
         combined_df = pd.concat([existing_df, news_df])
         
-        duplicated_news = combined_df.duplicated(subset=['Title', 'Font']).sum()
+        duplicated = combined_df.duplicated(subset=['Title', 'Font'])
+        duplicated_news = duplicated.sum()
         
         combined_df = combined_df.drop_duplicates(subset=['Title', 'Font'], keep='last')
         
         logger.info(f"{duplicated_news} news are already present on the dataset")
+        
+        # the duplicated flag is on the second occurrence, so on the news of the run
+        run_duplicated = duplicated.iloc[len(existing_df):].to_numpy()
     else:
         combined_df = news_df
+        run_duplicated = news_df.duplicated(subset=['Title', 'Font']).to_numpy()
+    
+    for font, font_duplicated in pd.Series(run_duplicated).groupby(news_df['Font'].to_numpy()):
+        metrics.count('news_new', int((~font_duplicated).sum()), site=font)
+        metrics.count('news_duplicated', int(font_duplicated.sum()), site=font)
 
     # Save the combined DataFrame to the CSV file
     combined_df.to_csv(csv_file_path, index=False)
     
+    # the news already indexed are skipped, and the history of the CSV is indexed on the first use
+    search_index = SearchIndex()
+    if len(search_index) == 0:
+        search_index.rebuild(combined_df)
+    else:
+        search_index.add(news_df)
+    
     logger.info(f"Sucess saving scraped data on {csv_file_path}")
 
 
-def main():
+def _scrap_and_write(scrap, stream, store: NewsStore, metrics: Metrics, enricher: Enricher, *args):
+    """Stream the news to the store as they are scraped, or rewrite the CSV with all of them"""
+    if store is None:
+        news_df = scrap(*args, metrics=metrics)
+        save_output(news_df, store, metrics, enricher)
+        return
+    
+    with BatchWriter(store, metrics=metrics, enricher=enricher) as writer:
+        stream(writer, *args, metrics=metrics)
+
+
+def _scrap_and_save(n_drivers: int, known_titles: dict, stop_fraction: float, fetch: str, store: NewsStore,
+                    cache: HtmlCache, metrics: Metrics, enricher: Enricher = None, headless: bool = True,
+                    max_memory_mb: float = None):
+    """Scrap all the websites with the chosen fetching, and save the results"""
+    driver_factory = functools.partial(drivers.create_firefox_driver, headless=headless)
+    
+    if fetch in ('http', 'auto'):
+        session = http_fetch.create_session()
+        # the pool only starts browsers if some website needs the fallback
+        with drivers.DriverPool(size=n_drivers, driver_factory=driver_factory, max_memory_mb=max_memory_mb) as pool:
+            _scrap_and_write(scrap_websites_http, stream_websites_http, store, metrics, enricher,
+                             session, pool if fetch == 'auto' else None, known_titles, stop_fraction, cache)
+        return
+    
+    # with a memory limit, the pages are scraped one by one on the pool, so the browser can be restarted between them
+    if n_drivers > 1 or max_memory_mb is not None:
+        with drivers.DriverPool(size=n_drivers, driver_factory=driver_factory, max_memory_mb=max_memory_mb) as pool:
+            _scrap_and_write(scrap_websites_parallel, stream_websites_parallel, store, metrics, enricher,
+                             pool, known_titles, stop_fraction, cache)
+        return
+    
     # create the web driver
-    GECKODRIVER_PATH = '/snap/bin/firefox.geckodriver'
-    s = Service(executable_path=GECKODRIVER_PATH)
-    # opens a window
-    logger.info("Starting webdriver")
-    driver = webdriver.Firefox(service=s)
+    driver = driver_factory()
     
     try:
         # main routine for scraping
-        news_df = scrap_websites(driver)
-        
-        save_output(news_df)
+        _scrap_and_write(scrap_websites, stream_websites, store, metrics, enricher,
+                         driver, known_titles, stop_fraction, cache)
     finally:
         # assures the window is closed
         driver.quit()
         
     logger.info('Closed driver')
 
+
+def _any_page_changed(detector: ChangeDetector, metrics: Metrics) -> bool:
+    """Check the subpages of all the websites, whether any changed since the last check"""
+    session = http_fetch.create_session()
+    changed = [detector.changed_pages(scraper, session, metrics) for scraper in _get_scrapers(metrics=metrics).values()]
+    return any(len(pages) > 0 for pages in changed)
+
+
+def main(n_drivers: int = 1, incremental: bool = False, stop_fraction: float = 0.8, fetch: str = 'browser',
+         output: str = 'store', use_cache: bool = True, prometheus_file: str = None, enrich: bool = False,
+         headless: bool = True, max_memory_mb: float = 1500, skip_unchanged: bool = False):
+    """Scrap all the websites and save the results
+
+    Parameters
+    ----------
+    n_drivers : int, optional
+        Number of webdrivers to use. With more than one, the pages are
+        scraped in parallel, by default 1
+    incremental : bool, optional
+        Stop scrolling each page when the news are already on the dataset,
+        by default False
+    stop_fraction : float, optional
+        In incremental mode, fraction of known news in a scroll to stop, by default 0.8
+    fetch : str, optional
+        How to get the pages: 'browser' uses the webdrivers, 'http' only plain
+        HTTP requests, and 'auto' HTTP with the webdrivers as fallback, by default 'browser'
+    output : str, optional
+        Where to save the news: 'store' appends to the Parquet store, 'csv'
+        rewrites data/news.csv, by default 'store'
+    use_cache : bool, optional
+        Keep the HTML of the pages on data/html_cache, to parse them again
+        with src/reparse.py, by default True
+    prometheus_file : str, optional
+        Also write the metrics of the run in the Prometheus text format on
+        this file, by default only the JSON lines on data/metrics
+    enrich : bool, optional
+        Download the pages of the new articles, keeping their body, author
+        and exact publish time on data/enriched, by default False
+    headless : bool, optional
+        Run the browsers without window, by default True
+    max_memory_mb : float, optional
+        Memory of a browser, with its tabs, to restart it before the next
+        page, by default 1500. None keeps one browser for all the pages
+    skip_unchanged : bool, optional
+        First check the subpages with conditional requests and a hash of
+        their top news, skipping the run when none changed, by default False
+    """
+    metrics = Metrics()
+    
+    store = open_store() if output == 'store' else None
+    cache = HtmlCache() if use_cache else None
+    enricher = Enricher() if enrich else None
+    
+    known_titles = load_known_titles(store) if incremental else None
+    
+    # the metrics are saved even when the run fails
+    try:
+        detector = ChangeDetector() if skip_unchanged else None
+        if detector is not None and not _any_page_changed(detector, metrics):
+            logger.info("No page changed since the last check, skipping the run")
+            return
+        
+        _scrap_and_save(n_drivers, known_titles, stop_fraction, fetch, store, cache, metrics, enricher,
+                        headless, max_memory_mb)
+        
+        # the pages are only saved as checked with their news, a failed run checks them again
+        if detector is not None:
+            detector.commit()
+    finally:
+        metrics.write_jsonl()
+        if prometheus_file is not None:
+            metrics.write_prometheus(prometheus_file)
+
+
+def _site_job(font: str, pool: drivers.DriverPool, store: NewsStore, cache: HtmlCache, incremental: bool,
+              stop_fraction: float, save_lock: threading.Lock, enricher: Enricher = None,
+              detector: ChangeDetector = None, interval: float = None, served_metrics: Metrics = None):
+    """One scraping of a website on the drivers of the pool, for the scheduler
+
+    With a detector, only the subpages changed since the last check are
+    scraped, and the job returns the time until the next one is due. Each
+    subpage is observed alone on the timeline, so the news of the pages
+    skipped stay on it. The metrics of each run replace the previous run
+    of the website on served_metrics, if given.
+    """
+    def job():
+        metrics = Metrics()
+        checked_urls = []
+        try:
+            known_titles = load_known_titles(store) if incremental else None
+            scraper = _get_scrapers(known_titles, stop_fraction, cache, metrics)[font]
+            
+            pages = scraper.pages
+            if detector is not None:
+                pages = detector.changed_pages(scraper, http_fetch.create_session(pool_size=1), metrics, interval)
+                checked_urls = [f'{scraper.url}{page}' for page in pages]
+                if len(pages) == 0:
+                    return detector.next_check(scraper, interval)
+            
+            page_dfs = []
+            scraped_pages = []
+            for page in pages:
+                try:
+                    page_dfs.append(_scrap_with_pool(pool, scraper.scrap_page, page))
+                    scraped_pages.append(page)
+                except Exception as e:
+                    logger.error(f"Error scraping {scraper.url}{page}: {e}")
+            
+            news_df = scraper.merge_pages(page_dfs)
+            news_df['Font'] = font
+            
+            # the articles of many websites can be enriched at the same time
+            if enricher is not None:
+                with metrics.timer('enrich'):
+                    news_df = enricher.enrich(news_df)
+            
+            # the websites finish at any time, but the dataset is written by one at a time
+            with save_lock:
+                save_output(news_df, store, metrics, timeline=False)
+            
+            if store is not None:
+                run_time = datetime.now()
+                for page, page_df in zip(scraped_pages, page_dfs):
+                    store.timeline.observe(page_df.assign(Font=font), run_time, page=page)
+            
+            if detector is None:
+                return None
+            # only the pages saved are checked, the failed ones are seen as changed on the next check
+            detector.commit([f'{scraper.url}{page}' for page in scraped_pages])
+            detector.discard(checked_urls)
+            return detector.next_check(scraper, interval)
+        except Exception:
+            if detector is not None:
+                detector.discard(checked_urls)
+            raise
+        finally:
+            metrics.write_jsonl()
+            if served_metrics is not None:
+                served_metrics.show_run(font, metrics)
+    
+    return job
+
+
+def run_daemon(n_drivers: int = 1, intervals: dict = None, default_interval: float = 600, jitter: float = 0.1,
+               max_pages: int = 50, max_memory_mb: float = 1500, incremental: bool = False,
+               stop_fraction: float = 0.8, output: str = 'store', use_cache: bool = True, enrich: bool = False,
+               headless: bool = True, skip_unchanged: bool = False, metrics_port: int = None):
+    """Scrap the websites periodically, keeping the webdrivers open between the runs
+
+    Each website is scheduled on its own interval, with its own pool of
+    warm drivers, so a slow website never holds the drivers of the others.
+    A driver is replaced by a new browser after max_pages pages or when it
+    uses more than max_memory_mb.
+
+    With skip_unchanged, each run first checks which subpages changed, and
+    the interval of each website follows how often its pages change,
+    starting from the one given.
+
+    With metrics_port, the metrics of the last run of each website are
+    served in the Prometheus format on http://localhost:metrics_port/metrics.
+
+    Parameters
+    ----------
+    n_drivers : int, optional
+        Number of webdrivers kept open for each website, by default 1
+    intervals : dict, optional
+        Seconds between two runs of each website, by default default_interval for all
+    default_interval : float, optional
+        Seconds between two runs of the websites not in intervals, by default 600
+    jitter : float, optional
+        Maximum random variation of the intervals, as a fraction, by default 0.1
+    max_pages : int, optional
+        Pages scraped by a driver before it is recycled, by default 50
+    max_memory_mb : float, optional
+        Memory of a browser, with its tabs, to recycle it, by default 1500
+    incremental : bool, optional
+        Stop scrolling each page when the news are already on the dataset,
+        by default False
+    stop_fraction : float, optional
+        In incremental mode, fraction of known news in a scroll to stop, by default 0.8
+    output : str, optional
+        Where to save the news: 'store' or 'csv', by default 'store'
+    use_cache : bool, optional
+        Keep the HTML of the pages on data/html_cache, by default True
+    enrich : bool, optional
+        Download the pages of the new articles, by default False
+    headless : bool, optional
+        Run the browsers without window, by default True
+    skip_unchanged : bool, optional
+        Scrape only the subpages changed since the last check, by default False
+    metrics_port : int, optional
+        Port serving the metrics for Prometheus, by default they are only on data/metrics
+    """
+    intervals = intervals or {}
+    store = open_store() if output == 'store' else None
+    cache = HtmlCache() if use_cache else None
+    enricher = Enricher() if enrich else None
+    save_lock = threading.Lock()
+    detector = ChangeDetector(initial_interval=default_interval) if skip_unchanged else None
+    served_metrics = None
+    if metrics_port is not None:
+        served_metrics = Metrics()
+        served_metrics.serve_prometheus(metrics_port)
+    
+    driver_factory = functools.partial(drivers.create_firefox_driver, headless=headless)
+    with contextlib.ExitStack() as stack:
+        jobs = {}
+        for font in sites.SITES:
+            pool = stack.enter_context(drivers.DriverPool(size=n_drivers, driver_factory=driver_factory,
+                                                          max_pages=max_pages, max_memory_mb=max_memory_mb))
+            pool.warm_up()
+            jobs[font] = _site_job(font, pool, store, cache, incremental, stop_fraction, save_lock, enricher,
+                                   detector, intervals.get(font, default_interval), served_metrics)
+        
+        SiteScheduler(jobs, intervals, jitter, default_interval).run()
+
+
+def _parse_intervals(values: list[str]) -> dict:
+    """The FONT=SECONDS values of the command line as a dict"""
+    intervals = {}
+    for value in values:
+        font, _, seconds = value.partition('=')
+        if font not in sites.SITES or not seconds:
+            raise argparse.ArgumentTypeError(f"Invalid interval {value}, expected FONT=SECONDS with FONT in {list(sites.SITES)}")
+        intervals[font] = float(seconds)
+    
+    return intervals
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Scrap the brazilian news websites')
+    parser.add_argument('--drivers', type=int, default=1,
+                        help='number of webdrivers to scrap the pages in parallel, for each website in daemon mode')
+    parser.add_argument('--incremental', action='store_true',
+                        help='stop scrolling when the news are already on the dataset')
+    parser.add_argument('--stop-fraction', type=float, default=0.8,
+                        help='fraction of known news in a scroll to stop, in incremental mode')
+    parser.add_argument('--fetch', choices=['browser', 'http', 'auto'], default='browser',
+                        help='get the pages with the webdriver, plain HTTP, or HTTP with webdriver fallback')
+    parser.add_argument('--output', choices=['store', 'csv'], default='store',
+                        help='append to the Parquet store or rewrite data/news.csv')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not keep the HTML of the pages on data/html_cache')
+    parser.add_argument('--prometheus-file', default=None,
+                        help='also write the metrics of the run in the Prometheus text format on this file')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve the metrics of the last run of each website for Prometheus, in daemon mode')
+    parser.add_argument('--enrich', action='store_true',
+                        help='download the pages of the new articles, for their body, author and exact time')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running, scraping each website periodically with warm webdrivers')
+    parser.add_argument('--interval', action='append', default=[], metavar='FONT=SECONDS',
+                        help='seconds between two runs of a website, in daemon mode')
+    parser.add_argument('--default-interval', type=float, default=600,
+                        help='seconds between two runs of the other websites, in daemon mode')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='maximum random variation of the intervals, as a fraction, in daemon mode')
+    parser.add_argument('--max-pages', type=int, default=50,
+                        help='pages scraped by a webdriver before it is restarted, in daemon mode')
+    parser.add_argument('--max-memory-mb', type=float, default=1500,
+                        help='memory of a browser to restart it before the next page')
+    parser.add_argument('--headed', action='store_true',
+                        help='show the window of the browsers, which run headless by default')
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help='check the pages first and scrape only the ones changed since the last check')
+    args = parser.parse_args()
+    
+    if args.daemon:
+        run_daemon(n_drivers=args.drivers, intervals=_parse_intervals(args.interval),
+                   default_interval=args.default_interval, jitter=args.jitter, max_pages=args.max_pages,
+                   max_memory_mb=args.max_memory_mb, incremental=args.incremental, stop_fraction=args.stop_fraction,
+                   output=args.output, use_cache=not args.no_cache, enrich=args.enrich, headless=not args.headed,
+                   skip_unchanged=args.skip_unchanged, metrics_port=args.metrics_port)
+    else:
+        main(n_drivers=args.drivers, incremental=args.incremental, stop_fraction=args.stop_fraction,
+             fetch=args.fetch, output=args.output, use_cache=not args.no_cache, prometheus_file=args.prometheus_file,
+             enrich=args.enrich, headless=not args.headed, max_memory_mb=args.max_memory_mb,
+             skip_unchanged=args.skip_unchanged)
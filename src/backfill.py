@@ -0,0 +1,242 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime
+import pandas as pd
+import argparse
+import os
+import logging
+
+import src.logging_config
+from src import http_fetch
+from src import wayback
+from src.extraction import ExtractionEngine
+from src.html_cache import HtmlCache
+from src.parsing import parse_html
+from src.sites import SITES
+from src.store import NewsStore
+logger = logging.getLogger(__name__)
+
+
+def default_checkpoint_path(font: str) -> str:
+    """Path of the checkpoint of a website inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'backfill', f'{font}.checkpoint')
+
+
+class Checkpoint():
+    """Snapshots already saved on the store, kept in a text file
+
+    Each line is the page and the timestamp of one snapshot. The lines are
+    only written after the news of the snapshot are on the store, so a
+    restarted backfill skips exactly the snapshots already saved.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = {tuple(line.rstrip('\n').split('\t')) for line in f if line.strip()}
+
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.done
+
+
+    def add(self, keys: list[tuple]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for page, timestamp in keys:
+                f.write(f'{page}\t{timestamp}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.done.update(keys)
+
+
+class Backfill():
+    """Scrape the archived front pages of a website into the news store
+
+    The snapshots of the period are enumerated with the CDX API, and each
+    archived page is downloaded over plain HTTP by a pool of workers and
+    parsed with the ExtractionEngine of the website. The relative times of
+    the news are resolved against the time of the snapshot.
+
+    The snapshots are saved in the order of their timestamps, and each one
+    is a run of its subpage on the timeline of the store.
+    """
+
+    def __init__(self, font: str, store: NewsStore = None, workers: int = 4, rate: float = 2.0,
+                 granularity: str = 'day', batch_size: int = 20, checkpoint_path: str = None,
+                 cdx_url: str = wayback.CDX_URL, snapshot_url: str = wayback.SNAPSHOT_URL,
+                 cache: HtmlCache = None):
+        """
+        Parameters
+        ----------
+        font : str
+            Website to backfill, one of the keys of sites.SITES
+        store : NewsStore, optional
+            Store receiving the news, by default the one in data/store
+        workers : int, optional
+            Number of pages downloaded at the same time, by default 4
+        rate : float, optional
+            Maximum number of downloads per second, by default 2.0
+        granularity : str, optional
+            Keep one snapshot per 'month', 'day', 'hour' or 'minute', by default 'day'
+        batch_size : int, optional
+            Number of snapshots written to the store at once, by default 20
+        checkpoint_path : str, optional
+            File of the snapshots already saved, by default one per website in data/backfill
+        cdx_url : str, optional
+            Address of the CDX API
+        snapshot_url : str, optional
+            Address of the archived pages
+        cache : HtmlCache, optional
+            If given, the archived pages are downloaded only once, even over many runs
+        """
+        self.font = font
+        self.engine = ExtractionEngine(SITES[font])
+        self.store = NewsStore() if store is None else store
+        self.workers = workers
+        self.granularity = granularity
+        self.batch_size = batch_size
+        self.checkpoint = Checkpoint(default_checkpoint_path(font) if checkpoint_path is None else checkpoint_path)
+        self.cdx_url = cdx_url
+        self.snapshot_url = snapshot_url
+        self.cache = cache
+
+        # the retries are done by get_with_backoff, respecting the rate limit
+        self.session = http_fetch.create_session(pool_size=workers, retries=0)
+        self.limiter = http_fetch.TokenBucket(rate)
+
+
+    def discover(self, start_date: str, end_date: str) -> list[tuple]:
+        """The (page, snapshot) pairs of the period not saved yet, the oldest first"""
+        pending = []
+        for page in self.engine.spec.pages:
+            url = f'{self.engine.spec.url}{page}'
+            for snapshot in wayback.stream_cdx_snapshots(url, start_date, end_date, self.granularity,
+                                                         base_url=self.cdx_url, session=self.session):
+                if (page, snapshot['timestamp']) not in self.checkpoint:
+                    pending.append((page, snapshot))
+
+        return sorted(pending, key=lambda item: item[1]['timestamp'])
+
+
+    def _get_snapshot_html(self, snapshot: dict) -> str:
+        """The archived page, from the cache if possible"""
+        if self.cache is not None:
+            html_source = self.cache.get(snapshot['original'], snapshot['timestamp'])
+            if html_source is not None:
+                return html_source
+
+        url = wayback.raw_snapshot_url(snapshot['timestamp'], snapshot['original'], self.snapshot_url)
+        html_source = http_fetch.get_with_backoff(self.session, url, limiter=self.limiter).text
+
+        if self.cache is not None:
+            self.cache.put(snapshot['original'], snapshot['timestamp'], html_source)
+
+        return html_source
+
+
+    def scrape_snapshot(self, page: str, snapshot: dict) -> pd.DataFrame:
+        """Download and parse one archived page"""
+        reference = datetime.strptime(snapshot['timestamp'], '%Y%m%d%H%M%S')
+
+        soup = parse_html(self._get_snapshot_html(snapshot), self.engine.page_strainer)
+
+        news_df = self.engine.build_dataframe(self.engine.iter_rows(soup, page, reference))
+        news_df = self.engine.clean(news_df, reference)
+        news_df['Font'] = self.font
+
+        return news_df
+
+
+    def _save(self, batch: list[tuple]):
+        """Write the news of a batch of snapshots, then mark them as done"""
+        batch = sorted(batch, key=lambda item: item[0][1])
+        news_df = pd.concat([news_df for _, news_df in batch], ignore_index=True)
+        run_time = datetime.strptime(batch[-1][0][1], '%Y%m%d%H%M%S')
+
+        # the snapshots are different front pages, each one is observed at its own time
+        self.store.append(news_df, run_time, timeline=False)
+        for (page, timestamp), snapshot_df in batch:
+            self.store.timeline.observe(snapshot_df, datetime.strptime(timestamp, '%Y%m%d%H%M%S'), page=page)
+
+        self.checkpoint.add([key for key, _ in batch])
+
+
+    def run(self, start_date: str, end_date: str) -> int:
+        """Backfill the period, skipping the snapshots already saved
+
+        Parameters
+        ----------
+        start_date : str
+            Start of the period in YYYYMMDD format
+        end_date : str
+            End of the period in YYYYMMDD format
+
+        Returns
+        -------
+        int
+            Number of snapshots saved
+        """
+        pending = self.discover(start_date, end_date)
+        logger.info(f"Backfilling {len(pending)} snapshots of {self.font}")
+
+        n_saved = 0
+        batch = []
+        # a bounded window of snapshots in flight, so a long period is not all held in memory
+        window = max(1, self.batch_size * self.workers)
+        snapshots = iter(pending)
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for i in range(len(pending)):
+                for page, snapshot in snapshots:
+                    future = executor.submit(self.scrape_snapshot, page, snapshot)
+                    in_flight.append(((page, snapshot['timestamp']), future))
+                    if len(in_flight) >= window:
+                        break
+
+                # in the order of the snapshots, so the runs reach the timeline in time order
+                key, future = in_flight.popleft()
+                try:
+                    batch.append((key, future.result()))
+                except Exception as e:
+                    # not on the checkpoint, so retried on the next run
+                    logger.error(f"Error scraping snapshot {key[1]} of {self.font} {key[0]}: {e}")
+
+                if len(batch) >= self.batch_size:
+                    self._save(batch)
+                    n_saved += len(batch)
+                    batch = []
+                    logger.info(f"Snapshot {i + 1}/{len(pending)}")
+
+        if batch:
+            self._save(batch)
+            n_saved += len(batch)
+
+        logger.info(f"Success backfilling {n_saved}/{len(pending)} snapshots of {self.font}")
+        return n_saved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scrape the archived front pages of a website into the store')
+    parser.add_argument('font', choices=list(SITES), help='website to backfill')
+    parser.add_argument('start_date', help='start of the period, in YYYYMMDD format')
+    parser.add_argument('end_date', help='end of the period, in YYYYMMDD format')
+    parser.add_argument('--granularity', choices=list(wayback.GRANULARITIES), default='day',
+                        help='keep one snapshot per period')
+    parser.add_argument('--workers', type=int, default=4, help='number of pages downloaded at the same time')
+    parser.add_argument('--rate', type=float, default=2.0, help='maximum number of downloads per second')
+    parser.add_argument('--checkpoint', default=None, help='file of the snapshots already saved')
+    parser.add_argument('--no-cache', action='store_true', help='do not keep the archived pages on data/html_cache')
+    parser.add_argument('--cdx-url', default=wayback.CDX_URL, help='address of the CDX API, or of a stub server')
+    parser.add_argument('--snapshot-url', default=wayback.SNAPSHOT_URL,
+                        help='address of the archived pages, or of a stub server')
+    args = parser.parse_args()
+
+    backfill = Backfill(args.font, workers=args.workers, rate=args.rate, granularity=args.granularity,
+                        checkpoint_path=args.checkpoint, cdx_url=args.cdx_url, snapshot_url=args.snapshot_url,
+                        cache=None if args.no_cache else HtmlCache())
+    backfill.run(args.start_date, args.end_date)
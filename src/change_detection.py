@@ -0,0 +1,360 @@
+from datetime import datetime
+from hashlib import blake2b
+import requests
+import argparse
+import sqlite3
+import threading
+import time
+import os
+import logging
+
+import src.logging_config
+from src import http_fetch
+from src.metrics import Metrics
+from src.parsing import parse_html
+from src.scrapers import NewsScraper
+from src.sites import SITES
+logger = logging.getLogger(__name__)
+
+# a page checked a bit before its interval, as with the jitter of the
+# scheduler, is still due
+DUE_SLACK = 0.2
+
+
+def default_detector_path() -> str:
+    """Path of the state of the change detection inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'change_detection.sqlite')
+
+
+def headline_hash(engine, html_source: str, page: str = '', n_items: int = 10) -> str:
+    """Hash of the top of a page: the titles of its highlights and first news
+
+    The times are left out, as the relative ones ('Há 5 minutos') change
+    every minute on a page that did not change. None when no news is found.
+    """
+    soup = parse_html(html_source, engine.page_strainer)
+
+    digest = blake2b(digest_size=16)
+    n_rows = 0
+    for row in engine.iter_rows(soup, page):
+        digest.update(f"{row['Highlighted']}\t{row['Title'].strip()}\n".encode())
+        n_rows += 1
+        if n_rows == n_items:
+            break
+
+    return digest.hexdigest() if n_rows > 0 else None
+
+
+class ChangeDetector():
+    """Cheap check of whether the subpages of a website changed since the last scraping
+
+    Each page is downloaded with a conditional GET, with the ETag and
+    Last-Modified of the previous check, so a 304 answer skips it without
+    a body. Otherwise the titles at the top of the page are hashed, and the
+    page changed when the hash did.
+
+    The interval of each page adapts to how often it changes: it is halved
+    on a change, down to min_interval, and grows 1.5 times when the page is
+    the same, up to max_interval. A page whose interval did not pass yet is
+    skipped without any request.
+
+    The state is kept on a sqlite file, so it survives the runs of a cron.
+    The new state of a changed page is only staged, and saved by commit
+    once its news are saved, so a scraping that fails does not lose the
+    change: the next check sees it again.
+
+    Examples
+    --------
+    >>> detector = ChangeDetector()
+    >>> scraper.pages = detector.changed_pages(scraper, session, metrics)
+    >>> save_output(scraper.scrap(), store)
+    >>> detector.commit()
+    """
+
+    def __init__(self, path: str = None, min_interval: float = 60, max_interval: float = 3600,
+                 initial_interval: float = 300, n_items: int = 10, timeout: float = http_fetch.DEFAULT_TIMEOUT):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            sqlite file of the state, by default data/change_detection.sqlite
+        min_interval : float, optional
+            Shortest interval between two checks of a page, in seconds, by default 60
+        max_interval : float, optional
+            Longest interval between two checks of a page, in seconds, by default 3600
+        initial_interval : float, optional
+            Interval of the pages never checked, by default 300
+        n_items : int, optional
+            Number of news at the top of the page hashed, by default 10
+        timeout : float, optional
+            Timeout of the requests, in seconds
+        """
+        self.path = default_detector_path() if path is None else path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.n_items = n_items
+        self.timeout = timeout
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        # the states of the changed pages waiting for their scraping to be saved
+        self._staged = {}
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    headline_hash TEXT,
+                    checked_at REAL NOT NULL,
+                    changed_at REAL,
+                    interval REAL NOT NULL,
+                    n_checks INTEGER NOT NULL DEFAULT 0,
+                    n_changes INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def _state(self, url: str) -> dict:
+        """The state of a page, or None if it was never checked"""
+        with self._lock:
+            cursor = self._connection.execute('SELECT * FROM pages WHERE url = ?', (url,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+
+    def interval(self, url: str, default: float = None) -> float:
+        """Current interval between the checks of a page"""
+        state = self._state(url)
+        if state is None:
+            return self.initial_interval if default is None else default
+        return state['interval']
+
+
+    def is_due(self, url: str, now: float = None) -> bool:
+        """Whether the interval of a page passed since its last check"""
+        state = self._state(url)
+        if state is None:
+            return True
+        now = time.time() if now is None else now
+        return now - state['checked_at'] >= state['interval'] * (1 - DUE_SLACK)
+
+
+    def _fetch(self, session: requests.Session, url: str, state: dict) -> requests.Response:
+        """Conditional GET of a page, with the validators of its last check"""
+        headers = {}
+        if state is not None and state['etag']:
+            headers['If-None-Match'] = state['etag']
+        if state is not None and state['last_modified']:
+            headers['If-Modified-Since'] = state['last_modified']
+
+        response = session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+
+    def _update(self, url: str, state: dict, changed: bool, now: float, etag: str = None,
+                last_modified: str = None, digest: str = None, initial_interval: float = None):
+        """Save the result of a check, adapting the interval of the page"""
+        if state is None:
+            interval = self.initial_interval if initial_interval is None else initial_interval
+        elif changed:
+            interval = state['interval'] / 2
+        else:
+            interval = state['interval'] * 1.5
+        interval = min(self.max_interval, max(self.min_interval, interval))
+
+        with self._lock, self._connection:
+            self._connection.execute('''
+                INSERT INTO pages (url, etag, last_modified, headline_hash, checked_at, changed_at, interval,
+                                   n_checks, n_changes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    etag = COALESCE(excluded.etag, etag),
+                    last_modified = COALESCE(excluded.last_modified, last_modified),
+                    headline_hash = COALESCE(excluded.headline_hash, headline_hash),
+                    checked_at = excluded.checked_at,
+                    changed_at = COALESCE(excluded.changed_at, changed_at),
+                    interval = excluded.interval,
+                    n_checks = n_checks + 1,
+                    n_changes = n_changes + excluded.n_changes
+            ''', (url, etag, last_modified, digest, now, now if changed else None, interval, int(changed)))
+
+
+    def check(self, session: requests.Session, engine, url: str, page: str = '',
+              initial_interval: float = None) -> bool:
+        """Whether a page changed since its last check
+
+        A page with an error or without news found is taken as changed, so
+        the full scraping runs and reports the problem.
+
+        Parameters
+        ----------
+        session : requests.Session
+            Session used to download the page
+        engine : ExtractionEngine
+            Parser of the website of the page
+        url : str
+            Address of the page
+        page : str, optional
+            Subpage, to parse the page as the scrapers do
+        initial_interval : float, optional
+            Interval of the page if it was never checked, by default initial_interval
+
+        Returns
+        -------
+        bool
+            True if the page changed, or was never checked. The state of a
+            changed page is staged until commit
+        """
+        state = self._state(url)
+        now = time.time()
+
+        try:
+            response = self._fetch(session, url, state)
+        except requests.RequestException as e:
+            logger.warning(f"Error checking {url}, taking it as changed: {e}")
+            return True
+
+        if response.status_code == 304:
+            self._update(url, state, False, now, initial_interval=initial_interval)
+            return False
+
+        digest = headline_hash(engine, response.text, page, self.n_items)
+        if digest is None:
+            logger.warning(f"No news found checking {url}, taking it as changed")
+            return True
+
+        changed = state is None or state['headline_hash'] != digest
+        update = (url, state, changed, now, response.headers.get('ETag'),
+                  response.headers.get('Last-Modified'), digest, initial_interval)
+        if changed:
+            with self._lock:
+                self._staged[url] = update
+        else:
+            self._update(*update)
+        return changed
+
+
+    def commit(self, urls: list[str] = None):
+        """Save the staged state of the changed pages, once their news are saved
+
+        Parameters
+        ----------
+        urls : list[str], optional
+            Addresses of the pages scraped, by default all the staged ones
+        """
+        with self._lock:
+            urls = list(self._staged) if urls is None else urls
+            updates = [self._staged.pop(url) for url in urls if url in self._staged]
+        for update in updates:
+            self._update(*update)
+
+
+    def discard(self, urls: list[str] = None):
+        """Drop the staged state of pages whose scraping failed, so they are seen as changed again"""
+        with self._lock:
+            for url in list(self._staged) if urls is None else urls:
+                self._staged.pop(url, None)
+
+
+    def changed_pages(self, scraper: NewsScraper, session: requests.Session, metrics: Metrics = None,
+                      initial_interval: float = None) -> list[str]:
+        """The subpages of a website to scrape: the ones due to a check that changed
+
+        Each decision is counted on metrics: pages_changed for the pages to
+        scrape, and pages_skipped for the others, with the reason as tag.
+        The pages returned are saved as checked by commit, after their
+        scraping.
+        """
+        metrics = Metrics() if metrics is None else metrics
+
+        pages = []
+        for page in scraper.pages:
+            url = f'{scraper.url}{page}'
+            tags = scraper._tags(page)
+
+            if not self.is_due(url):
+                metrics.count('pages_skipped', reason='not_due', **tags)
+                continue
+
+            with metrics.timer('change_check', **tags):
+                changed = self.check(session, scraper.engine, url, page, initial_interval)
+
+            if changed:
+                pages.append(page)
+                metrics.count('pages_changed', **tags)
+            else:
+                metrics.count('pages_skipped', reason='unchanged', **tags)
+            metrics.gauge('check_interval_seconds', self.interval(url), **tags)
+
+        logger.info(f"{len(pages)} of {len(scraper.pages)} pages of {scraper.url} to scrape")
+        return pages
+
+
+    def next_check(self, scraper: NewsScraper, default: float = None) -> float:
+        """Seconds until the next subpage of a website is due"""
+        now = time.time()
+        waits = []
+        for page in scraper.pages:
+            url = f'{scraper.url}{page}'
+            state = self._state(url)
+            if state is None:
+                waits.append(self.initial_interval if default is None else default)
+            else:
+                waits.append(state['checked_at'] + state['interval'] - now)
+
+        return max(self.min_interval, min(waits, default=self.initial_interval))
+
+
+    def status(self) -> list[dict]:
+        """The state of all the pages checked"""
+        with self._lock:
+            cursor = self._connection.execute('SELECT * FROM pages ORDER BY url')
+            rows = cursor.fetchall()
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check which subpages of the websites changed since the last check')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser.add_argument('--path', default=None, help='sqlite file of the state, by default data/change_detection.sqlite')
+
+    check = subparsers.add_parser('check', help='check the pages now, even the ones not due')
+    check.add_argument('--fonts', nargs='*', default=None, choices=list(SITES), help='websites, by default all')
+
+    subparsers.add_parser('status', help='interval and number of changes of each page')
+    args = parser.parse_args()
+
+    detector = ChangeDetector(args.path)
+    if args.command == 'check':
+        session = http_fetch.create_session()
+        for font in args.fonts or list(SITES):
+            scraper = NewsScraper(spec=SITES[font])
+            for page in scraper.pages:
+                url = f'{scraper.url}{page}'
+                changed = detector.check(session, scraper.engine, url, page)
+                detector.commit([url])
+                logger.info(f"{url} {'changed' if changed else 'unchanged'}, next check in {detector.interval(url):.0f}s")
+    else:
+        for state in detector.status():
+            checked_at = datetime.fromtimestamp(state['checked_at']).isoformat(timespec='seconds')
+            logger.info(f"{state['url']}: every {state['interval']:.0f}s, {state['n_changes']} changes "
+                        f"in {state['n_checks']} checks, last check {checked_at}")
@@ -0,0 +1,346 @@
+from datetime import datetime
+import pyarrow.parquet as pq
+import pandas as pd
+import argparse
+import glob
+import socket
+import threading
+import time
+import os
+import uuid
+import logging
+
+import src.logging_config
+from src import http_fetch
+from src import wayback
+from src.backfill import Backfill
+from src.drivers import DriverPool
+from src.metrics import Metrics
+from src.records import BatchWriter, articles_to_frame
+from src.scrapers import NewsScraper
+from src.sites import SITES
+from src.store import NewsStore
+from src.work_queue import Task, WorkQueue
+logger = logging.getLogger(__name__)
+
+
+def default_workers_path() -> str:
+    """Folder of the partitions of the workers inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'workers')
+
+
+def live_tasks(fonts: list[str] = None) -> list[Task]:
+    """One task for each subpage of the websites"""
+    fonts = list(SITES) if fonts is None else fonts
+    return [Task(font, page) for font in fonts for page in SITES[font].pages]
+
+
+def snapshot_tasks(font: str, start_date: str, end_date: str, granularity: str = 'day',
+                   cdx_url: str = wayback.CDX_URL) -> list[Task]:
+    """One task for each archived snapshot of the subpages of a website in the period"""
+    spec = SITES[font]
+    session = http_fetch.create_session()
+    return [
+        Task(font, page, snapshot['timestamp'], snapshot['original'])
+        for page in spec.pages
+        for snapshot in wayback.stream_cdx_snapshots(f'{spec.url}{page}', start_date, end_date, granularity,
+                                                     base_url=cdx_url, session=session)
+    ]
+
+
+class Worker():
+    """Scrape the tasks of the queue into the partition of this worker
+
+    Each of the n_drivers threads leases a task, scrapes it on its own
+    driver, or over HTTP, and writes the news to a NewsStore of its own in
+    root/worker=<worker_id>, so the workers never write on the same files.
+    The positions of the news of each task are kept apart, in
+    _observations, as a run of its subpage. The leases of the running tasks
+    are renewed in the background, and merge_workers moves the news and
+    the positions to the main store.
+    """
+
+    def __init__(self, queue: WorkQueue, worker_id: str = None, root: str = None, n_drivers: int = 1,
+                 fetch: str = 'browser', lease_seconds: float = 600, poll_interval: float = 5.0,
+                 max_pages: int = None, max_memory_mb: float = None, snapshot_url: str = wayback.SNAPSHOT_URL):
+        """
+        Parameters
+        ----------
+        queue : WorkQueue
+            Queue of the tasks
+        worker_id : str, optional
+            Name of the worker, by default the host name and the process id
+        root : str, optional
+            Folder of the partitions of the workers, by default data/workers
+        n_drivers : int, optional
+            Number of tasks scraped at the same time, each on its own driver, by default 1
+        fetch : str, optional
+            'browser' scrapes the live pages with the webdrivers, 'http' with plain
+            HTTP requests. The snapshots are always downloaded over HTTP
+        lease_seconds : float, optional
+            Time a task is held without renewal before other workers can take it
+        poll_interval : float, optional
+            Seconds to wait for new tasks when the queue is empty
+        max_pages : int, optional
+            Recycle each driver after scraping this many pages
+        max_memory_mb : float, optional
+            Recycle a driver when its browser uses more memory
+        snapshot_url : str, optional
+            Address of the archived pages
+        """
+        self.queue = queue
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}' if worker_id is None else worker_id
+        self.n_drivers = n_drivers
+        self.fetch = fetch
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.snapshot_url = snapshot_url
+
+        root = default_workers_path() if root is None else root
+        self.store = NewsStore(os.path.join(root, f'worker={self.worker_id}'))
+        self.pool = DriverPool(size=n_drivers, max_pages=max_pages, max_memory_mb=max_memory_mb)
+        self.session = http_fetch.create_session(pool_size=n_drivers)
+        self.metrics = Metrics()
+
+        self.scrapers = {font: NewsScraper(spec=spec, metrics=self.metrics) for font, spec in SITES.items()}
+        self._backfills = {}
+
+        self._held = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+
+    def _backfill(self, font: str) -> Backfill:
+        """Parser of the snapshots of a website, writing to the partition of the worker"""
+        with self._lock:
+            if font not in self._backfills:
+                # the checkpoint of the main backfill is not shared between the workers
+                checkpoint_path = os.path.join(self.store.root, '_backfill', f'{font}.checkpoint')
+                self._backfills[font] = Backfill(font, store=self.store, checkpoint_path=checkpoint_path,
+                                                 snapshot_url=self.snapshot_url)
+            return self._backfills[font]
+
+
+    def _observe(self, task: Task, news_df: pd.DataFrame, run_time: datetime):
+        """Keep the positions of the news of a task, for the timeline of the main store"""
+        observations_dir = os.path.join(self.store.root, '_observations')
+        os.makedirs(observations_dir, exist_ok=True)
+
+        final_path = os.path.join(observations_dir,
+                                  f"obs-{run_time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+        tmp_path = final_path + '.tmp'
+
+        observations_df = pd.DataFrame({'Title': news_df['Title'], 'Highlighted': news_df['Highlighted'],
+                                        'Font': task.font, 'Page': task.page})
+        observations_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, final_path)
+
+
+    def scrape(self, task: Task) -> int:
+        """Scrape one task into the partition, returning the number of news"""
+        if task.snapshot:
+            news_df = self._backfill(task.font).scrape_snapshot(
+                task.page, {'timestamp': task.snapshot, 'original': task.original}
+            )
+            run_time = datetime.strptime(task.snapshot, '%Y%m%d%H%M%S')
+            self.store.append(news_df, run_time, timeline=False)
+            self._observe(task, news_df, run_time)
+            return len(news_df)
+
+        scraper = self.scrapers[task.font]
+        if self.fetch == 'http':
+            articles = scraper.scrap_page_articles_http(self.session, task.page)
+        else:
+            with self.pool.driver() as driver:
+                articles = scraper.scrap_page_articles(driver, task.page)
+
+        # a task is one subpage, observed alone so it does not close the spans of the others
+        with BatchWriter(self.store, metrics=self.metrics, timeline=False) as writer:
+            n_news = writer.write_all(articles)
+        self._observe(task, articles_to_frame(articles), writer.run_time)
+        return n_news
+
+
+    def _renew_leases(self):
+        """Renew the leases of the running tasks until the worker stops"""
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                held = list(self._held.values())
+
+            for task in held:
+                if not self.queue.renew(task, self.worker_id, self.lease_seconds):
+                    logger.warning(f"Lost the lease of {task.name}")
+
+
+    def _work(self, until_empty: bool):
+        while not self._stop.is_set():
+            task = self.queue.lease(self.worker_id, self.lease_seconds)
+            if task is None:
+                if until_empty and self.queue.is_idle():
+                    return
+                self._stop.wait(self.poll_interval)
+                continue
+
+            with self._lock:
+                self._held[task.id] = task
+
+            try:
+                with self.metrics.timer('task', site=task.font, theme=task.page or None):
+                    n_news = self.scrape(task)
+                self.queue.complete(task, self.worker_id)
+                self.metrics.count('tasks_done', site=task.font)
+                logger.info(f"Sucess scraping {n_news} news of {task.name}")
+            except Exception as e:
+                self.queue.fail(task, self.worker_id, str(e))
+                self.metrics.count('tasks_failed', site=task.font)
+                logger.error(f"Error scraping {task.name}, attempt {task.attempts}: {e}")
+            finally:
+                with self._lock:
+                    del self._held[task.id]
+
+
+    def run(self, until_empty: bool = True):
+        """Work on the tasks of the queue
+
+        Parameters
+        ----------
+        until_empty : bool, optional
+            Stop when no task is pending or leased, by default True. Otherwise
+            wait for new tasks until stop is called
+        """
+        logger.info(f"Worker {self.worker_id} started with {self.n_drivers} drivers")
+        renewer = threading.Thread(target=self._renew_leases, daemon=True)
+        renewer.start()
+
+        threads = [threading.Thread(target=self._work, args=(until_empty,)) for _ in range(self.n_drivers)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self._stop.set()
+            self.pool.quit()
+            self.metrics.write_jsonl()
+
+
+    def stop(self):
+        self._stop.set()
+
+
+def _run_time(path: str) -> datetime:
+    """Time of the run that wrote a file of a worker, from its name part-<YYYYmmddTHHMMSS>-<id> or obs-..."""
+    try:
+        return datetime.strptime(os.path.basename(path).split('-')[1], '%Y%m%dT%H%M%S')
+    except (IndexError, ValueError):
+        return None
+
+
+def merge_workers(store: NewsStore, root: str = None) -> int:
+    """Move the news of the partitions of the workers to the main store
+
+    The news of each worker are appended, so the store dedups them against
+    the dataset and between the workers. Then the positions of the tasks
+    of all the workers are observed on the timeline of the store, in the
+    order of their runs. The files of a worker are only removed after they
+    are on the store, and a merge interrupted before is just done again.
+
+    Returns
+    -------
+    int
+        Number of news new on the store
+    """
+    root = default_workers_path() if root is None else root
+
+    n_new = 0
+    for worker_root in sorted(glob.glob(os.path.join(root, 'worker=*'))):
+        # only the finished files, the ones being written end with .tmp
+        paths = sorted(glob.glob(os.path.join(worker_root, 'date=*', 'font=*', 'part-*.parquet')))
+        if len(paths) == 0:
+            continue
+
+        worker_df = pd.concat([pq.read_table(path).to_pandas() for path in paths], ignore_index=True)
+        run_times = [run_time for run_time in map(_run_time, paths) if run_time is not None]
+        # the news of many tasks and rounds are merged, their positions are observed by task below
+        n_new += store.append(worker_df, max(run_times, default=None), timeline=False)
+
+        for path in paths:
+            os.remove(path)
+
+        logger.info(f"Merged {len(paths)} files of {os.path.basename(worker_root)}")
+
+    # the tasks of the same subpage can be on different workers, so they are sorted together
+    paths = glob.glob(os.path.join(root, 'worker=*', '_observations', 'obs-*.parquet'))
+    for path in sorted(paths, key=lambda path: (_run_time(path) or datetime.min, path)):
+        observations_df = pd.read_parquet(path)
+        if len(observations_df) > 0:
+            store.timeline.observe(observations_df, _run_time(path), page=observations_df['Page'].iloc[0])
+        os.remove(path)
+
+    logger.info(f"Sucess merging {n_new} new news on {store.root}")
+    return n_new
+
+
+def coordinate(queue: WorkQueue, store: NewsStore, interval: float = 600, fonts: list[str] = None,
+               root: str = None, stop: threading.Event = None):
+    """Enqueue the live pages of the websites every interval, merging the partitions of the workers"""
+    stop = threading.Event() if stop is None else stop
+    while not stop.is_set():
+        start = time.monotonic()
+        n_enqueued = queue.enqueue(live_tasks(fonts))
+        logger.info(f"Enqueued {n_enqueued} tasks, queue {queue.counts()}")
+
+        merge_workers(store, root)
+        stop.wait(max(0.0, interval - (time.monotonic() - start)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scrape the websites with many workers sharing a queue of tasks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser.add_argument('--queue', default=None, help='sqlite file of the queue, by default data/queue.sqlite')
+    parser.add_argument('--workers-root', default=None, help='folder of the worker partitions, by default data/workers')
+
+    enqueue = subparsers.add_parser('enqueue', help='add the live pages, or the snapshots of a period, to the queue')
+    enqueue.add_argument('--fonts', nargs='*', default=None, choices=list(SITES), help='websites, by default all')
+    enqueue.add_argument('--start-date', default=None, help='start of the snapshots, in YYYYMMDD format')
+    enqueue.add_argument('--end-date', default=None, help='end of the snapshots, in YYYYMMDD format')
+    enqueue.add_argument('--granularity', choices=list(wayback.GRANULARITIES), default='day',
+                         help='keep one snapshot per period')
+
+    coordinator = subparsers.add_parser('coordinator', help='enqueue the live pages periodically and merge the results')
+    coordinator.add_argument('--fonts', nargs='*', default=None, choices=list(SITES), help='websites, by default all')
+    coordinator.add_argument('--interval', type=float, default=600, help='seconds between the rounds')
+
+    work = subparsers.add_parser('work', help='scrape the tasks of the queue')
+    work.add_argument('--worker-id', default=None, help='name of the worker, by default host and process id')
+    work.add_argument('--drivers', type=int, default=1, help='number of tasks scraped at the same time')
+    work.add_argument('--fetch', choices=['browser', 'http'], default='browser', help='how to get the live pages')
+    work.add_argument('--lease', type=float, default=600, help='seconds of the lease of a task')
+    work.add_argument('--forever', action='store_true', help='wait for new tasks instead of stopping on an empty queue')
+    work.add_argument('--max-pages', type=int, default=50, help='pages scraped by a webdriver before it is restarted')
+    work.add_argument('--max-memory-mb', type=float, default=1500,
+                      help='memory of a browser to restart it before the next page')
+
+    subparsers.add_parser('merge', help='move the news of the worker partitions to the store')
+    subparsers.add_parser('status', help='number of tasks of each status')
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    if args.command == 'enqueue':
+        if args.start_date is None:
+            tasks = live_tasks(args.fonts)
+        else:
+            tasks = [
+                task for font in (args.fonts or list(SITES))
+                for task in snapshot_tasks(font, args.start_date, args.end_date, args.granularity)
+            ]
+        logger.info(f"Enqueued {queue.enqueue(tasks)} of {len(tasks)} tasks")
+    elif args.command == 'coordinator':
+        coordinate(queue, NewsStore(), args.interval, args.fonts, args.workers_root)
+    elif args.command == 'work':
+        Worker(queue, args.worker_id, args.workers_root, args.drivers, args.fetch, args.lease,
+               max_pages=args.max_pages, max_memory_mb=args.max_memory_mb).run(not args.forever)
+    elif args.command == 'merge':
+        merge_workers(NewsStore(), args.workers_root)
+    else:
+        logger.info(f"Queue {queue.counts()}")
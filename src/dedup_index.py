@@ -0,0 +1,239 @@
+import pandas as pd
+from datetime import datetime
+import argparse
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import os
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+# max number of parameters of a sqlite query
+CHUNK_SIZE = 500
+
+
+def normalize_title(title: str) -> str:
+    """Normalize a title, so small spacing and case changes give the same key"""
+    title = unicodedata.normalize('NFC', title)
+    return ' '.join(title.split()).casefold()
+
+
+def title_hash(title: str) -> int:
+    """64 bits hash of the normalized title, stored as a sqlite integer"""
+    digest = hashlib.blake2b(normalize_title(title).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class KnownTitles():
+    """Read only view of the titles of one font, usable with the `in` operator"""
+
+    def __init__(self, index, font: str):
+        self.index = index
+        self.font = font
+
+
+    def __contains__(self, title: str) -> bool:
+        return self.index.contains(self.font, title)
+
+
+class DedupIndex():
+    """Persistent index of the (Title, Font) keys already on the dataset
+
+    The keys are hashes of the normalized titles, kept in a sqlite table,
+    so checking a batch of news costs only the size of the batch. Each key
+    also records when the news was first and last seen, and in how many
+    runs it was on the front page.
+
+    The runs being written to the store are kept as pending until their
+    keys are recorded, so the store can finish a run interrupted between
+    writing its files and updating the index.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # the scrapers may check titles from many threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS news_keys (
+                    font TEXT NOT NULL,
+                    title_hash INTEGER NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    last_seen TEXT NOT NULL,
+                    n_runs INTEGER NOT NULL,
+                    PRIMARY KEY (font, title_hash)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS pending_runs (
+                    run_id TEXT PRIMARY KEY,
+                    run_time TEXT NOT NULL
+                )
+            ''')
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM news_keys').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def contains(self, font: str, title: str) -> bool:
+        """Check if a news is already on the dataset"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM news_keys WHERE font = ? AND title_hash = ?', (font, title_hash(title))
+            ).fetchone()
+        return row is not None
+
+
+    def known(self, font: str) -> KnownTitles:
+        """Titles of a font, to be checked by the scrapers while scrolling"""
+        return KnownTitles(self, font)
+
+
+    def _existing_hashes(self, font: str, hashes: list[int]) -> set:
+        existing = set()
+        with self._lock:
+            for i in range(0, len(hashes), CHUNK_SIZE):
+                chunk = hashes[i:i + CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._connection.execute(
+                    f'SELECT title_hash FROM news_keys WHERE font = ? AND title_hash IN ({placeholders})',
+                    [font] + chunk
+                ).fetchall()
+                existing.update(row[0] for row in rows)
+        return existing
+
+
+    def is_new(self, news_df: pd.DataFrame) -> pd.Series:
+        """Boolean mask of the news not on the dataset yet
+
+        Parameters
+        ----------
+        news_df : pd.DataFrame
+            News with Title and Font columns
+
+        Returns
+        -------
+        pd.Series
+            True for the news whose (Title, Font) is not on the index
+        """
+        hashes = news_df['Title'].map(title_hash)
+
+        mask = pd.Series(True, index=news_df.index)
+        for font, font_hashes in hashes.groupby(news_df['Font']):
+            existing = self._existing_hashes(font, list(set(font_hashes)))
+            mask[font_hashes.index] = ~font_hashes.isin(existing)
+
+        return mask
+
+
+    def begin_run(self, run_id: str, run_time: datetime):
+        """Mark a run as pending, before its files are written"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO pending_runs (run_id, run_time) VALUES (?, ?)',
+                (run_id, run_time.isoformat(sep=' ', timespec='seconds'))
+            )
+
+
+    def pending_runs(self) -> dict:
+        """Time of each run whose files may be written without its keys on the index"""
+        with self._lock:
+            rows = self._connection.execute('SELECT run_id, run_time FROM pending_runs').fetchall()
+        return {run_id: datetime.fromisoformat(run_time) for run_id, run_time in rows}
+
+
+    def observe(self, news_df: pd.DataFrame, run_time: datetime = None, run_id: str = None):
+        """Record the news seen in a run
+
+        New keys are inserted, and the known ones get their last seen time
+        and number of runs updated. A run written in many batches, with the
+        same run_time, counts once. With a run_id, the run stops being
+        pending in the same transaction.
+        """
+        run_time = (datetime.now() if run_time is None else run_time).isoformat(sep=' ', timespec='seconds')
+
+        keys = {(font, title_hash(title)) for title, font in zip(news_df['Title'], news_df['Font'])}
+
+        with self._lock, self._connection:
+            self._connection.executemany('''
+                INSERT INTO news_keys (font, title_hash, first_seen, last_seen, n_runs)
+                VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT (font, title_hash) DO UPDATE SET
+                    first_seen = MIN(first_seen, excluded.first_seen),
+                    last_seen = MAX(last_seen, excluded.last_seen),
+                    n_runs = n_runs + (excluded.last_seen <> last_seen)
+            ''', [(font, key, run_time, run_time) for font, key in keys])
+            if run_id is not None:
+                self._connection.execute('DELETE FROM pending_runs WHERE run_id = ?', (run_id,))
+
+
+    def history(self, font: str, title: str) -> dict:
+        """First and last time a news was seen, and in how many runs"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT first_seen, last_seen, n_runs FROM news_keys WHERE font = ? AND title_hash = ?',
+                (font, title_hash(title))
+            ).fetchone()
+
+        if row is None:
+            return None
+        return {'first_seen': row[0], 'last_seen': row[1], 'n_runs': row[2]}
+
+
+    def rebuild(self, news_df: pd.DataFrame):
+        """Replace the index with the keys of a dataset
+
+        The Time of each news is used as its first and last seen time,
+        since the times of the past runs are not known.
+        """
+        news_df = news_df.dropna(subset=['Title', 'Font'])
+        times = pd.to_datetime(news_df['Time'], errors='coerce', format='mixed')
+        times = times.dt.strftime('%Y-%m-%d %H:%M:%S').fillna(datetime.now().isoformat(sep=' ', timespec='seconds'))
+
+        rows = {}
+        for title, font, time in zip(news_df['Title'], news_df['Font'], times):
+            rows.setdefault((font, title_hash(title)), time)
+
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM news_keys')
+            self._connection.executemany(
+                'INSERT INTO news_keys (font, title_hash, first_seen, last_seen, n_runs) VALUES (?, ?, ?, ?, 1)',
+                [(font, key, time, time) for (font, key), time in rows.items()]
+            )
+
+        logger.info(f"Rebuilt index {self.path} with {len(rows)} keys")
+
+
+    def rebuild_from_csv(self, csv_file_path: str):
+        """Replace the index with the keys of a CSV dataset, like data/news.csv"""
+        self.rebuild(pd.read_csv(csv_file_path, usecols=['Title', 'Time', 'Font']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the (Title, Font) dedup index')
+    parser.add_argument('command', choices=['rebuild', 'stats'])
+    parser.add_argument('--index', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'store', '_index.sqlite'),
+                        help='path of the sqlite index, by default the one of the news store')
+    parser.add_argument('--csv', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'news.csv'),
+                        help='CSV dataset to rebuild from, by default data/news.csv')
+    args = parser.parse_args()
+
+    index = DedupIndex(args.index)
+    if args.command == 'rebuild':
+        index.rebuild_from_csv(args.csv)
+    else:
+        logger.info(f"{len(index)} keys on {args.index}")
@@ -0,0 +1,255 @@
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.firefox.service import Service
+from contextlib import contextmanager
+from queue import Queue, Empty
+import threading
+import os
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+GECKODRIVER_PATH = '/snap/bin/firefox.geckodriver'
+
+# ad and analytics hosts of the news websites, resolved to the local machine
+# so their scripts and frames are never loaded
+BLOCKED_HOSTS = [
+    'securepubads.g.doubleclick.net', 'stats.g.doubleclick.net', 'pagead2.googlesyndication.com',
+    'tpc.googlesyndication.com', 'www.googletagservices.com', 'www.googletagmanager.com',
+    'www.google-analytics.com', 'c.amazon-adsystem.com', 'aax.amazon-adsystem.com', 'ib.adnxs.com',
+    'ads.pubmatic.com', 'cdn.taboola.com', 'trc.taboola.com', 'widgets.outbrain.com', 'static.chartbeat.com',
+    'ping.chartbeat.net', 'sb.scorecardresearch.com', 'connect.facebook.net', 'cdn.permutive.com',
+    'static.criteo.net', 'tags.t.tailtarget.com',
+]
+
+
+def firefox_options(headless: bool = True, block_resources: bool = True) -> Options:
+    """Options of the browser, without window and without the resources the scraping does not need
+
+    The images, web fonts and videos are not loaded, the trackers are
+    blocked by the tracking protection of Firefox, and the BLOCKED_HOSTS
+    are not reachable. The news text comes from the HTML, so the pages are
+    the same for the scrapers, with a fraction of the memory.
+    """
+    options = Options()
+    if headless:
+        options.add_argument('-headless')
+
+    if block_resources:
+        options.set_preference('permissions.default.image', 2)
+        options.set_preference('gfx.downloadable_fonts.enabled', False)
+        options.set_preference('media.autoplay.default', 5)
+        options.set_preference('media.mediasource.enabled', False)
+        options.set_preference('media.hls.enabled', False)
+        options.set_preference('privacy.trackingprotection.enabled', True)
+        options.set_preference('privacy.trackingprotection.socialtracking.enabled', True)
+        options.set_preference('network.dns.localDomains', ','.join(BLOCKED_HOSTS))
+        # no previous pages kept in memory to go back
+        options.set_preference('browser.sessionhistory.max_total_viewers', 0)
+
+    return options
+
+
+def create_firefox_driver(headless: bool = True, block_resources: bool = True) -> webdriver.Firefox:
+    """Start a new Firefox webdriver, by default without window and blocking the heavy resources"""
+    s = Service(executable_path=GECKODRIVER_PATH)
+    logger.info("Starting webdriver")
+    return webdriver.Firefox(service=s, options=firefox_options(headless, block_resources))
+
+
+def _children(pid: int) -> list[int]:
+    """Direct child processes of a process, read from /proc"""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def process_tree_memory(pid: int) -> int:
+    """Resident memory of a process and all its descendants, in bytes
+
+    Firefox runs each tab on its own content process, so the memory of the
+    browser is the one of the whole tree. Only available on Linux, returns
+    0 elsewhere or if the process is gone.
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            continue
+        pending.extend(_children(pid))
+
+    return total
+
+
+def driver_memory(driver: webdriver) -> int:
+    """Resident memory of the browser of a driver, in bytes, 0 if unknown"""
+    # geckodriver reports the pid of the browser it started
+    pid = driver.capabilities.get('moz:processID')
+    if pid is None:
+        return 0
+    return process_tree_memory(int(pid))
+
+
+def driver_alive(driver: webdriver) -> bool:
+    """Whether the browser of a driver still answers the commands"""
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+
+class DriverPool():
+    """Bounded pool of webdrivers shared between scraping threads
+
+    The drivers are created lazily, so a pool never starts more browsers
+    than the number of pages scraped at the same time.
+
+    For long running processes, a driver can be recycled, closed and
+    replaced by a new browser, after scraping max_pages pages or when its
+    memory grows over max_memory_mb. The memory of the browsers is checked
+    after each page, the highest on peak_memory_mb.
+
+    A driver whose browser crashed, after a page failed or when its process
+    is gone, is closed instead of lent again.
+    """
+
+    def __init__(self, size: int = 3, driver_factory=create_firefox_driver, max_pages: int = None,
+                 max_memory_mb: float = None, memory_probe=driver_memory, alive_probe=driver_alive):
+        if size < 1:
+            raise ValueError(f"The pool needs at least one driver, got {size}")
+
+        self.size = size
+        self.driver_factory = driver_factory
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.memory_probe = memory_probe
+        self.alive_probe = alive_probe
+
+        self._idle = Queue()
+        self._drivers = []
+        self._n_pages = {}
+        self._n_created = 0
+        self._lock = threading.Lock()
+
+        self.peak_memory_mb = 0.0
+
+
+    def _acquire(self) -> webdriver:
+        """Take an idle driver, creating a new one if the pool is not full"""
+        while True:
+            with self._lock:
+                # reserve a slot, the browser itself starts outside the lock
+                create = self._idle.empty() and self._n_created < self.size
+                if create:
+                    self._n_created += 1
+
+            if create:
+                break
+
+            # all the drivers are busy, wait for one to be released or recycled
+            try:
+                return self._idle.get(timeout=1.0)
+            except Empty:
+                continue
+
+        try:
+            driver = self.driver_factory()
+        except Exception:
+            with self._lock:
+                self._n_created -= 1
+            raise
+
+        with self._lock:
+            self._drivers.append(driver)
+            self._n_pages[id(driver)] = 0
+        return driver
+
+
+    def warm_up(self):
+        """Start all the drivers of the pool, before the scraping, so the first pages do not wait for the browsers"""
+        drivers = [self._acquire() for _ in range(self.size)]
+        for driver in drivers:
+            self._idle.put(driver)
+
+
+    def _should_recycle(self, driver: webdriver, memory_mb: float) -> bool:
+        if self.max_pages is not None and self._n_pages[id(driver)] >= self.max_pages:
+            logger.info(f"Recycling driver after {self._n_pages[id(driver)]} pages")
+            return True
+
+        if self.max_memory_mb is not None and memory_mb > self.max_memory_mb:
+            logger.info(f"Recycling driver using {memory_mb:.0f} MB")
+            return True
+
+        return False
+
+
+    def _retire(self, driver: webdriver):
+        """Close a driver and free its slot, a new one is started on the next use"""
+        with self._lock:
+            self._drivers.remove(driver)
+            del self._n_pages[id(driver)]
+            self._n_created -= 1
+
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.error(f"Error closing driver: {e}")
+
+
+    @contextmanager
+    def driver(self):
+        """Lend a driver for the duration of the with block"""
+        driver = self._acquire()
+        failed = False
+        try:
+            yield driver
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            memory_mb = self.memory_probe(driver) / 2**20
+            with self._lock:
+                self._n_pages[id(driver)] += 1
+                self.peak_memory_mb = max(self.peak_memory_mb, memory_mb)
+
+            # a crashed browser would fail all the next pages of the slot
+            if (failed or memory_mb == 0) and not self.alive_probe(driver):
+                logger.warning("Retiring a driver whose browser does not answer")
+                self._retire(driver)
+            elif self._should_recycle(driver, memory_mb):
+                self._retire(driver)
+            else:
+                self._idle.put(driver)
+
+
+    def quit(self):
+        """Close all the drivers created by the pool"""
+        with self._lock:
+            for driver in self._drivers:
+                try:
+                    driver.quit()
+                except Exception as e:
+                    logger.error(f"Error closing driver: {e}")
+
+            logger.info(f"Closed {len(self._drivers)} drivers, peak memory of a browser {self.peak_memory_mb:.0f} MB")
+            self._drivers = []
+            self._n_pages = {}
+            self._n_created = 0
+            self._idle = Queue()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.quit()
@@ -0,0 +1,322 @@
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlsplit
+import pandas as pd
+import requests
+import argparse
+import json
+import sqlite3
+import threading
+import os
+import logging
+
+import src.logging_config
+from src import http_fetch
+from src.store import NewsStore
+logger = logging.getLogger(__name__)
+
+# types of schema.org objects describing an article
+ARTICLE_TYPES = {'NewsArticle', 'Article', 'ReportageNewsArticle', 'AnalysisNewsArticle', 'BlogPosting'}
+
+
+def default_enriched_path() -> str:
+    """Path of the index of the enriched articles inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'enriched', 'articles.sqlite')
+
+
+def _iter_json_ld(soup: BeautifulSoup):
+    """Yield the schema.org objects of the JSON-LD scripts of a page"""
+    for script in soup.find_all('script', type='application/ld+json'):
+        try:
+            data = json.loads(script.string or '')
+        except ValueError:
+            continue
+
+        pending = data if isinstance(data, list) else [data]
+        while pending:
+            item = pending.pop(0)
+            if not isinstance(item, dict):
+                continue
+            # many objects may come in a @graph
+            pending.extend(item.get('@graph', []))
+            yield item
+
+
+def _author_name(author) -> str:
+    """Names of the author field of schema.org, which may be a text, an object or a list"""
+    if isinstance(author, list):
+        names = [_author_name(one) for one in author]
+        return ', '.join(name for name in names if name) or None
+    if isinstance(author, dict):
+        return author.get('name')
+    return author or None
+
+
+def _parse_published(text: str) -> datetime:
+    """ISO 8601 publish time as a naive datetime in the local time, like the scraped times"""
+    # malformed pages may give a number, a list or an object
+    if not text or not isinstance(text, str):
+        return None
+    try:
+        published = datetime.fromisoformat(text.strip())
+    except ValueError:
+        return None
+
+    if published.tzinfo is not None:
+        published = published.astimezone().replace(tzinfo=None)
+    return published
+
+
+def extract_article(html_source: str) -> dict:
+    """Obtain the body text, the author and the publish time of an article page
+
+    The news websites describe their articles with schema.org JSON-LD, used
+    first. The meta tags and the paragraphs of the <article> are the
+    fallback.
+
+    Returns
+    -------
+    dict
+        Body, Author and Published, None for the ones not found
+    """
+    soup = BeautifulSoup(html_source, 'lxml')
+
+    body = author = published = None
+    for item in _iter_json_ld(soup):
+        types = item.get('@type')
+        types = set(types) if isinstance(types, list) else {types}
+        if types & ARTICLE_TYPES:
+            body = item.get('articleBody')
+            author = _author_name(item.get('author'))
+            published = _parse_published(item.get('datePublished'))
+            break
+
+    if published is None:
+        meta = soup.find('meta', property='article:published_time') or soup.find('meta', itemprop='datePublished')
+        published = _parse_published(meta.get('content') if meta is not None else None)
+
+    if author is None:
+        meta = soup.find('meta', attrs={'name': 'author'})
+        author = meta.get('content') if meta is not None else None
+
+    if not body:
+        root = soup.find('article') or soup
+        paragraphs = [p.get_text(' ', strip=True) for p in root.find_all('p')]
+        body = '\n'.join(paragraph for paragraph in paragraphs if paragraph) or None
+
+    return {'Body': body, 'Author': author, 'Published': published}
+
+
+class EnrichedIndex():
+    """Persistent index of the articles already enriched, keyed by URL
+
+    Keeps the data extracted from each article page, so an URL is only
+    downloaded once, over all the runs.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = default_enriched_path() if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # the pages are enriched from many threads
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS articles (
+                    url TEXT PRIMARY KEY,
+                    font TEXT,
+                    published TEXT,
+                    author TEXT,
+                    body TEXT,
+                    enriched_at TEXT NOT NULL
+                )
+            ''')
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def missing(self, urls: list[str]) -> list[str]:
+        """The URLs not enriched yet, without repetitions"""
+        urls = list(dict.fromkeys(url for url in urls if url))
+        with self._lock:
+            known = {
+                row[0] for row in self._connection.execute(
+                    'SELECT url FROM articles WHERE url IN (SELECT value FROM json_each(?))', (json.dumps(urls),)
+                )
+            }
+        return [url for url in urls if url not in known]
+
+
+    def add(self, url: str, font: str, article: dict):
+        published = article['Published']
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO articles (url, font, published, author, body, enriched_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, font, None if published is None else published.isoformat(), article['Author'], article['Body'],
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+
+
+    def published_times(self, urls: list[str]) -> dict:
+        """The publish time of each enriched URL that has one"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT url, published FROM articles WHERE published IS NOT NULL AND url IN (SELECT value FROM json_each(?))',
+                (json.dumps(list(set(url for url in urls if url))),)
+            ).fetchall()
+        return {url: datetime.fromisoformat(published) for url, published in rows}
+
+
+    def read(self, font: str = None) -> pd.DataFrame:
+        """The enriched articles, with the columns Link, Font, Published, Author and Body"""
+        query = 'SELECT url, font, published, author, body FROM articles'
+        params = ()
+        if font is not None:
+            query += ' WHERE font = ?'
+            params = (font,)
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+
+        enriched_df = pd.DataFrame(rows, columns=['Link', 'Font', 'Published', 'Author', 'Body'])
+        enriched_df['Published'] = pd.to_datetime(enriched_df['Published'])
+        return enriched_df
+
+
+class Enricher():
+    """Download the pages of the new articles and extract their full data
+
+    The pages are downloaded concurrently over one pooled session, with at
+    most max_per_host downloads at the same time on each website. The
+    exact publish time replaces the Time of the front page, which is only
+    an approximation for the highlights.
+    """
+
+    def __init__(self, index: EnrichedIndex = None, workers: int = 8, max_per_host: int = 4,
+                 timeout: float = http_fetch.DEFAULT_TIMEOUT, session: requests.Session = None):
+        """
+        Parameters
+        ----------
+        index : EnrichedIndex, optional
+            Index of the articles already enriched, by default the one in data/enriched
+        workers : int, optional
+            Number of pages downloaded at the same time, by default 8
+        max_per_host : int, optional
+            Number of pages downloaded at the same time from one website, by default 4
+        timeout : float, optional
+            Timeout of each download, in seconds
+        session : requests.Session, optional
+            Session used to download the pages, by default a new one
+        """
+        self.index = EnrichedIndex() if index is None else index
+        self.workers = workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+
+        # the retries are done by get_with_backoff
+        self.session = http_fetch.create_session(pool_size=workers, retries=0) if session is None else session
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+
+    def _host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            return self._host_limits.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+
+
+    def fetch_article(self, url: str) -> dict:
+        """Download and extract one article page"""
+        with self._host_limit(url):
+            response = http_fetch.get_with_backoff(self.session, url, self.timeout, retries=2)
+
+        return extract_article(response.text)
+
+
+    def enrich_urls(self, urls: dict) -> int:
+        """Enrich the URLs not on the index yet
+
+        Parameters
+        ----------
+        urls : dict
+            Font of each URL
+
+        Returns
+        -------
+        int
+            Number of articles enriched
+        """
+        pending = self.index.missing(list(urls))
+        if len(pending) == 0:
+            return 0
+
+        logger.info(f"Enriching {len(pending)} articles")
+
+        n_enriched = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fetch_article, url): url for url in pending}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    self.index.add(url, urls[url], future.result())
+                    n_enriched += 1
+                except Exception as e:
+                    # not on the index, so retried on the next run. The
+                    # enrichment is optional, a bad page never stops the save
+                    logger.error(f"Error enriching {url}: {e}")
+
+        logger.info(f"Sucess enriching {n_enriched}/{len(pending)} articles")
+        return n_enriched
+
+
+    def enrich(self, news_df: pd.DataFrame) -> pd.DataFrame:
+        """Enrich the articles of the news, and give them their exact publish time
+
+        Parameters
+        ----------
+        news_df : pd.DataFrame
+            News scraped, with the Link and Font columns
+
+        Returns
+        -------
+        pd.DataFrame
+            The news, with the Time replaced by the publish time when known
+        """
+        if 'Link' not in news_df.columns:
+            return news_df
+
+        links = news_df[['Link', 'Font']].dropna(subset=['Link'])
+        self.enrich_urls(dict(zip(links['Link'], links['Font'])))
+
+        published = self.index.published_times(links['Link'].tolist())
+        if published:
+            exact_times = pd.to_datetime(news_df['Link'].map(published))
+            news_df['Time'] = exact_times.fillna(pd.to_datetime(news_df['Time'], errors='coerce', format='mixed'))
+
+        return news_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Enrich the news of the store with the data of their article pages')
+    parser.add_argument('--fonts', nargs='*', default=None, help='websites to enrich, by default all')
+    parser.add_argument('--root', default=None, help='folder of the store, by default data/store')
+    parser.add_argument('--workers', type=int, default=8, help='number of pages downloaded at the same time')
+    parser.add_argument('--max-per-host', type=int, default=4,
+                        help='number of pages downloaded at the same time from one website')
+    args = parser.parse_args()
+
+    news_df = NewsStore(args.root).read(fonts=args.fonts).dropna(subset=['Link'])
+    enricher = Enricher(workers=args.workers, max_per_host=args.max_per_host)
+    enricher.enrich_urls(dict(zip(news_df['Link'], news_df['Font'])))
@@ -0,0 +1,377 @@
+from bs4 import BeautifulSoup, SoupStrainer
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from urllib.parse import urljoin
+import pandas as pd
+import soupsieve
+import re
+import logging
+
+import src.logging_config
+from src.parsing import AnyStrainer, class_strainer
+from src.records import Article
+logger = logging.getLogger(__name__)
+
+# selectors like 'div.feed-post-body' are matched without soupsieve
+SIMPLE_SELECTOR = re.compile(r'([a-zA-Z][a-zA-Z0-9]*)?((?:\.[\w-]+)*)')
+
+# units of the relative times, like 'Há 2 horas'
+RELATIVE_UNITS = {
+    'minuto': timedelta(minutes=1),
+    'hora': timedelta(hours=1),
+    'dia': timedelta(days=1),
+    # Note: This is an approximation as timedelta does not support months directly
+    'mês': timedelta(days=30),
+    'mes': timedelta(days=30),
+}
+RELATIVE_TIME = re.compile(r'(?P<amount>\d+)\s+(?P<unit>' + '|'.join(RELATIVE_UNITS) + ')')
+
+
+@dataclass(frozen=True)
+class SiteSpec():
+    """Declarative description of how to scrape a news website
+
+    The selectors are CSS selectors. The fields map a column name to the
+    selector of the tag with its text, inside a news; a None selector means
+    the text of the news tag itself.
+    """
+    font: str
+    url: str
+    # containers of the feed, and one news inside them
+    container: str
+    item: str
+    fields: dict
+    columns: tuple
+    # 'relative' for times like 'Há 2 horas', otherwise a strptime format
+    time_format: str
+    # the highlighted news on the top of the page
+    highlight_area: str = None
+    highlight_item: str = None
+    highlight_fields: dict = field(default_factory=dict)
+    highlight_limit: int = None
+    # Time given to the highlights, by default the time of the scrap
+    highlight_time: str = None
+    # subpages of the url, each scraped on its own
+    pages: tuple = ('',)
+    # use the subpage as the Theme of its news
+    page_theme: bool = False
+    # if False, only the first container is used
+    all_containers: bool = True
+    strip_title: bool = False
+    # the 'load more' button, and how the page loads more news:
+    # 'autoload' scrolls and clicks the button only when it appears,
+    # 'click' clicks the button on every scroll
+    load_more: str = None
+    scroll_mode: str = 'autoload'
+    # other classes to keep when parsing, like the container of the button
+    keep_classes: tuple = ()
+    # False when the button loads the news with scripts, without an address
+    # to follow over HTTP, so the browser is used when available
+    http_pagination: bool = True
+    # anchor with the URL of the news, inside it or around it
+    link: str = 'a'
+    highlight_link: str = 'a'
+
+
+class Selector():
+    """A CSS selector compiled once
+
+    Simple selectors, a tag name and classes, are matched directly on the
+    tag, the others with soupsieve.
+    """
+
+    def __init__(self, css: str):
+        self.css = css
+
+        simple = SIMPLE_SELECTOR.fullmatch(css)
+        if simple is not None and css:
+            self.name = simple.group(1)
+            self.classes = frozenset(class_ for class_ in simple.group(2).split('.') if class_)
+            self._compiled = None
+        else:
+            self.name = None
+            self.classes = frozenset()
+            self._compiled = soupsieve.compile(css)
+
+
+    def match(self, tag) -> bool:
+        if self._compiled is not None:
+            return self._compiled.match(tag)
+
+        if self.name is not None and tag.name != self.name:
+            return False
+        return self.classes.issubset(tag.get('class') or ())
+
+
+    def select(self, root) -> list:
+        if self._compiled is not None:
+            return self._compiled.select(root)
+        return root.find_all(self.match)
+
+
+    def select_one(self, root):
+        if self._compiled is not None:
+            return self._compiled.select_one(root)
+        return root.find(self.match)
+
+
+class ExtractionEngine():
+    """Extract the news of the pages of a website, following its SiteSpec"""
+
+    def __init__(self, spec: SiteSpec):
+        self.spec = spec
+
+        self.container = Selector(spec.container)
+        self.item = Selector(spec.item)
+        self.fields = {name: None if css is None else Selector(css) for name, css in spec.fields.items()}
+
+        self.highlight_area = None if spec.highlight_area is None else Selector(spec.highlight_area)
+        self.highlight_item = None if spec.highlight_item is None else Selector(spec.highlight_item)
+        self.highlight_fields = {name: None if css is None else Selector(css)
+                                 for name, css in spec.highlight_fields.items()}
+        self.link = Selector(spec.link)
+        self.highlight_link = Selector(spec.highlight_link)
+
+        # selector of the news for the browser
+        self.item_css = f'{spec.container} {spec.item}'
+
+        # without a highlight area, the anchor around a highlight is only kept by its own selector
+        highlight_link = None
+        if self.highlight_area is None and self.highlight_item is not None:
+            highlight_link = self.highlight_link
+        self.page_strainer = self._strainer([self.container, self.highlight_area, self.highlight_item, highlight_link])
+        self.items_strainer = self._strainer([self.container, self.item])
+
+
+    def _strainer(self, selectors: list[Selector]) -> SoupStrainer:
+        """Strainer keeping only the tags of the selectors
+
+        Selectors without classes can only be kept by the tag name, and the
+        keep_classes, like the 'load more' button, are kept besides them.
+        """
+        selectors = [selector for selector in selectors if selector is not None]
+
+        if all(selector.classes for selector in selectors):
+            # the longest class is usually the most specific one
+            classes = [max(sorted(selector.classes), key=len) for selector in selectors]
+            return class_strainer(classes + list(self.spec.keep_classes))
+
+        names = SoupStrainer([selector.name for selector in selectors if selector.name is not None])
+        if len(self.spec.keep_classes) == 0:
+            return names
+
+        return AnyStrainer([names, class_strainer(list(self.spec.keep_classes))])
+
+
+    def _collect_fields(self, item, fields: dict) -> dict:
+        """Obtain the text of the fields of a news in one pass over its tags"""
+        values = {}
+        pending = {}
+        for name, selector in fields.items():
+            if selector is None:
+                values[name] = item.text
+            else:
+                values[name] = None
+                pending[name] = selector
+
+        if pending:
+            for tag in item.find_all(True):
+                for name, selector in list(pending.items()):
+                    if selector.match(tag):
+                        values[name] = tag.text
+                        del pending[name]
+
+                if not pending:
+                    break
+
+        return values
+
+
+    def _link(self, item, selector: Selector) -> str:
+        """Absolute URL of a news, from the anchor inside it, or around it"""
+        anchor = item if selector.match(item) else selector.select_one(item)
+        if anchor is None:
+            anchor = item.find_parent('a')
+
+        href = None if anchor is None else anchor.get('href')
+        if not href:
+            return None
+        return urljoin(self.spec.url, href)
+
+
+    def _row(self, values: dict, page: str, highlighted: int) -> dict:
+        row = dict.fromkeys(self.spec.columns)
+        row.update(values)
+
+        if self.spec.page_theme:
+            row['Theme'] = page
+        row['Highlighted'] = highlighted
+
+        return row
+
+
+    def parse_item(self, item, page: str = '') -> dict:
+        """Obtain the data of a single news of the feed"""
+        values = self._collect_fields(item, self.fields)
+        if values.get('Title') is None:
+            raise ValueError(f"News without title on {self.spec.url}{page}")
+        values['Link'] = self._link(item, self.link)
+
+        return self._row(values, page, 0)
+
+
+    def iter_items(self, soup: BeautifulSoup, page: str = ''):
+        """Yield the news of the feed of a page"""
+        if self.spec.all_containers:
+            containers = self.container.select(soup)
+        else:
+            container = self.container.select_one(soup)
+            containers = [] if container is None else [container]
+
+        # the pagination pages may have only the news
+        if len(containers) == 0:
+            containers = [soup]
+
+        for container in containers:
+            for item in self.item.select(container):
+                yield self.parse_item(item, page)
+
+
+    def highlight_time(self, reference: datetime = None) -> str:
+        """Time text of the highlights, the reference time by default now"""
+        if self.spec.highlight_time is not None:
+            return self.spec.highlight_time
+
+        if self.spec.time_format == 'relative':
+            return 'Há 0 minutos'
+
+        reference = datetime.now() if reference is None else reference
+        return reference.strftime(self.spec.time_format)
+
+
+    def iter_highlights(self, soup: BeautifulSoup, page: str = '', reference: datetime = None):
+        """Yield the highlighted news on the top of a page, seen at the reference time"""
+        if self.highlight_item is None:
+            return
+
+        area = soup
+        if self.highlight_area is not None:
+            area = self.highlight_area.select_one(soup)
+            if area is None:
+                logger.warning(f"No highlights area on {self.spec.url}{page}")
+                return
+
+        highlighted_news = islice(self.highlight_item.select(area), self.spec.highlight_limit)
+
+        time = self.highlight_time(reference)
+        for hnews in highlighted_news:
+            values = self._collect_fields(hnews, self.highlight_fields)
+            values['Time'] = time
+            values['Link'] = self._link(hnews, self.highlight_link)
+            yield self._row(values, page, 1)
+
+
+    def iter_rows(self, soup: BeautifulSoup, page: str = '', reference: datetime = None):
+        """Yield the highlights and the news of the feed of a page"""
+        return chain(self.iter_highlights(soup, page, reference), self.iter_items(soup, page))
+
+
+    def build_dataframe(self, rows) -> pd.DataFrame:
+        return pd.DataFrame(list(rows), columns=list(self.spec.columns))
+
+
+    def convert_time(self, time_str: str, reference: datetime = None) -> datetime:
+        """Convert the Time text of a news to datetime
+
+        Relative times are counted back from the reference, by default now.
+        """
+        if time_str is None or pd.isna(time_str):
+            return None
+
+        if self.spec.time_format != 'relative':
+            return datetime.strptime(time_str.strip(), self.spec.time_format)
+
+        match = RELATIVE_TIME.search(time_str)
+        if match is None:
+            return None  # If the format does not match, return None
+
+        reference = datetime.now() if reference is None else reference
+        return reference - int(match['amount']) * RELATIVE_UNITS[match['unit']]
+
+
+    def parse_times(self, times: pd.Series, reference: datetime = None) -> pd.Series:
+        """Convert the Time texts of many news to datetime at once
+
+        The relative times are extracted with one regex over the column and
+        counted back from a single reference, by default now. The dates are
+        parsed with the explicit format of the website. The texts that do
+        not match give NaT.
+        """
+        times = times.astype('string').str.strip()
+
+        if self.spec.time_format != 'relative':
+            return pd.to_datetime(times, format=self.spec.time_format, errors='coerce')
+
+        reference = pd.Timestamp.now() if reference is None else pd.Timestamp(reference)
+
+        # a feed has few distinct relative times, so only those are parsed
+        codes, texts = pd.factorize(times)
+        parts = pd.Series(texts, dtype='string').str.extract(RELATIVE_TIME)
+        deltas = pd.to_timedelta(parts['unit'].map(RELATIVE_UNITS)) * pd.to_numeric(parts['amount'])
+
+        # the missing texts have code -1, so they take the NaT added at the end
+        deltas = pd.concat([deltas, pd.Series([pd.NaT], dtype='timedelta64[ns]')], ignore_index=True)
+        return pd.Series(reference - deltas.to_numpy()[codes], index=times.index)
+
+
+    def iter_articles(self, rows, reference: datetime = None):
+        """Yield the rows of a page as cleaned Article records
+
+        The same cleaning of clean, one news at a time. All the relative
+        times are counted from the same reference, by default now, and each
+        distinct time text is converted only once.
+        """
+        reference = datetime.now() if reference is None else reference
+
+        times = {}
+        n_unparsed = 0
+        for row in rows:
+            text = row.get('Time')
+            if text not in times:
+                try:
+                    times[text] = self.convert_time(text, reference)
+                except ValueError:
+                    times[text] = None
+
+            time = times[text]
+            if time is None and text is not None:
+                n_unparsed += 1
+
+            title = row['Title']
+            if self.spec.strip_title and title is not None:
+                title = title.strip()
+            yield Article(title, time, row.get('Theme'), row.get('Header'), row.get('Resume'),
+                          self.spec.font, row['Highlighted'], row.get('Link'))
+
+        if n_unparsed > 0:
+            logger.warning(f"{n_unparsed} times of {self.spec.url} do not match the format {self.spec.time_format}")
+
+
+    def clean(self, news_df: pd.DataFrame, reference: datetime = None) -> pd.DataFrame:
+        """Do simple data cleaning after the scrap
+
+        All the relative times are counted from the same reference, by
+        default the time of the cleaning.
+        """
+        n_times = news_df['Time'].notna().sum()
+        news_df['Time'] = self.parse_times(news_df['Time'], reference)
+
+        n_unparsed = n_times - news_df['Time'].notna().sum()
+        if n_unparsed > 0:
+            logger.warning(f"{n_unparsed} times of {self.spec.url} do not match the format {self.spec.time_format}")
+
+        if self.spec.strip_title:
+            news_df['Title'] = news_df['Title'].str.strip()
+
+        return news_df
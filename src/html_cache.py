@@ -0,0 +1,219 @@
+from datetime import datetime
+import argparse
+import gzip
+import hashlib
+import sqlite3
+import threading
+import os
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 2 * 2**30
+
+
+def default_cache_path() -> str:
+    """Path of the cache inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'html_cache')
+
+
+def now_timestamp() -> str:
+    """Current time in the YYYYMMDDhhmmss format of the cache keys"""
+    return datetime.now().strftime('%Y%m%d%H%M%S')
+
+
+class HtmlCache():
+    """Local cache of the raw HTML of the pages downloaded
+
+    The pages are keyed by URL and timestamp, the time of the download or
+    of the archived snapshot. The HTML is stored compressed, once for each
+    distinct content, in root/blobs/<hash[:2]>/<hash>.html.gz, and the keys
+    in a sqlite index. When the compressed size goes over max_bytes, the
+    contents used the longest time ago are evicted.
+    """
+
+    def __init__(self, root: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = default_cache_path() if root is None else root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.root, 'blobs'), exist_ok=True)
+
+        # the scrapers may use the cache from many threads
+        self._connection = sqlite3.connect(os.path.join(self.root, 'index.sqlite'), check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    PRIMARY KEY (url, timestamp)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    content_hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS pages_hash ON pages (content_hash)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS blobs_access ON blobs (last_access)')
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.root, 'blobs', content_hash[:2], f'{content_hash}.html.gz')
+
+
+    def total_size(self) -> int:
+        """Compressed size of the cached contents, in bytes"""
+        with self._lock:
+            return self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+
+    def put(self, url: str, timestamp: str, html: str) -> str:
+        """Save the HTML of a page
+
+        Parameters
+        ----------
+        url : str
+            URL of the page
+        timestamp : str
+            Time of the page in YYYYMMDDhhmmss format
+        html : str
+            Content of the page
+
+        Returns
+        -------
+        str
+            Hash of the content
+        """
+        data = html.encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(content_hash)
+
+        with self._lock:
+            known = self._connection.execute(
+                'SELECT 1 FROM blobs WHERE content_hash = ?', (content_hash,)
+            ).fetchone() is not None
+
+        if not known:
+            # the file is complete before it is on the index
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(data))
+            os.replace(tmp_path, path)
+
+        with self._lock, self._connection:
+            self._connection.execute('''
+                INSERT INTO blobs (content_hash, size, last_access) VALUES (?, ?, ?)
+                ON CONFLICT (content_hash) DO UPDATE SET last_access = excluded.last_access
+            ''', (content_hash, os.path.getsize(path), datetime.now().timestamp()))
+            self._connection.execute(
+                'INSERT OR REPLACE INTO pages (url, timestamp, content_hash) VALUES (?, ?, ?)',
+                (url, timestamp, content_hash)
+            )
+
+        if not known:
+            self.evict()
+
+        return content_hash
+
+
+    def get(self, url: str, timestamp: str) -> str:
+        """The HTML of a page, None if it is not cached"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT content_hash FROM pages WHERE url = ? AND timestamp = ?', (url, timestamp)
+            ).fetchone()
+        if row is None:
+            return None
+
+        try:
+            with open(self._blob_path(row[0]), 'rb') as f:
+                data = gzip.decompress(f.read())
+        except FileNotFoundError:
+            return None
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE blobs SET last_access = ? WHERE content_hash = ?', (datetime.now().timestamp(), row[0])
+            )
+
+        return data.decode('utf-8')
+
+
+    def entries(self, url_prefix: str = None) -> list[tuple[str, str]]:
+        """The (url, timestamp) keys of the cached pages, optionally only the URLs with a prefix"""
+        with self._lock:
+            if url_prefix is None:
+                rows = self._connection.execute('SELECT url, timestamp FROM pages ORDER BY url, timestamp')
+            else:
+                rows = self._connection.execute(
+                    'SELECT url, timestamp FROM pages WHERE substr(url, 1, ?) = ? ORDER BY url, timestamp',
+                    (len(url_prefix), url_prefix)
+                )
+            return rows.fetchall()
+
+
+    def evict(self) -> int:
+        """Remove the contents used the longest time ago until the cache fits max_bytes
+
+        Returns
+        -------
+        int
+            Number of contents removed
+        """
+        with self._lock, self._connection:
+            total = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            removed = []
+            for content_hash, size in self._connection.execute(
+                'SELECT content_hash, size FROM blobs ORDER BY last_access'
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                removed.append(content_hash)
+                total -= size
+
+            for content_hash in removed:
+                self._connection.execute('DELETE FROM pages WHERE content_hash = ?', (content_hash,))
+                self._connection.execute('DELETE FROM blobs WHERE content_hash = ?', (content_hash,))
+
+        for content_hash in removed:
+            try:
+                os.remove(self._blob_path(content_hash))
+            except FileNotFoundError:
+                pass
+
+        logger.info(f"Evicted {len(removed)} pages from {self.root}")
+        return len(removed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the cache of downloaded pages')
+    parser.add_argument('command', choices=['stats', 'evict'])
+    parser.add_argument('--root', default=None, help='folder of the cache, by default data/html_cache')
+    parser.add_argument('--max-mb', type=float, default=DEFAULT_MAX_BYTES / 2**20,
+                        help='maximum compressed size of the cache, in MB')
+    args = parser.parse_args()
+
+    cache = HtmlCache(args.root, int(args.max_mb * 2**20))
+    if args.command == 'evict':
+        cache.evict()
+    else:
+        logger.info(f"{len(cache)} pages, {cache.total_size() / 2**20:.1f} MB on {cache.root}")
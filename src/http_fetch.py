@@ -0,0 +1,234 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup, SoupStrainer
+from time import monotonic, sleep
+import threading
+import logging
+
+import src.logging_config
+from src.parsing import parse_html
+logger = logging.getLogger(__name__)
+
+# some websites serve a reduced page for unknown clients
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0',
+    'Accept-Language': 'pt-BR,pt;q=0.9,en;q=0.5',
+}
+
+DEFAULT_TIMEOUT = 15
+
+# responses worth retrying after a while
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def create_session(pool_size: int = 10, retries: int = 3) -> requests.Session:
+    """Create a HTTP session with a pool of keep-alive connections
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Maximum number of connections kept open per host, by default 10
+    retries : int, optional
+        Retries on connection errors and 429/5xx responses, by default 3
+
+    Returns
+    -------
+    requests.Session
+        The configured session
+    """
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET', 'HEAD'], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+class TokenBucket():
+    """Rate limiter shared by many threads
+
+    Allows bursts of up to capacity requests, with the tokens refilled at
+    rate requests per second.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = max(1, rate) if capacity is None else capacity
+
+        self._tokens = self.capacity
+        self._last = monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        """Wait until a request is allowed"""
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            sleep(wait)
+
+
+def get_with_backoff(session: requests.Session, url: str, timeout: float = DEFAULT_TIMEOUT,
+                     retries: int = 5, backoff: float = 1.0, limiter: TokenBucket = None,
+                     **kwargs) -> requests.Response:
+    """GET a URL, retrying with exponential backoff on 429/5xx and connection errors
+
+    Parameters
+    ----------
+    session : requests.Session
+        Session used for the requests, ideally created with retries=0
+    url : str
+        URL to download
+    timeout : float, optional
+        Timeout of each request, in seconds
+    retries : int, optional
+        Maximum number of retries, by default 5
+    backoff : float, optional
+        Wait before the first retry, doubled on each retry, by default 1.0.
+        A Retry-After header of the server takes precedence
+    limiter : TokenBucket, optional
+        Rate limiter acquired before each request, including the retries
+    **kwargs
+        Passed to session.get, like params
+
+    Returns
+    -------
+    requests.Response
+        The successful response
+
+    Raises
+    ------
+    requests.RequestException
+        When the retries are exhausted or the response is another HTTP error
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
+        try:
+            response = session.get(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            wait = backoff * 2 ** attempt
+            logger.warning(f"Error fetching {url}, retrying in {wait:.1f}s: {e}")
+        else:
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                response.raise_for_status()
+                return response
+
+            retry_after = response.headers.get('Retry-After', '')
+            wait = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+            logger.warning(f"Status {response.status_code} on {url}, retrying in {wait:.1f}s")
+
+        sleep(wait)
+
+
+def get_html(session: requests.Session, url: str, timeout: float = DEFAULT_TIMEOUT) -> str:
+    """Download a page, raising on HTTP errors"""
+    logger.info(f"Fetching {url}")
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.text
+
+
+def get_soup(session: requests.Session, url: str, timeout: float = DEFAULT_TIMEOUT,
+             parse_only: SoupStrainer = None) -> BeautifulSoup:
+    """Download and parse a page, optionally only the tags matched by parse_only"""
+    return parse_html(get_html(session, url, timeout), parse_only)
+
+
+def find_next_page_url(soup: BeautifulSoup, page_url: str, button_selector: str = None) -> str:
+    """Find the URL of the next page of a feed
+
+    The 'load more' buttons usually carry the address they request, either
+    as a link or as a data attribute. Otherwise the page may declare it
+    with rel="next".
+    """
+    if button_selector is not None:
+        button = soup.select_one(button_selector)
+        if button is not None:
+            for attribute in ['href', 'data-href', 'data-url', 'data-next', 'data-request']:
+                next_url = button.get(attribute)
+                if next_url and not next_url.startswith(('#', 'javascript')):
+                    return urljoin(page_url, next_url)
+
+    next_link = soup.find(['link', 'a'], rel='next', href=True)
+    if next_link is not None:
+        return urljoin(page_url, next_link['href'])
+
+    return None
+
+
+def fetch_feed_pages(session: requests.Session, soup: BeautifulSoup, page_url: str, parse_items,
+                     n_pages: int, button_selector: str = None, extractor=None,
+                     parse_only: SoupStrainer = None) -> list[dict]:
+    """Parse a feed and follow its pagination, the HTTP equivalent of scrolling
+
+    Parameters
+    ----------
+    session : requests.Session
+        Session used for the next pages
+    soup : BeautifulSoup
+        The first page, already downloaded
+    page_url : str
+        URL of the first page
+    parse_items : function
+        Receives the soup of a page and returns the list of its news
+    n_pages : int
+        Maximum number of extra pages to follow
+    button_selector : str, optional
+        CSS selector of the 'load more' button
+    extractor : IncrementalExtractor, optional
+        If given, stops when the news of a page are already known
+    parse_only : SoupStrainer, optional
+        Tags of the next pages to parse, by default the whole page
+
+    Returns
+    -------
+    list[dict]
+        The news of all the pages, in order
+    """
+    page_rows = parse_items(soup)
+    rows = list(page_rows)
+
+    for i in range(n_pages):
+        if extractor is not None and extractor.should_stop(page_rows):
+            logger.info(f"Stopping pagination, news of page {i + 1} already known")
+            break
+
+        next_url = find_next_page_url(soup, page_url, button_selector)
+        if next_url is None:
+            logger.info(f"No next page after page {i + 1}")
+            break
+
+        # keep the news already obtained if a next page fails
+        try:
+            soup = get_soup(session, next_url, parse_only=parse_only)
+        except requests.RequestException as e:
+            logger.warning(f"Error fetching {next_url}, stopping pagination: {e}")
+            break
+
+        page_url = next_url
+        page_rows = parse_items(soup)
+        rows.extend(page_rows)
+
+        logger.debug(f"Page {i + 2}: {len(page_rows)} news")
+
+    return rows
@@ -0,0 +1,96 @@
+from bs4 import BeautifulSoup
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+
+class IncrementalExtractor():
+    """Parse the feed items as they are loaded by the scrolls
+
+    After each scroll only the items that were not seen yet are transferred
+    from the browser and parsed. When most of a new batch is already in the
+    dataset, the rest of the feed is old news, so the scraper can stop.
+
+    With trim_dom, the items already parsed are emptied on the page, keeping
+    their height, so the memory of the browser does not grow with the
+    scrolls, while the scroll position and the number of items stay the same.
+    """
+
+    def __init__(self, item_selector: str, parse_item, known_titles, stop_fraction: float = 0.8,
+                 trim_dom: bool = True):
+        """
+        Parameters
+        ----------
+        item_selector : str
+            CSS selector of the feed items
+        parse_item : function
+            Receives the soup of one item and returns a dict with its data
+        known_titles : set
+            Titles of this website already present on the dataset
+        stop_fraction : float, optional
+            Fraction of known titles in a batch to stop scrolling, by default 0.8
+        trim_dom : bool, optional
+            Empty the items on the page after parsing them, by default True
+        """
+        self.item_selector = item_selector
+        self.parse_item = parse_item
+        self.known_titles = known_titles
+        self.stop_fraction = stop_fraction
+        self.trim_dom = trim_dom
+
+        # the parsed items, in the order of the page
+        self.items = []
+        self.n_known = 0
+
+
+    def extract_new(self, driver) -> list[dict]:
+        """Parse the items loaded since the last call"""
+        new_items_html = driver.execute_script(
+            "return Array.from(document.querySelectorAll(arguments[0]))"
+            ".slice(arguments[1]).map(e => e.outerHTML)",
+            self.item_selector, len(self.items)
+        )
+
+        new_items = [self.parse_item(BeautifulSoup(html, 'lxml')) for html in new_items_html]
+        self.items.extend(new_items)
+
+        if self.trim_dom:
+            self.trim(driver)
+
+        return new_items
+
+
+    def trim(self, driver):
+        """Empty the items already parsed, with their images and frames, keeping their size on the page"""
+        driver.execute_script(
+            "Array.from(document.querySelectorAll(arguments[0])).slice(0, arguments[1]).forEach(e => {"
+            "  if (e.dataset.scraped) return;"
+            "  e.style.height = e.offsetHeight + 'px';"
+            "  e.replaceChildren();"
+            "  e.dataset.scraped = '1';"
+            "})",
+            self.item_selector, len(self.items)
+        )
+
+
+    def should_stop(self, new_items: list[dict]) -> bool:
+        """Check if enough of the new items are already known"""
+        if len(new_items) == 0:
+            return False
+
+        n_known = sum(item['Title'].strip() in self.known_titles for item in new_items)
+        self.n_known += n_known
+
+        known_fraction = n_known / len(new_items)
+        logger.debug(f"{n_known}/{len(new_items)} new items already known")
+
+        return known_fraction >= self.stop_fraction
+
+
+    def extract_and_check(self, driver) -> bool:
+        """Parse the new items and tell if the scrolling can stop"""
+        stop = self.should_stop(self.extract_new(driver))
+        if stop:
+            logger.info(f"Stopping scroll, {self.n_known}/{len(self.items)} news already known")
+        return stop
@@ -0,0 +1,275 @@
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import perf_counter
+import json
+import threading
+import uuid
+import os
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+# prefix of the names of the Prometheus metrics
+PROMETHEUS_PREFIX = 'news_scraper'
+
+
+def default_metrics_path() -> str:
+    """Folder of the metrics files inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'metrics')
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    """Nearest rank percentile of a list of values"""
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def _tags_key(tags: dict) -> tuple:
+    return tuple(sorted(tags.items()))
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_labels(tags: dict, **extra) -> str:
+    labels = {**tags, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in sorted(labels.items())) + '}'
+
+
+class Metrics():
+    """Timers, counters and gauges of one run of the scraping
+
+    Each measure is an event tagged by site and theme, kept in memory and
+    written as JSON lines at the end of the run. The same events give the
+    Prometheus text format, as a file or over HTTP.
+
+    Examples
+    --------
+    >>> metrics = Metrics()
+    >>> with metrics.timer('parse', site='G1'):
+    ...     parse_page()
+    >>> metrics.count('news', 120, site='G1')
+    """
+
+    def __init__(self, run_id: str = None):
+        self.run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}" if run_id is None else run_id
+        self.start = datetime.now()
+        self._start = perf_counter()
+
+        self.events = []
+        # run shown for each key, see show_run
+        self._shown = {}
+        # the scrapers may record from many threads
+        self._lock = threading.Lock()
+
+
+    def _record(self, kind: str, name: str, value: float, tags: dict):
+        event = {
+            'run_id': self.run_id,
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'type': kind,
+            'name': name,
+            'value': value,
+            'tags': {tag: tag_value for tag, tag_value in tags.items() if tag_value is not None},
+        }
+        with self._lock:
+            self.events.append(event)
+
+
+    @contextmanager
+    def timer(self, stage: str, **tags):
+        """Measure the duration of a stage, in seconds, even if it fails"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._record('timer', stage, perf_counter() - start, tags)
+
+
+    def count(self, name: str, value: float = 1, **tags):
+        """Add a value to a counter"""
+        self._record('counter', name, value, tags)
+
+
+    def gauge(self, name: str, value: float, **tags):
+        """Record a level, like the memory of the browser, reported by its peak"""
+        self._record('gauge', name, value, tags)
+
+
+    def show_run(self, key: str, other: 'Metrics'):
+        """Replace the events shown for a key by the ones of another run
+
+        A long running process serves one Metrics with the last run of each
+        of its jobs, like the websites of the daemon, without keeping the
+        events of all the runs.
+        """
+        with other._lock:
+            events = list(other.events)
+
+        with self._lock:
+            previous = self._shown.get(key)
+            self.events = [event for event in self.events if event['run_id'] != previous]
+            self.events.extend(events)
+            self._shown[key] = other.run_id
+
+
+    def _select(self, kind: str) -> list[dict]:
+        with self._lock:
+            return [event for event in self.events if event['type'] == kind]
+
+
+    def counter_total(self, name: str, **tags) -> float:
+        """Sum of a counter, over the events having the given tags"""
+        return sum(
+            event['value'] for event in self._select('counter')
+            if event['name'] == name and all(event['tags'].get(tag) == value for tag, value in tags.items())
+        )
+
+
+    def stage_stats(self) -> dict:
+        """Number of measures, total and p95 seconds of each stage"""
+        durations = {}
+        for event in self._select('timer'):
+            durations.setdefault(event['name'], []).append(event['value'])
+
+        return {
+            stage: {'count': len(values), 'total': sum(values), 'p95': _percentile(values, 0.95)}
+            for stage, values in durations.items()
+        }
+
+
+    def peaks(self) -> dict:
+        """Highest value of each gauge"""
+        peaks = {}
+        for event in self._select('gauge'):
+            peaks[event['name']] = max(peaks.get(event['name'], event['value']), event['value'])
+        return peaks
+
+
+    def summary(self) -> dict:
+        """Run level figures: duration, throughput and new vs duplicated news"""
+        duration = perf_counter() - self._start
+        n_news = self.counter_total('news')
+        n_new = self.counter_total('news_new')
+        n_duplicated = self.counter_total('news_duplicated')
+
+        return {
+            'run_id': self.run_id,
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'type': 'summary',
+            'start': self.start.isoformat(timespec='seconds'),
+            'duration': duration,
+            'news': n_news,
+            'news_per_second': n_news / duration if duration > 0 else 0.0,
+            'news_new': n_new,
+            'news_duplicated': n_duplicated,
+            'duplicated_ratio': n_duplicated / (n_new + n_duplicated) if n_new + n_duplicated > 0 else 0.0,
+            'stages': self.stage_stats(),
+            'peaks': self.peaks(),
+        }
+
+
+    def write_jsonl(self, folder: str = None) -> str:
+        """Write the events and the summary of the run to folder/run-<run_id>.jsonl"""
+        folder = default_metrics_path() if folder is None else folder
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'run-{self.run_id}.jsonl')
+
+        with self._lock:
+            events = list(self.events)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            for event in events + [self.summary()]:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+        logger.info(f"Metrics of the run saved on {path}")
+        return path
+
+
+    def to_prometheus(self) -> str:
+        """The timers, counters and peaks of the gauges in the Prometheus text exposition format"""
+        lines = []
+
+        stages = {}
+        for event in self._select('timer'):
+            key = (event['name'], _tags_key(event['tags']))
+            stages.setdefault(key, []).append(event['value'])
+
+        name = f'{PROMETHEUS_PREFIX}_stage_seconds'
+        lines.append(f'# HELP {name} Duration of the stages of the scraping')
+        lines.append(f'# TYPE {name} summary')
+        for (stage, tags), values in sorted(stages.items()):
+            tags = dict(tags, stage=stage)
+            lines.append(f'{name}{_prometheus_labels(tags, quantile="0.95")} {_percentile(values, 0.95)}')
+            lines.append(f'{name}_sum{_prometheus_labels(tags)} {sum(values)}')
+            lines.append(f'{name}_count{_prometheus_labels(tags)} {len(values)}')
+
+        counters = {}
+        for event in self._select('counter'):
+            key = (event['name'], _tags_key(event['tags']))
+            counters[key] = counters.get(key, 0) + event['value']
+
+        for counter in sorted({counter for counter, _ in counters}):
+            name = f'{PROMETHEUS_PREFIX}_{counter}_total'
+            lines.append(f'# TYPE {name} counter')
+            for (other, tags), value in sorted(counters.items()):
+                if other == counter:
+                    lines.append(f'{name}{_prometheus_labels(dict(tags))} {value}')
+
+        gauges = {}
+        for event in self._select('gauge'):
+            key = (event['name'], _tags_key(event['tags']))
+            gauges[key] = max(gauges.get(key, event['value']), event['value'])
+
+        for gauge in sorted({gauge for gauge, _ in gauges}):
+            name = f'{PROMETHEUS_PREFIX}_{gauge}_peak'
+            lines.append(f'# TYPE {name} gauge')
+            for (other, tags), value in sorted(gauges.items()):
+                if other == gauge:
+                    lines.append(f'{name}{_prometheus_labels(dict(tags))} {value}')
+
+        summary = self.summary()
+        for field in ['duration', 'news_per_second', 'duplicated_ratio']:
+            name = f'{PROMETHEUS_PREFIX}_run_{field}'
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {summary[field]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def write_prometheus(self, path: str):
+        """Write the metrics for the node exporter textfile collector, atomically"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+    def serve_prometheus(self, port: int, host: str = '') -> ThreadingHTTPServer:
+        """Expose the metrics on http://host:port/metrics, from a daemon thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        logger.info(f"Serving the metrics on port {port}")
+        return server
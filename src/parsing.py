@@ -0,0 +1,86 @@
+from bs4 import BeautifulSoup, SoupStrainer
+import re
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+
+def parse_html(html_source: str, parse_only: SoupStrainer = None) -> BeautifulSoup:
+    """Parse a page, building the tree only for the tags matched by parse_only
+
+    Long scrolled pages are mostly scripts, ads and menus. Restricting the
+    tree to the news containers cuts the parse time and memory.
+    """
+    return BeautifulSoup(html_source, 'lxml', parse_only=parse_only)
+
+
+def class_strainer(classes: list[str], names: list[str] = None) -> SoupStrainer:
+    """Strainer for the tags having any of the classes
+
+    While parsing, the class attribute is still the raw string, so the
+    classes are matched as whole words of it.
+    """
+    pattern = re.compile(r'(^|\s)(' + '|'.join(re.escape(class_) for class_ in classes) + r')(\s|$)')
+    return SoupStrainer(names, class_ = pattern)
+
+
+class AnyStrainer(SoupStrainer):
+    """Strainer keeping the tags matched by any of the given strainers
+
+    A SoupStrainer matches the name and the attributes of a tag together,
+    so a tag name or a class needs one strainer each.
+    """
+
+    def __init__(self, strainers: list[SoupStrainer]):
+        super().__init__()
+        self.strainers = strainers
+
+
+    def allow_tag_creation(self, nsprefix, name, attrs) -> bool:
+        return any(strainer.allow_tag_creation(nsprefix, name, attrs) for strainer in self.strainers)
+
+
+    def allow_string_creation(self, string) -> bool:
+        # only the text inside the tags kept
+        return False
+
+
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        # the same for the versions of bs4 before 4.13
+        return next(filter(None, (strainer.search_tag(markup_name, markup_attrs) for strainer in self.strainers)), None)
+
+
+def collect_fields(item, fields: dict) -> dict:
+    """Obtain the text of many fields of a news in one pass over its tags
+
+    Parameters
+    ----------
+    item : bs4.Tag
+        Tag containing a single news
+    fields : dict
+        For each field name, a (tag name, class) pair. The first tag with
+        that name having that class gives the value of the field
+
+    Returns
+    -------
+    dict
+        The text of each field, None for the ones not found
+    """
+    values = dict.fromkeys(fields)
+    pending = dict(fields)
+
+    for tag in item.find_all(True):
+        classes = tag.get('class')
+        if not classes:
+            continue
+
+        for field, (name, class_) in list(pending.items()):
+            if tag.name == name and class_ in classes:
+                values[field] = tag.text
+                del pending[field]
+
+        if not pending:
+            break
+
+    return values
@@ -0,0 +1,139 @@
+from collections import Counter
+from dataclasses import dataclass, fields
+from datetime import datetime
+import pandas as pd
+import logging
+
+import src.logging_config
+from src.enrichment import Enricher
+from src.metrics import Metrics
+from src.store import NewsStore, COLUMNS
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Article():
+    """One news scraped, already cleaned
+
+    A compact record, without the per row overhead of a dict or a
+    DataFrame, so the news can flow from the parsing to the store one by
+    one. The attributes are the columns of the dataset.
+    """
+    title: str
+    time: datetime = None
+    theme: str = None
+    header: str = None
+    resume: str = None
+    font: str = None
+    highlighted: int = 0
+    link: str = None
+
+
+    @classmethod
+    def from_row(cls, row: dict) -> 'Article':
+        """Record of a row with the column names of the dataset"""
+        return cls(*(row.get(column) for column in COLUMNS))
+
+
+    def to_row(self) -> dict:
+        """The record with the column names of the dataset"""
+        return {column: getattr(self, attribute.name) for column, attribute in zip(COLUMNS, fields(self))}
+
+
+def articles_to_frame(articles) -> pd.DataFrame:
+    """DataFrame of the dataset with the given records"""
+    return pd.DataFrame([article.to_row() for article in articles], columns=COLUMNS)
+
+
+class BatchWriter():
+    """Write the news to the store in batches, as they are scraped
+
+    The records are kept in memory only until batch_size of them are
+    available, so a failure late in the run keeps the news already
+    written, and the memory does not grow with the size of the run.
+    All the batches are written with the same run time, and the ranks of
+    the news on the timeline continue from one batch to the next.
+
+    Examples
+    --------
+    >>> with BatchWriter(store) as writer:
+    ...     writer.write_all(scraper.iter_news(driver))
+    """
+
+    def __init__(self, store: NewsStore, batch_size: int = 500, metrics: Metrics = None, enricher: Enricher = None,
+                 timeline: bool = True):
+        """
+        Parameters
+        ----------
+        store : NewsStore
+            Store receiving the news, deduplicated by (Title, Font)
+        batch_size : int, optional
+            Number of news written at once, by default 500
+        metrics : Metrics, optional
+            Where the time of the writes and the new and duplicated news are counted
+        enricher : Enricher, optional
+            If given, the articles of each batch are enriched before being written
+        timeline : bool, optional
+            Record the positions of the news on the timeline of the store, by default True
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.metrics = Metrics() if metrics is None else metrics
+        self.enricher = enricher
+        self.timeline = timeline
+
+        self.run_time = datetime.now()
+        self.n_font_news = Counter()
+
+        self.batch = []
+        self.n_written = 0
+        self.n_new = 0
+
+
+    def write(self, article: Article):
+        self.batch.append(article)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+
+    def write_all(self, articles) -> int:
+        """Write all the records of an iterable, returning how many there were"""
+        n_articles = 0
+        for article in articles:
+            self.write(article)
+            n_articles += 1
+
+        return n_articles
+
+
+    def flush(self):
+        """Write the records waiting on the batch"""
+        if len(self.batch) == 0:
+            return
+
+        news_df = articles_to_frame(self.batch)
+        self.batch = []
+
+        if self.enricher is not None:
+            with self.metrics.timer('enrich'):
+                news_df = self.enricher.enrich(news_df)
+
+        with self.metrics.timer('save'):
+            for font, font_df in news_df.groupby('Font', sort=False):
+                n_new = self.store.append(font_df, self.run_time, self.n_font_news[font], self.timeline)
+                self.n_font_news[font] += len(font_df)
+                self.metrics.count('news_new', n_new, site=font)
+                self.metrics.count('news_duplicated', len(font_df) - n_new, site=font)
+                self.n_new += n_new
+
+        self.n_written += len(news_df)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        # the news of the batch are kept even if the scraping failed
+        self.flush()
+        logger.info(f"Sucess writing {self.n_new} new news of {self.n_written} scraped on {self.store.root}")
@@ -0,0 +1,118 @@
+from datetime import datetime
+from urllib.parse import urlsplit
+import pandas as pd
+import argparse
+import os
+import logging
+
+import src.logging_config
+from src.extraction import ExtractionEngine
+from src.html_cache import HtmlCache
+from src.parsing import parse_html
+from src.sites import SITES
+from src.store import NewsStore
+logger = logging.getLogger(__name__)
+
+
+def default_reparse_path() -> str:
+    """Path of the rebuilt store inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'reparsed')
+
+
+def _normalize_url(url: str) -> str:
+    """URL without scheme, www, query and final slash, so live and archived URLs match"""
+    parts = urlsplit(url if '//' in url else f'//{url}')
+    host = parts.netloc.lower().removeprefix('www.')
+    return f"{host}{parts.path}".rstrip('/')
+
+
+def _site_pages(fonts: list[str] = None) -> dict:
+    """The (font, page) of each normalized page URL of the websites"""
+    return {
+        _normalize_url(f'{spec.url}{page}'): (font, page)
+        for font, spec in SITES.items() if fonts is None or font in fonts
+        for page in spec.pages
+    }
+
+
+def iter_cached_news(cache: HtmlCache, fonts: list[str] = None):
+    """Parse again the cached pages of the websites, without any network
+
+    The relative times are resolved against the time each page was
+    downloaded or archived.
+
+    Yields
+    ------
+    tuple[datetime, pd.DataFrame]
+        The time of a cached page and its news, with a Font column
+    """
+    site_pages = _site_pages(fonts)
+    engines = {}
+
+    # chronological, so the store keeps the first observation of each news
+    entries = sorted(cache.entries(), key=lambda entry: entry[1])
+    for url, timestamp in entries:
+        site_page = site_pages.get(_normalize_url(url))
+        if site_page is None:
+            continue
+        font, page = site_page
+
+        html_source = cache.get(url, timestamp)
+        if html_source is None:
+            continue
+
+        engine = engines.setdefault(font, ExtractionEngine(SITES[font]))
+        reference = datetime.strptime(timestamp, '%Y%m%d%H%M%S')
+        try:
+            soup = parse_html(html_source, engine.page_strainer)
+            news_df = engine.build_dataframe(engine.iter_rows(soup, page, reference))
+            news_df = engine.clean(news_df, reference)
+        except ValueError as e:
+            logger.error(f"Error parsing {url} at {timestamp}: {e}")
+            continue
+
+        news_df['Font'] = font
+        yield reference, news_df
+
+
+def reparse(cache: HtmlCache = None, store: NewsStore = None, fonts: list[str] = None) -> int:
+    """Rebuild a dataset from the cached HTML
+
+    Parameters
+    ----------
+    cache : HtmlCache, optional
+        Cache of the pages, by default the one in data/html_cache
+    store : NewsStore, optional
+        Store receiving the news, by default a new one in data/reparsed
+    fonts : list[str], optional
+        Websites to parse, by default all
+
+    Returns
+    -------
+    int
+        Number of news written
+    """
+    cache = HtmlCache() if cache is None else cache
+    store = NewsStore(default_reparse_path()) if store is None else store
+
+    n_pages = 0
+    n_news = 0
+    for reference, news_df in iter_cached_news(cache, fonts):
+        n_news += store.append(news_df, reference)
+        n_pages += 1
+
+    # one file per page was written
+    store.compact()
+
+    logger.info(f"Sucess parsing {n_pages} cached pages, {n_news} news on {store.root}")
+    return n_news
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the dataset from the cached HTML, without network')
+    parser.add_argument('--fonts', nargs='*', choices=list(SITES), default=None, help='websites to parse')
+    parser.add_argument('--cache', default=None, help='folder of the cache, by default data/html_cache')
+    parser.add_argument('--root', default=None, help='folder of the rebuilt store, by default data/reparsed')
+    args = parser.parse_args()
+
+    reparse(HtmlCache(args.cache), NewsStore(args.root or default_reparse_path()), args.fonts)
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+import random
+import threading
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+
+class SiteScheduler():
+    """Run a job for each website periodically, each on its own thread
+
+    Every website has its own interval, with a random jitter so the
+    requests do not always hit the servers at the same second. As each
+    website runs on its own thread, a slow or failing website only delays
+    its next run, never the others.
+
+    A job returning a number of seconds sets the interval of its website
+    from then on, so a website can adapt its own polling.
+
+    Examples
+    --------
+    >>> scheduler = SiteScheduler({'G1': scrap_g1, 'CNN': scrap_cnn}, {'G1': 300, 'CNN': 900})
+    >>> scheduler.run()  # until stop() or Ctrl+C
+    """
+
+    def __init__(self, jobs: dict, intervals: dict, jitter: float = 0.1, default_interval: float = 600):
+        """
+        Parameters
+        ----------
+        jobs : dict
+            Function without arguments running one scraping, for each website.
+            If it returns a number, that is the new interval of the website
+        intervals : dict
+            Seconds between the start of two runs, for each website
+        jitter : float, optional
+            Maximum random variation of the intervals, as a fraction, by default 0.1
+        default_interval : float, optional
+            Interval of the websites without one in intervals, by default 600
+        """
+        self.jobs = jobs
+        self.intervals = {name: intervals.get(name, default_interval) for name in jobs}
+        self.jitter = jitter
+
+        self.next_runs = {}
+        self._stop = threading.Event()
+
+
+    def _delay(self, name: str) -> float:
+        """Interval of a website, with the random jitter"""
+        interval = self.intervals[name]
+        return max(0.0, interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+    def _loop(self, name: str):
+        """Run the job of one website until the scheduler stops"""
+        # the first runs are spread over the jitter too
+        self._stop.wait(random.uniform(0, self.jitter * self.intervals[name]))
+
+        while not self._stop.is_set():
+            start = datetime.now()
+            try:
+                interval = self.jobs[name]()
+                if interval is not None:
+                    self.intervals[name] = interval
+            except Exception as e:
+                logger.error(f"Error on the scheduled run of {name}: {e}")
+
+            # the interval counts from the start, a long run shortens the wait
+            self.next_runs[name] = start + timedelta(seconds=self._delay(name))
+            wait = (self.next_runs[name] - datetime.now()).total_seconds()
+            if wait < 0:
+                logger.warning(f"Run of {name} took longer than its interval, {-wait:.0f}s late")
+
+            self._stop.wait(max(0.0, wait))
+
+
+    def stop(self):
+        """Let the current runs finish and stop scheduling new ones"""
+        self._stop.set()
+
+
+    def run(self):
+        """Start the threads and block until the scheduler is stopped"""
+        threads = [
+            threading.Thread(target=self._loop, args=(name,), name=f'scheduler-{name}', daemon=True)
+            for name in self.jobs
+        ]
+        for thread in threads:
+            thread.start()
+
+        logger.info(f"Scheduling {', '.join(f'{name} every {interval:.0f}s' for name, interval in self.intervals.items())}")
+
+        try:
+            # waits with a timeout, so Ctrl+C is not blocked
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            logger.info("Stopping the scheduler")
+            self.stop()
+
+        for thread in threads:
+            thread.join()
@@ -1,158 +1,289 @@
 import selenium
 from bs4 import BeautifulSoup
-from time import sleep
+from time import perf_counter
+from itertools import chain
 from selenium.webdriver.common.by import By
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
 
 import src.logging_config
+from src.waits import PageWaiter
+from src.drivers import driver_memory
+from src.incremental import IncrementalExtractor
+from src import http_fetch
+from src import sites
+from src.extraction import SiteSpec, ExtractionEngine
+from src.parsing import parse_html
+from src.html_cache import HtmlCache, now_timestamp
+from src.metrics import Metrics
+from src.records import Article
 logger = logging.getLogger(__name__)
 
-class G1NewsScraper():
-    """Scraper for the G1 news website"""
+class NewsScraper():
+    """Scraper for a news website, following the SiteSpec of the website"""
+
+    # spec of the website, set by the subclasses
+    spec = None
+
+    def __init__(self, n_scrolls = 10, wait_timeout = 10, known_titles = None, stop_fraction = 0.8,
+                 spec: SiteSpec = None, cache: HtmlCache = None, metrics: Metrics = None, trim_dom: bool = True):
+        self.spec = self.spec if spec is None else spec
+        self.engine = ExtractionEngine(self.spec)
+
+        self.url = self.spec.url
+
+        # the subpages to acess
+        self.pages = list(self.spec.pages)
 
-    def __init__(self, n_scrolls = 10):
-        self.url = 'https://g1.globo.com/'
-        
         # how many times to scrool the page
         self.n_scrolls = n_scrolls
-        
-        
-    def _scroll_page(self, driver: selenium.webdriver):
+
+        # ceiling, in seconds, of each wait for the page to load
+        self.wait_timeout = wait_timeout
+
+        # titles already on the dataset. If given, the news are parsed while
+        # scrolling, stopping when stop_fraction of the new ones are known
+        self.known_titles = known_titles
+        self.stop_fraction = stop_fraction
+
+        # in incremental mode, the news already parsed are emptied on the
+        # page, so the memory of the browser does not grow with the scrolls
+        self.trim_dom = trim_dom
+
+        # if given, the HTML of the pages is saved to be parsed again offline
+        self.cache = cache
+
+        # timers and counters of the stages, tagged by site and theme
+        self.metrics = Metrics() if metrics is None else metrics
+
+        self.container_selector = self.spec.container
+        self.item_selector = self.engine.item_css
+        self.highlight_selector = self.spec.highlight_area or self.spec.highlight_item
+        self.load_more_selector = self.spec.load_more
+
+        # parse only the news containers and the 'load more' button of the
+        # page, and only the news and the button on the pagination pages
+        self.page_strainer = self.engine.page_strainer
+        self.items_strainer = self.engine.items_strainer
+
+
+    def _tags(self, page: str = None) -> dict:
+        """Tags of the metrics of a subpage, or of the whole website"""
+        return {'site': self.spec.font, 'theme': page or None}
+
+
+    def _scroll_page(self, driver: selenium.webdriver, waiter: PageWaiter, extractor: IncrementalExtractor = None):
         """Scroll the page by n_scrolls iterations"""
-        
         logger.info(f"Scrolling page {self.n_scrolls} times")
-        
-        current_height = driver.execute_script("return document.body.scrollHeight")
 
+        current_height, n_items = waiter.page_state(driver, self.item_selector)
+
+        # the first screen may already be all known
+        if extractor is not None and extractor.extract_and_check(driver):
+            return
+
+        if self.spec.scroll_mode == 'click':
+            current_height = self._scroll_clicking(driver, waiter, current_height, n_items, extractor)
+        else:
+            current_height = self._scroll_autoload(driver, waiter, current_height, n_items, extractor)
+
+        logger.info(f"Scrolled to height {current_height}")
+
+
+    def _scroll_autoload(self, driver, waiter: PageWaiter, current_height: int, n_items: int,
+                         extractor: IncrementalExtractor = None) -> int:
+        """Scroll pages that load the news by themselves, clicking the button only when it appears"""
         for i in range(self.n_scrolls):
             # scroll to the end of the page
             driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight)")
-            sleep(1)
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            
-            
+            loaded = waiter.wait_for_new_content(driver, current_height, n_items, self.item_selector,
+                                                 button_selector=self.load_more_selector)
+
             # if not autoload
-            if new_height == current_height:
+            if loaded == 'button':
                 # click the 'Veja mais' button
-                driver.find_element(By.CSS_SELECTOR, value='.load-more > a:nth-child(1)').click()
-                
+                driver.find_element(By.CSS_SELECTOR, value=self.load_more_selector).click()
+
                 # repeat the scroll
                 driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight)")
-                current_height = driver.execute_script("return document.body.scrollHeight")
-                
-            else:
-                current_height = new_height
-            
-            
-            logger.debug(f"Scroll {i + 1}/{self.n_scrolls}. Height {current_height}")
-            # time for the page to load
-            sleep(4)
-            
-        logger.info(f"Scrolled to height {current_height}")
+                loaded = waiter.wait_for_new_content(driver, current_height, n_items, self.item_selector)
+
+            if loaded is None:
+                logger.warning(f"No new news loaded after scroll {i + 1}")
+
+            current_height, n_items = waiter.page_state(driver, self.item_selector)
+
+            logger.debug(f"Scroll {i + 1}/{self.n_scrolls}. Height {current_height}, {n_items} news")
+
+            if extractor is not None and extractor.extract_and_check(driver):
+                break
+
+        return current_height
+
+
+    def _scroll_clicking(self, driver, waiter: PageWaiter, current_height: int, n_items: int,
+                         extractor: IncrementalExtractor = None) -> int:
+        """Scroll pages that only load news with the button, clicking it on every scroll"""
+        driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight - 1000)")
+
+        for i in range(self.n_scrolls):
+            # try to click in the 'Ver mais noticias' button
+            try:
+                driver.find_element(By.CSS_SELECTOR, value=self.load_more_selector).click()
+            except Exception:
+                logger.warning(f"Unable to click on see more button")
+
+            # scroll to the end of the page
+            driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight - 1000)")
+
+            # wait for the news to load and the button to be available again
+            loaded = waiter.wait_for_new_content(driver, current_height, n_items, self.item_selector)
+            if loaded is None:
+                logger.warning(f"No new news loaded after scroll {i + 1}")
+            elif i + 1 < self.n_scrolls:
+                waiter.wait_clickable(driver, self.load_more_selector)
+
+            current_height, n_items = waiter.page_state(driver, self.item_selector)
+
+            logger.debug(f"Scroll {i + 1}/{self.n_scrolls}. Height {current_height}, {n_items} news")
+
+            if extractor is not None and extractor.extract_and_check(driver):
+                break
+
+        return current_height
+
+
+    def _parse_highlights(self, soup: BeautifulSoup, page: str = '') -> list[dict]:
+        """Obtain the highlighted news on the top of the page"""
+        return list(self.engine.iter_highlights(soup, page))
+
+
+    def _parse_feed_item(self, news: BeautifulSoup, page: str = '') -> dict:
+        """Obtain the info of a individual news of the feed"""
+        return self.engine.parse_item(news, page)
+
+
+    def _parse_page_items(self, soup: BeautifulSoup, page: str = '') -> list[dict]:
+        """Obtain all the news of the feed"""
+        return list(self.engine.iter_items(soup, page))
+
 
-        
-    def _get_scraped_news(self, driver: selenium.webdriver):
-        """Obtain the scraped news from the website"""
+    def _new_extractor(self, page: str) -> IncrementalExtractor:
+        """Extractor of the news while scrolling, only in incremental mode"""
+        if self.known_titles is None:
+            return None
+
+        return IncrementalExtractor(self.item_selector, lambda news: self.engine.parse_item(news, page),
+                                    self.known_titles, self.stop_fraction, self.trim_dom)
+
+
+    def _get_scraped_rows(self, driver: selenium.webdriver, page: str = '') -> list[dict]:
+        """Obtain the scraped news from the loaded page"""
         logger.info("Scraping data")
-        
-        html_source = driver.page_source
-        soup = BeautifulSoup(html_source, 'lxml')
-        
-        # the news are split in many containers
-        content_blocks = soup.find_all('div', class_ = '_evg') 
-        
-        highlight_area = soup.find('div', class_ = 'row small-collapse large-uncollapse')
-        highlighted_news = highlight_area.find_all('ul', class_ = 'bstn-hl-list')
-        
-        titles = []
-        times = []
-        themes = []
-        headers = []
-        resumes = []
-        highlight = []
-
-        for hnews in highlighted_news:
-            title = hnews.find('span', class_ = 'bstn-hl-title gui-color-primary gui-color-hover gui-color-primary-bg-after')
-            titles.append(title.text)
-            
-            theme = hnews.find('span', class_ = 'bstn-hl-chapeu gui-subject gui-color-primary-bg-after')
-            themes.append(None if theme is None else theme.text)
-
-            # FIXME
-            times.append('Há 1 minuto')
-
-            resumes.append(None)
-            headers.append(None)
-            
-            highlight.append(1)
-
-        for block in content_blocks:
-            news_list = block.find_all('div', class_ = 'feed-post-body')
-            for news in news_list:
-                # obtain the info of a individual news
-                title = news.find('a', class_ = 'feed-post-link gui-color-primary gui-color-hover')
-                titles.append(title.text)
-                
-                header = news.find('span', 'feed-post-header-chapeu')
-                headers.append(None if header is None else header.text)
-
-                time = news.find('span', 'feed-post-datetime')
-                times.append(None if time is None else time.text)
-
-                theme = news.find('span', 'feed-post-metadata-section')
-                themes.append(None if theme is None else theme.text)
-
-                resume = news.find('div', class_='feed-post-body-resumo')
-                resumes.append(None if resume is None else resume.text)
-                
-                highlight.append(0)
-
-        # create the final dataframe
-        news_df = pd.DataFrame({
-            'Title': titles,
-            'Time': times,
-            'Theme': themes,
-            'Header': headers,
-            'Resume': resumes,
-            'Highlighted': highlight
-        })
-        
-        logger.info(f"Sucess scraping {len(news_df)} news from {self.url}")
-        
-        return news_df
-    
+
+        with self.metrics.timer('page_source', **self._tags(page)):
+            html_source = driver.page_source
+        if self.cache is not None:
+            self.cache.put(f'{self.url}{page}', now_timestamp(), html_source)
+
+        with self.metrics.timer('parse', **self._tags(page)):
+            soup = parse_html(html_source, self.page_strainer)
+            return list(self.engine.iter_rows(soup, page))
+
+
+    def _get_incremental_rows(self, driver: selenium.webdriver, page: str, extractor: IncrementalExtractor) -> list[dict]:
+        """Obtain the news already parsed while scrolling, plus the highlights"""
+        logger.info("Scraping highlights")
+
+        with self.metrics.timer('parse', **self._tags(page)):
+            rows = []
+            if self.highlight_selector is not None:
+                highlight_html = driver.execute_script(
+                    "return document.querySelector(arguments[0]).outerHTML", self.highlight_selector
+                )
+                rows = self.engine.iter_highlights(BeautifulSoup(highlight_html, 'lxml'), page)
+
+            return list(chain(rows, extractor.items))
+
+
+    def _scrape_rows(self, driver: selenium.webdriver, page: str, waiter: PageWaiter) -> list[dict]:
+        """Load, scroll and scrape one subpage, measuring its time and the memory of the browser"""
+        with self.metrics.timer('page', **self._tags(page)):
+            rows = self._load_and_scrape_rows(driver, page, waiter)
+
+        memory_mb = driver_memory(driver) / 2**20
+        self.metrics.gauge('browser_memory_mb', memory_mb, **self._tags(page))
+        logger.info(f"Browser using {memory_mb:.0f} MB after {self.url}{page}")
+
+        return rows
+
+
+    def _load_and_scrape_rows(self, driver: selenium.webdriver, page: str, waiter: PageWaiter) -> list[dict]:
+        logger.info(f"Loading {self.url}{page}")
+        with self.metrics.timer('load', **self._tags(page)):
+            driver.get(f'{self.url}{page}')
+            waiter.wait_page_loaded(driver, self.container_selector)
+
+        extractor = self._new_extractor(page)
+        with self.metrics.timer('scroll', **self._tags(page)):
+            self._scroll_page(driver, waiter, extractor)
+
+        if extractor is None:
+            return self._get_scraped_rows(driver, page)
+
+        return self._get_incremental_rows(driver, page, extractor)
+
+
+    def _scrape_page(self, driver: selenium.webdriver, page: str, waiter: PageWaiter) -> pd.DataFrame:
+        """Load, scroll and scrape one subpage, as a dataframe"""
+        return self.engine.build_dataframe(self._scrape_rows(driver, page, waiter))
+
+
     def _convert_to_datetime(self, time_str: str) -> datetime:
-        """convert "Há X [time unit]" to datetime"""
-        if 'hora' in time_str or 'horas' in time_str:
-            hours_ago = int(time_str.split(' ')[1])
-            return datetime.now() - timedelta(hours=hours_ago)
-        
-        elif 'minuto' in time_str or 'minutos' in time_str:
-            minutes_ago = int(time_str.split(' ')[1])
-            return datetime.now() - timedelta(minutes=minutes_ago)
-        
-        elif 'dia' in time_str or 'dias' in time_str:
-            days_ago = int(time_str.split(' ')[1])
-            return datetime.now() - timedelta(days=days_ago)
-        
-        elif 'mês' in time_str or 'meses' in time_str:
-            months_ago = int(time_str.split(' ')[1])
-            # Note: This is an approximation as timedelta does not support months directly
-            return datetime.now() - timedelta(days=30*months_ago)
-        else:
-            return None  # If the format does not match, return None
-        
-    
-    def _data_cleaning(self, news_df: pd.DataFrame):
+        """Convert the time of a news to datetime"""
+        return self.engine.convert_time(time_str)
+
+
+    def _data_cleaning(self, news_df: pd.DataFrame, page: str = None) -> pd.DataFrame:
         """Do simple data cleaning after the scrap"""
-        news_df['Time'] = news_df['Time'].apply(self._convert_to_datetime)
+        with self.metrics.timer('cleaning', **self._tags(page)):
+            news_df = self.engine.clean(news_df)
+
+        self.metrics.count('news', len(news_df), **self._tags(page))
+        return news_df
+
+
+    def _clean_articles(self, rows: list[dict], page: str = None) -> list[Article]:
+        """The same cleaning of _data_cleaning, giving Article records"""
+        with self.metrics.timer('cleaning', **self._tags(page)):
+            articles = list(self.engine.iter_articles(rows))
+
+        self.metrics.count('news', len(articles), **self._tags(page))
+        return articles
+
+
+    def _report_waits(self, waiter: PageWaiter, name: str, total_time: float, page: str = None):
+        """Log and count the time spent waiting for the page"""
+        waiter.report(name, total_time)
+        self.metrics.count('wait_seconds', waiter.waiting_time, **self._tags(page))
+        self.metrics.count('wait_timeouts', waiter.n_timeouts, **self._tags(page))
+
+
+    def merge_pages(self, news_dfs: list[pd.DataFrame]) -> pd.DataFrame:
+        """Merge the results of the subpages in one dataframe"""
+        if len(news_dfs) == 0:
+            raise ValueError(f"No page of {self.url} was scraped")
+
+        news_df = pd.concat(news_dfs, axis='rows')
+
+        logger.info(f"Sucess scraping {len(news_df)} news from {self.url}")
+
         return news_df
 
 
     def scrap_news(self, driver: selenium.webdriver) -> pd.DataFrame:
-        """Scrap the news for the G1 website
+        """Scrap the news for the website, all its subpages in sequence
 
         Parameters
         ----------
@@ -164,294 +295,240 @@ class G1NewsScraper():
         pd.DataFrame
             The news scraped
         """
-        
-        logger.info(f"Loading {self.url}")
-        driver.get(self.url)
-        sleep(1)
-        
-        self._scroll_page(driver)
-        
-        news_df = self._get_scraped_news(driver)
-        
-        news_df = self._data_cleaning(news_df)
-        
-        return news_df
-        
-        
-        
-class CNNNewsScraper():
-    def __init__(self, n_scrolls = 10):
-        self.url = 'https://www.cnnbrasil.com.br/'
-        
-        # the subpages to acess
-        self.themes = ['politica', 'economia', 'esportes', 'pop']
-        
-        self.n_scrolls = n_scrolls
-        
-        
-    def _scroll_page(self, driver):
-        """Scroll the page by n_scrolls iterations"""
-        logger.info(f"Scrolling page {self.n_scrolls} times")
-        
-        current_height = driver.execute_script("return document.body.scrollHeight")
-        driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight - 1000)")
-
-        for i in range(self.n_scrolls):
-            # try to click in the 'Ver mais noticias' button
-            try:
-                driver.find_element(By.CSS_SELECTOR, value='.block-list-get-more-btn').click()
-            except Exception:
-                logger.warning(f"Unable to click on see more button")
-            
-            # scroll to the end of the page
-            driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight - 1000)")
-            current_height = driver.execute_script("return document.body.scrollHeight")
-            
-            
-            logger.debug(f"Scroll {i + 1}/{self.n_scrolls}. Height {current_height}")
-            # time for the page to load
-            sleep(4)
-            
-        logger.info(f"Scrolled to height {current_height}")
+        start = perf_counter()
+        waiter = PageWaiter(self.wait_timeout)
 
-    
-    def _scrape_news_from_page(self, driver: selenium.webdriver, theme: str) -> pd.DataFrame:
-        """Scrape the news of a given page (url/theme)"""
-
-        html_source = driver.page_source
-        soup = BeautifulSoup(html_source, 'lxml')
-        
-        # one container contains all the news
-        content_block = soup.find('div', class_ = 'col__l--9 col--12')
-        news_list = content_block.find_all('li', class_ = 'home__list__item')
-        
-        highlight_area = soup.find('ul', class_ = 'three__highlights__list row')
-        highlighted_news = highlight_area.find_all('div', class_ = 'three__highlights__titles')
-        
-        titles = []
-        times = []
-        themes = []
-        highlight = []
-        
-        for hnews in highlighted_news:
-            title = hnews.find('h2', class_ = 'block__news__title')
-            titles.append(title.text)
-            
-            themes.append(theme)
-
-            # FIXME
-            times.append(datetime.now().strftime('%d/%m/%Y %H:%M'))
-
-            highlight.append(1)
-        
-        for news in news_list:
-            # obtain the data for a individual news
-            title = news.find('h3', class_ = 'news-item-header__title')
-            titles.append(title.text)
-
-            time = news.find('span', 'home__title__date')
-            times.append(None if time is None else time.text)
-            
-            themes.append(theme)
-            
-            highlight.append(0)
-            
-        data = pd.DataFrame({
-            'Title': titles,
-            'Time': times,
-            'Theme': themes,
-            'Highlighted': highlight
-        })
-
-        return data
-    
-    
-    def _get_scraped_data(self, driver: selenium.webdriver) -> pd.DataFrame:
-        """Scrape news for all the subpages in self.themes"""
         news_dfs = []
-
-        for theme in self.themes:
-            # scrape the page
+        for page in self.pages:
             try:
-                logger.info(f"Loading {self.url}{theme}")
-                driver.get(f'{self.url}{theme}')
-                sleep(5)
-                
-                self._scroll_page(driver)
-                
-                data = self._scrape_news_from_page(driver, theme)
-                
-                news_dfs.append(data)
+                news_dfs.append(self._scrape_page(driver, page, waiter))
             except Exception as e:
-                logger.error(f"Error scraping {self.url}{theme}: {e}")
-            
-        # merge all the results of pages
-        news_df = pd.concat(news_dfs, axis='rows')
-        
-        logger.info(f"Sucess scraping {len(news_df)} news from {self.url}")
-        
-        return news_df
-    
-
-    def _convert_to_datetime(self, time_str:str) -> datetime:
-        """Convert date of format 'dd/MM/yyyy às HH:mm' to datetime"""
-        # Remove the 'às' and strip any extra whitespace
-        cleaned_str = time_str.strip().replace(' às ', ' ')
-        # Convert to datetime using the appropriate format
-        return datetime.strptime(cleaned_str, '%d/%m/%Y %H:%M')
-        
-        
-    def _data_cleaning(self, news_df: pd.DataFrame) -> pd.DataFrame:
-        """Do simple data cleaning after the scrap"""
-        news_df['Time'] = news_df['Time'].apply(self._convert_to_datetime)
+                logger.error(f"Error scraping {self.url}{page}: {e}")
+
+        news_df = self.merge_pages(news_dfs)
+
+        news_df = self._data_cleaning(news_df)
+
+        self._report_waits(waiter, self.url, perf_counter() - start)
 
-        news_df['Title'] = news_df['Title'].str.strip()
-        
         return news_df
-        
 
-    def scrap_news(self, driver: selenium.webdriver) -> pd.DataFrame:
-        """Scrap the news for the CNN website
+
+    def scrap_page(self, driver: selenium.webdriver, page: str) -> pd.DataFrame:
+        """Scrap only one of the subpages in self.pages
+
+        Used to split the scraping between many drivers. Merging the
+        results with merge_pages gives the same data as scrap_news.
 
         Parameters
         ----------
         driver : selenium.webdriver
             Current webdriver
+        page : str
+            Subpage to scrap
 
         Returns
         -------
         pd.DataFrame
-            The news scraped
+            The news scraped for the subpage
         """
-        logger.info(f"Loading {self.url}")
-        driver.get(self.url)
-        
-        news_df = self._get_scraped_data(driver)
-        
-        news_df = self._data_cleaning(news_df)
-        
-        return news_df
-    
-    
-class UolNewsScraper():
-    """Scraper for the UOL news website"""
+        start = perf_counter()
+        waiter = PageWaiter(self.wait_timeout)
 
-    def __init__(self, n_scrolls = 10):
-        self.url = 'https://noticias.uol.com.br/?clv3=true'
-        
-        # how many times to scrool the page
-        self.n_scrolls = n_scrolls
-        
-        
-    def _scroll_page(self, driver: selenium.webdriver):
-        """Scroll the page by n_scrolls iterations"""
-        logger.info(f"Scrolling page {self.n_scrolls} times")
-        
-        current_height = driver.execute_script("return document.body.scrollHeight")
+        news_df = self._scrape_page(driver, page, waiter)
 
-        for i in range(self.n_scrolls):
-            # scroll to the end of the page
-            driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight)")
-            sleep(1)
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            
-            
-            # if not autoload
-            if new_height == current_height:
-                # click the 'Veja mais' button
-                driver.find_element(By.CSS_SELECTOR, value='.btn-search').click()
-                
-                # repeat the scroll
-                driver.execute_script(f"window.scrollTo(0,document.body.scrollHeight)")
-                current_height = driver.execute_script("return document.body.scrollHeight")
-            else:
-                current_height = new_height
-            
-            logger.debug(f"Scroll {i + 1}/{self.n_scrolls}. Height {current_height}")
-            # time for the page to load
-            sleep(4)
-            
-        logger.info(f"Scrolled to height {current_height}")
+        news_df = self._data_cleaning(news_df, page)
 
-        
-    def _get_scraped_news(self, driver: selenium.webdriver):
-        """Obtain the scraped news from the website"""
-        logger.info("Scraping data")
-        
-        html_source = driver.page_source
-        soup = BeautifulSoup(html_source, 'lxml')
-        
-        content = soup.find('section', class_ = 'latest-news')
-        news_list = content.find_all('div', class_ = 'thumb-caption')
-        
-        
-        titles = []
-        times = []
-        resumes = []
-        highlight = []
-        
-        # main header news
-        titles.append(soup.find('h2').text)
-        times.append(datetime.now().strftime('%d/%m/%Y %Hh%M'))
-        resumes.append(None)
-        highlight.append(1)
-
-        for news in news_list:
-            # obtain the info of a individual news
-            title = news.find('h3', class_ = 'thumb-title')
-            titles.append(title.text)
-
-            time = news.find('time', class_ = 'thumb-date')
-            times.append(None if time is None else time.text)
-
-            resume = news.find('p', class_ = 'thumb-description')
-            resumes.append(None if resume is None else resume.text)
-            highlight.append(0)
-
-        # create the final dataframe
-        news_df = pd.DataFrame({
-            'Title': titles,
-            'Time': times,
-            'Resume': resumes,
-            'Highlighted': highlight
-        })     
+        self._report_waits(waiter, f'{self.url}{page}', perf_counter() - start, page)
 
-        logger.info(f"Sucess scraping {len(news_df)} news from {self.url}")
-        
-        return news_df
-    
-    def _convert_to_datetime(self, time_str: str) -> datetime:
-        """Convert date in format  '13/07/2024 19h39' to datetime"""
-        return datetime.strptime(time_str, '%d/%m/%Y %Hh%M')
-        
-    
-    def _data_cleaning(self, news_df: pd.DataFrame):
-        """Do simple data cleaning after the scrap"""
-        news_df['Time'] = news_df['Time'].apply(self._convert_to_datetime)
         return news_df
 
 
-    def scrap_news(self, driver: selenium.webdriver) -> pd.DataFrame:
-        """Scrap the news for the G1 website
+    def iter_news(self, driver: selenium.webdriver):
+        """Scrap the news for the website, yielding them as each subpage is parsed
+
+        The streaming version of scrap_news: the news of a subpage are
+        available before the next one is loaded, and are never merged in
+        one dataframe.
 
         Parameters
         ----------
         driver : selenium.webdriver
             Current webdriver
 
+        Yields
+        ------
+        Article
+            The news scraped, already cleaned
+        """
+        start = perf_counter()
+        waiter = PageWaiter(self.wait_timeout)
+
+        n_pages = 0
+        for page in self.pages:
+            try:
+                rows = self._scrape_rows(driver, page, waiter)
+            except Exception as e:
+                logger.error(f"Error scraping {self.url}{page}: {e}")
+                continue
+
+            n_pages += 1
+            yield from self._clean_articles(rows, page)
+
+        self._report_waits(waiter, self.url, perf_counter() - start)
+
+        if n_pages == 0:
+            raise ValueError(f"No page of {self.url} was scraped")
+
+
+    def scrap_page_articles(self, driver: selenium.webdriver, page: str) -> list[Article]:
+        """Scrap only one of the subpages in self.pages, as Article records
+
+        The same as scrap_page, to split the streaming between many drivers.
+        """
+        start = perf_counter()
+        waiter = PageWaiter(self.wait_timeout)
+
+        articles = self._clean_articles(self._scrape_rows(driver, page, waiter), page)
+
+        self._report_waits(waiter, f'{self.url}{page}', perf_counter() - start, page)
+
+        return articles
+
+
+    def _scrape_rows_http(self, session, page: str) -> list[dict]:
+        """Download and parse one subpage, following the 'load more' pages"""
+        page_url = f'{self.url}{page}'
+        with self.metrics.timer('fetch', **self._tags(page)):
+            html_source = http_fetch.get_html(session, page_url)
+        if self.cache is not None:
+            self.cache.put(page_url, now_timestamp(), html_source)
+
+        with self.metrics.timer('parse', **self._tags(page)):
+            soup = parse_html(html_source, self.page_strainer)
+
+        # the next pages are downloaded and parsed one after the other
+        with self.metrics.timer('pagination', **self._tags(page)):
+            rows = http_fetch.fetch_feed_pages(session, soup, page_url, lambda soup: self._parse_page_items(soup, page),
+                                               self.n_scrolls, button_selector=self.load_more_selector,
+                                               extractor=self._new_extractor(page), parse_only=self.items_strainer)
+        if len(rows) == 0:
+            raise ValueError(f"No news found on the HTML of {page_url}")
+
+        return list(chain(self.engine.iter_highlights(soup, page), rows))
+
+
+    def scrap_page_http(self, session, page: str) -> pd.DataFrame:
+        """Scrap one of the subpages in self.pages without a browser
+
+        The first page comes from the server HTML, and the 'load more'
+        pages are followed directly, n_scrolls times at most.
+
+        Parameters
+        ----------
+        session : requests.Session
+            Session used to download the pages
+        page : str
+            Subpage to scrap
+
+        Returns
+        -------
+        pd.DataFrame
+            The news scraped for the subpage
+        """
+        news_df = self.engine.build_dataframe(self._scrape_rows_http(session, page))
+
+        return self._data_cleaning(news_df, page)
+
+
+    def scrap_page_articles_http(self, session, page: str) -> list[Article]:
+        """Scrap one of the subpages in self.pages without a browser, as Article records
+
+        The same as scrap_page_http, for the streaming and the cluster workers.
+        """
+        return self._clean_articles(self._scrape_rows_http(session, page), page)
+
+
+    def scrap_news_http(self, session) -> pd.DataFrame:
+        """Scrap the news for the website without a browser
+
+        Parameters
+        ----------
+        session : requests.Session
+            Session used to download the pages
+
         Returns
         -------
         pd.DataFrame
             The news scraped
         """
-        logger.info(f"Loading {self.url}")
-        driver.get(self.url)
-        sleep(1)
-        
-        self._scroll_page(driver)
-        
-        news_df = self._get_scraped_news(driver)
-        
-        news_df = self._data_cleaning(news_df)
-        
-        return news_df
\ No newline at end of file
+        start = perf_counter()
+
+        news_dfs = []
+        for page in self.pages:
+            try:
+                news_dfs.append(self.scrap_page_http(session, page))
+            except Exception as e:
+                logger.error(f"Error scraping {self.url}{page}: {e}")
+
+        news_df = self.merge_pages(news_dfs)
+
+        logger.info(f"Scraped {self.url} over HTTP in {perf_counter() - start:.1f}s")
+
+        return news_df
+
+
+    def iter_news_http(self, session):
+        """Scrap the news for the website without a browser, yielding them as each subpage is parsed
+
+        Parameters
+        ----------
+        session : requests.Session
+            Session used to download the pages
+
+        Yields
+        ------
+        Article
+            The news scraped, already cleaned
+        """
+        start = perf_counter()
+
+        n_pages = 0
+        for page in self.pages:
+            try:
+                articles = self.scrap_page_articles_http(session, page)
+            except Exception as e:
+                logger.error(f"Error scraping {self.url}{page}: {e}")
+                continue
+
+            n_pages += 1
+            yield from articles
+
+        if n_pages == 0:
+            raise ValueError(f"No page of {self.url} was scraped")
+
+        logger.info(f"Scraped {self.url} over HTTP in {perf_counter() - start:.1f}s")
+
+
+
+class G1NewsScraper(NewsScraper):
+    """Scraper for the G1 news website"""
+    spec = sites.G1
+
+
+class CNNNewsScraper(NewsScraper):
+    """Scraper for the CNN news website, one subpage for each theme"""
+    spec = sites.CNN
+
+    @property
+    def themes(self) -> list[str]:
+        return self.pages
+
+    scrap_theme = NewsScraper.scrap_page
+    scrap_theme_http = NewsScraper.scrap_page_http
+    merge_themes = NewsScraper.merge_pages
+
+
+class UolNewsScraper(NewsScraper):
+    """Scraper for the UOL news website"""
+    spec = sites.UOL
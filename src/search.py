@@ -0,0 +1,365 @@
+import pandas as pd
+from functools import lru_cache
+from time import perf_counter
+import argparse
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+import os
+import logging
+
+import src.logging_config
+from src.analytics import PORTUGUESE_STOPWORDS
+from src.dedup_index import title_hash
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r'\w+')
+
+# columns of the search results, as the columns of the dataset
+RESULT_COLUMNS = ['Title', 'Time', 'Theme', 'Header', 'Resume', 'Font', 'Highlighted', 'Link']
+
+# weights of the Title, Header and Resume on the relevance
+WEIGHTS = (3.0, 1.5, 1.0)
+
+
+def fold(text: str) -> str:
+    """Lower case text without accents"""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+STOPWORDS = frozenset(fold(word) for word in PORTUGUESE_STOPWORDS)
+
+# suffix rules of each step of a light version of the RSLP stemmer, over the
+# words without accents: (suffix, minimum size of the stem, replacement),
+# the longest suffixes first
+_PLURAL = [
+    ('oes', 3, 'ao'), ('aes', 1, 'ao'), ('ais', 1, 'al'), ('eis', 2, 'el'), ('ois', 2, 'ol'),
+    ('ns', 1, 'm'), ('les', 3, 'l'), ('res', 3, 'r'), ('is', 2, 'il'), ('s', 2, ''),
+]
+_FEMININE = [
+    ('inha', 3, 'inho'), ('eira', 3, 'eiro'), ('ona', 3, 'ao'), ('ora', 3, 'or'), ('esa', 3, 'es'),
+    ('osa', 3, 'oso'), ('ica', 3, 'ico'), ('ada', 2, 'ado'), ('ida', 3, 'ido'), ('iva', 3, 'ivo'),
+    ('ima', 3, 'imo'), ('na', 4, 'no'),
+]
+_DEGREE = [
+    ('issimo', 3, ''), ('errimo', 4, ''), ('zinho', 2, ''), ('inho', 3, ''), ('zao', 2, ''),
+]
+_NOUN = [
+    ('alizacao', 5, ''), ('izacao', 5, ''), ('amento', 3, ''), ('imento', 3, ''), ('abilidade', 5, ''),
+    ('idade', 4, ''), ('mento', 6, ''), ('izado', 5, ''), ('ativo', 4, ''), ('acao', 3, ''),
+    ('ador', 3, ''), ('edor', 3, ''), ('idor', 4, ''), ('ismo', 3, ''), ('ista', 4, ''), ('encia', 3, ''),
+    ('ancia', 4, ''), ('eiro', 3, ''), ('agem', 3, ''), ('ante', 2, ''), ('oso', 3, ''), ('ivo', 4, ''),
+    ('ico', 4, ''), ('cao', 3, ''), ('eza', 3, ''),
+]
+_VERB = [
+    ('ariamos', 2, ''), ('eriamos', 3, ''), ('iriamos', 3, ''), ('assemos', 2, ''), ('essemos', 2, ''),
+    ('aramos', 2, ''), ('eramos', 3, ''), ('iramos', 3, ''), ('avamos', 2, ''), ('ariam', 2, ''),
+    ('eriam', 3, ''), ('iriam', 3, ''), ('assem', 2, ''), ('essem', 2, ''), ('issem', 3, ''),
+    ('arem', 2, ''), ('erem', 3, ''), ('irem', 3, ''), ('aram', 2, ''), ('eram', 3, ''), ('iram', 3, ''),
+    ('avam', 2, ''), ('ando', 2, ''), ('endo', 3, ''), ('indo', 3, ''), ('aria', 2, ''), ('eria', 3, ''),
+    ('iria', 3, ''), ('amos', 2, ''), ('emos', 2, ''), ('imos', 3, ''), ('ara', 2, ''), ('era', 3, ''),
+    ('ava', 2, ''), ('ado', 2, ''), ('ido', 3, ''), ('ar', 2, ''), ('er', 2, ''), ('ir', 3, ''),
+    ('ou', 3, ''), ('am', 2, ''), ('em', 2, ''), ('ei', 3, ''),
+]
+
+
+def _apply(word: str, rules: list[tuple]) -> tuple[str, bool]:
+    """Replace the first suffix of the rules leaving a big enough stem"""
+    for suffix, min_stem, replacement in rules:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+            return word[:len(word) - len(suffix)] + replacement, True
+    return word, False
+
+
+@lru_cache(maxsize=2**16)
+def stem(word: str) -> str:
+    """Stem of a Portuguese word without accents, so 'eleições' and 'eleição' give the same term
+
+    Follows the steps of the RSLP stemmer, with fewer rules: plural,
+    feminine, adverb, degree, then the noun or, if none applies, the verb
+    suffixes, and the final vowel.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+
+    if word.endswith('s'):
+        word, _ = _apply(word, _PLURAL)
+    if word.endswith('a'):
+        word, _ = _apply(word, _FEMININE)
+    if word.endswith('mente') and len(word) > 8:
+        word = word[:-5]
+    word, _ = _apply(word, _DEGREE)
+
+    word, removed = _apply(word, _NOUN)
+    if not removed:
+        word, _ = _apply(word, _VERB)
+
+    if len(word) > 3 and word[-1] in 'aeo':
+        word = word[:-1]
+    return word
+
+
+def analyze(text: str) -> list[str]:
+    """Terms of a text for the index: the stems of the words without accents and stopwords"""
+    if not isinstance(text, str):
+        return []
+    return [stem(word) for word in WORD.findall(fold(text)) if word not in STOPWORDS]
+
+
+def _term(text: str) -> str:
+    """The terms of a word or phrase of a query, quoted for FTS5, None if there is none"""
+    prefix = text.endswith('*')
+    terms = analyze(text.rstrip('*'))
+    if len(terms) == 0:
+        return None
+
+    # a prefix is searched on the stem, so the inflections are found too
+    return '"' + ' '.join(terms) + '"' + ('*' if prefix else '')
+
+
+def build_match(query: str) -> str:
+    """FTS5 expression of a search
+
+    The words, and the "phrases" between quotes, must all be on the news,
+    unless separated by OR. A word ending in * matches the words starting
+    with it.
+    """
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        if word == 'OR':
+            if parts and parts[-1] != 'OR':
+                parts.append('OR')
+            continue
+
+        term = _term(phrase or word)
+        if term is not None:
+            parts.append(term)
+
+    while parts and parts[-1] == 'OR':
+        parts.pop()
+    return ' '.join(parts)
+
+
+def default_search_path() -> str:
+    """Path of the search index of the CSV dataset"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'search.sqlite')
+
+
+class SearchIndex():
+    """Full-text index of the Title, Header and Resume of the news
+
+    The text is indexed by a sqlite FTS5 table as the stems of its words,
+    without accents and stopwords, so a search for 'eleição' finds
+    'Eleições'. The other columns of the news are kept on a table with
+    indexes on the Font, Theme, Highlighted and Time, used to filter the
+    results. Each news, by font and title hash, is indexed only once, so
+    the index is updated with each run.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = default_search_path() if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS news (
+                    id INTEGER PRIMARY KEY,
+                    font TEXT NOT NULL,
+                    title_hash INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    time TEXT,
+                    theme TEXT,
+                    theme_key TEXT,
+                    header TEXT,
+                    resume TEXT,
+                    highlighted INTEGER NOT NULL,
+                    link TEXT,
+                    UNIQUE (font, title_hash)
+                )
+            ''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS news_time ON news (time)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS news_font_time ON news (font, time)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS news_theme ON news (theme_key)')
+            # only the terms are kept by FTS5, the text is on the news table
+            self._connection.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS news_text USING fts5 (
+                    title, header, resume, content='', tokenize='unicode61'
+                )
+            ''')
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM news').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def add(self, news_df: pd.DataFrame) -> int:
+        """Index the news not indexed yet
+
+        Parameters
+        ----------
+        news_df : pd.DataFrame
+            News with the columns of the dataset
+
+        Returns
+        -------
+        int
+            Number of news indexed
+        """
+        news_df = news_df.reindex(columns=RESULT_COLUMNS).dropna(subset=['Title', 'Font'])
+        times = pd.to_datetime(news_df['Time'], errors='coerce', format='mixed')
+        news_df = news_df.astype(object).where(news_df.notna(), None)
+
+        n_added = 0
+        with self._lock, self._connection:
+            for row, time in zip(news_df.itertuples(index=False), times):
+                theme = row.Theme.strip() if isinstance(row.Theme, str) else None
+                cursor = self._connection.execute('''
+                    INSERT OR IGNORE INTO news
+                        (font, title_hash, title, time, theme, theme_key, header, resume, highlighted, link)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (row.Font, title_hash(row.Title), row.Title,
+                      None if pd.isna(time) else time.isoformat(sep=' ', timespec='seconds'),
+                      theme, None if theme is None else fold(theme), row.Header, row.Resume,
+                      int(row.Highlighted or 0), row.Link))
+                if cursor.rowcount == 0:
+                    continue
+
+                self._connection.execute(
+                    'INSERT INTO news_text (rowid, title, header, resume) VALUES (?, ?, ?, ?)',
+                    (cursor.lastrowid, *(' '.join(analyze(text)) for text in (row.Title, row.Header, row.Resume)))
+                )
+                n_added += 1
+
+        return n_added
+
+
+    def search(self, query: str, fonts: list[str] = None, theme: str = None, highlighted: bool = None,
+               start_time: str = None, end_time: str = None, limit: int = 20, sort: str = 'relevance') -> pd.DataFrame:
+        """Search the news
+
+        Parameters
+        ----------
+        query : str
+            Words that must be on the Title, Header or Resume, in any inflection.
+            "Phrases" between quotes, OR between words and prefixes ending in * are accepted
+        fonts : list[str], optional
+            Fonts of the news, by default all
+        theme : str, optional
+            Theme of the news, without considering case and accents
+        highlighted : bool, optional
+            Only the highlights, or only the other news, by default both
+        start_time : str, optional
+            First time of the news, like 2024-07-11 or 2024-07-11 12:00
+        end_time : str, optional
+            Last time of the news, a day alone includes the whole day
+        limit : int, optional
+            Maximum number of news, by default 20
+        sort : str, optional
+            'relevance' or 'time', the most recent first
+
+        Returns
+        -------
+        pd.DataFrame
+            The news found, with the columns of the dataset and the Score of relevance
+        """
+        match = build_match(query)
+        if not match:
+            return pd.DataFrame(columns=RESULT_COLUMNS + ['Score'])
+
+        conditions, params = ['news_text MATCH ?'], [match]
+        if fonts is not None:
+            conditions.append('news.font IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(fonts)))
+        if theme is not None:
+            conditions.append('news.theme_key = ?')
+            params.append(fold(theme.strip()))
+        if highlighted is not None:
+            conditions.append('news.highlighted > 0' if highlighted else 'news.highlighted = 0')
+        if start_time is not None:
+            conditions.append('news.time >= ?')
+            params.append(start_time)
+        if end_time is not None:
+            # a day alone includes all its times
+            conditions.append('news.time <= ?')
+            params.append(end_time + ' 23:59:59' if len(end_time) == 10 else end_time)
+
+        order = 'score' if sort == 'relevance' else 'news.time DESC'
+        with self._lock:
+            rows = self._connection.execute(f'''
+                SELECT news.title, news.time, news.theme, news.header, news.resume, news.font,
+                       news.highlighted, news.link, bm25(news_text, {', '.join(map(str, WEIGHTS))}) AS score
+                FROM news_text JOIN news ON news.id = news_text.rowid
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {order} LIMIT ?
+            ''', (*params, limit)).fetchall()
+
+        results_df = pd.DataFrame(rows, columns=RESULT_COLUMNS + ['Score'])
+        results_df['Time'] = pd.to_datetime(results_df['Time'])
+        # bm25 is lower for the best matches
+        results_df['Score'] = -results_df['Score']
+        return results_df
+
+
+    def rebuild(self, news_df: pd.DataFrame):
+        """Index again a whole dataset"""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM news')
+            self._connection.execute("INSERT INTO news_text (news_text) VALUES ('delete-all')")
+
+        self.add(news_df)
+        logger.info(f"Indexed {len(self)} news on {self.path}")
+
+
+    def rebuild_from_csv(self, csv_file_path: str):
+        """Index again a CSV dataset, like data/news.csv"""
+        self.rebuild(pd.read_csv(csv_file_path))
+
+
+if __name__ == '__main__':
+    from src.store import NewsStore
+
+    parser = argparse.ArgumentParser(description='Search the news of the store')
+    parser.add_argument('query', nargs='?', help='words to search, "phrases" between quotes, OR and prefixes ending in *')
+    parser.add_argument('--fonts', nargs='*', default=None, help='websites, by default all')
+    parser.add_argument('--theme', default=None, help='theme of the news')
+    highlighted = parser.add_mutually_exclusive_group()
+    highlighted.add_argument('--highlighted', action='store_const', const=True, default=None, help='only the highlights')
+    highlighted.add_argument('--no-highlighted', action='store_const', const=False, dest='highlighted',
+                             help='only the news that are not highlights')
+    parser.add_argument('--start-time', default=None, help='first time, like 2024-07-11 or "2024-07-11 12:00"')
+    parser.add_argument('--end-time', default=None, help='last time, a day alone includes the whole day')
+    parser.add_argument('--limit', type=int, default=20, help='number of news shown')
+    parser.add_argument('--sort', choices=['relevance', 'time'], default='relevance', help='order of the news')
+    parser.add_argument('--root', default=None, help='folder of the store, by default data/store')
+    parser.add_argument('--index', default=None, help='search index file, instead of the one of the store')
+    parser.add_argument('--rebuild-csv', default=None, metavar='CSV',
+                        help='index again a CSV dataset, like data/news.csv, on --index or data/search.sqlite')
+    args = parser.parse_args()
+
+    if args.rebuild_csv is not None:
+        SearchIndex(args.index).rebuild_from_csv(args.rebuild_csv)
+    elif args.query is None:
+        parser.error('the query is required')
+    else:
+        index = NewsStore(args.root).search_index if args.index is None else SearchIndex(args.index)
+
+        start = perf_counter()
+        results_df = index.search(args.query, args.fonts, args.theme, args.highlighted, args.start_time,
+                                  args.end_time, args.limit, args.sort)
+        elapsed = perf_counter() - start
+
+        with pd.option_context('display.max_colwidth', 80, 'display.width', 200):
+            print(results_df[['Time', 'Font', 'Title', 'Score']].to_string(index=False))
+        logger.info(f"Found {len(results_df)} news in {elapsed * 1000:.1f} ms")
@@ -0,0 +1,89 @@
+from src.extraction import SiteSpec
+
+# Specs of the news websites scraped. Adding a website is adding its
+# SiteSpec to SITES. The selectors are CSS selectors, the same used by the
+# browser and by the parser.
+
+
+G1 = SiteSpec(
+    font='G1',
+    url='https://g1.globo.com/',
+    # the news are split in many containers
+    container='div._evg',
+    item='div.feed-post-body',
+    fields={
+        'Title': 'a.feed-post-link',
+        'Time': 'span.feed-post-datetime',
+        'Theme': 'span.feed-post-metadata-section',
+        'Header': 'span.feed-post-header-chapeu',
+        'Resume': 'div.feed-post-body-resumo',
+    },
+    columns=('Title', 'Time', 'Theme', 'Header', 'Resume', 'Highlighted', 'Link'),
+    time_format='relative',
+    highlight_area='div.row.small-collapse.large-uncollapse',
+    highlight_item='ul.bstn-hl-list',
+    highlight_fields={
+        'Title': 'span.bstn-hl-title',
+        'Theme': 'span.bstn-hl-chapeu',
+    },
+    # the page has no time for the highlights, the exact one comes from
+    # the article page, with the enrichment
+    highlight_time='Há 1 minuto',
+    link='a.feed-post-link',
+    load_more='.load-more > a:nth-child(1)',
+    keep_classes=('load-more',),
+)
+
+
+CNN = SiteSpec(
+    font='CNN',
+    url='https://www.cnnbrasil.com.br/',
+    # the subpages to acess, each one is a theme
+    pages=('politica', 'economia', 'esportes', 'pop'),
+    page_theme=True,
+    # one container contains all the news
+    container='div.col__l--9.col--12',
+    all_containers=False,
+    item='li.home__list__item',
+    fields={
+        'Title': 'h3.news-item-header__title',
+        'Time': 'span.home__title__date',
+    },
+    columns=('Title', 'Time', 'Theme', 'Highlighted', 'Link'),
+    time_format='%d/%m/%Y às %H:%M',
+    highlight_area='ul.three__highlights__list.row',
+    highlight_item='div.three__highlights__titles',
+    highlight_fields={'Title': 'h2.block__news__title'},
+    strip_title=True,
+    load_more='.block-list-get-more-btn',
+    scroll_mode='click',
+    keep_classes=('block-list-get-more-btn',),
+    # the button requests the news with scripts
+    http_pagination=False,
+)
+
+
+UOL = SiteSpec(
+    font='UOL',
+    url='https://noticias.uol.com.br/?clv3=true',
+    container='section.latest-news',
+    all_containers=False,
+    item='div.thumb-caption',
+    fields={
+        'Title': 'h3.thumb-title',
+        'Time': 'time.thumb-date',
+        'Resume': 'p.thumb-description',
+    },
+    columns=('Title', 'Time', 'Resume', 'Highlighted', 'Link'),
+    time_format='%d/%m/%Y %Hh%M',
+    # the main header is the first h2 of the page
+    highlight_item='h2',
+    highlight_fields={'Title': None},
+    highlight_limit=1,
+    load_more='.btn-search',
+    keep_classes=('btn-search',),
+)
+
+
+# the websites scraped, indexed by the font name
+SITES = {spec.font: spec for spec in [G1, CNN, UOL]}
@@ -0,0 +1,378 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+from datetime import datetime
+import argparse
+import glob
+import os
+import uuid
+import logging
+
+import src.logging_config
+from src.analytics import AnalyticsIndex
+from src.dedup_index import DedupIndex, KnownTitles, normalize_title
+from src.search import SearchIndex
+from src.stories import StoryIndex
+from src.timeline import FrontPageTimeline
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['Title', 'Time', 'Theme', 'Header', 'Resume', 'Font', 'Highlighted', 'Link']
+
+SCHEMA = pa.schema([
+    ('Title', pa.string()),
+    ('Time', pa.timestamp('us')),
+    ('Theme', pa.string()),
+    ('Header', pa.string()),
+    ('Resume', pa.string()),
+    ('Font', pa.string()),
+    ('Highlighted', pa.int64()),
+    ('Link', pa.string()),
+])
+
+
+def default_store_path() -> str:
+    """Path of the store inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'store')
+
+
+class NewsStore():
+    """Append-only dataset of news, stored as Parquet partitions
+
+    Each run is written as new immutable files, one per date and font, in
+    root/date=YYYY-MM-DD/font=XX/part-<id>.parquet. A file is first written
+    with a temporary name and then renamed, so a crash never leaves a
+    partial file on the dataset. The date is the one of the news Time, or
+    of the run when the Time is not available.
+
+    The (Title, Font) keys already stored are kept in a DedupIndex, so the
+    dedup of a run never reads the dataset. A run is pending on the index
+    until its keys are recorded, and the runs interrupted after writing
+    their files are finished when the store is opened. The news are also clustered in
+    stories across the fonts by a StoryIndex, read as the Story column,
+    counted per day on the tables of an AnalyticsIndex, and indexed for
+    full-text search by a SearchIndex. The rank and highlight of every
+    news of each run, new or not, are kept on a FrontPageTimeline.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = default_store_path() if root is None else root
+        os.makedirs(self.root, exist_ok=True)
+
+        self.index = DedupIndex(os.path.join(self.root, '_index.sqlite'))
+        self.stories = StoryIndex(os.path.join(self.root, '_stories.sqlite'))
+        self.analytics = AnalyticsIndex(os.path.join(self.root, '_analytics.sqlite'))
+        self.search_index = SearchIndex(os.path.join(self.root, '_search.sqlite'))
+        self.timeline = FrontPageTimeline(os.path.join(self.root, '_timeline.sqlite'))
+        # the indexes rebuilt from the files already have the interrupted runs
+        rebuilt = set()
+        if len(self.index) == 0 and not self.is_empty():
+            self.rebuild_index()
+            rebuilt.add('index')
+        if len(self.analytics) == 0 and not self.is_empty():
+            self.rebuild_analytics()
+            rebuilt.add('analytics')
+        if len(self.search_index) == 0 and not self.is_empty():
+            self.rebuild_search()
+            rebuilt.add('search')
+        self._recover_runs(rebuilt)
+
+
+    def _partition_dir(self, date: str, font: str) -> str:
+        return os.path.join(self.root, f'date={date}', f'font={font}')
+
+
+    @staticmethod
+    def _partition_of(path: str) -> tuple[str, str]:
+        """Date and font of the partition of a file"""
+        font_dir = os.path.dirname(path)
+        date = os.path.basename(os.path.dirname(font_dir)).split('=', 1)[1]
+        font = os.path.basename(font_dir).split('=', 1)[1]
+        return date, font
+
+
+    def list_parts(self, font: str = None) -> list[str]:
+        """Paths of the files of the dataset, optionally only of one font"""
+        font_pattern = '*' if font is None else f'font={font}'
+        return sorted(glob.glob(os.path.join(self.root, 'date=*', font_pattern, 'part-*.parquet')))
+
+
+    def is_empty(self) -> bool:
+        return len(self.list_parts()) == 0
+
+
+    def _prepare(self, news_df: pd.DataFrame) -> pd.DataFrame:
+        """Give the dataframe the columns and types of the store"""
+        news_df = news_df.reindex(columns=COLUMNS)
+        news_df['Time'] = pd.to_datetime(news_df['Time'], errors='coerce', format='mixed')
+        news_df['Highlighted'] = news_df['Highlighted'].fillna(0).astype('int64')
+
+        for column in ['Title', 'Theme', 'Header', 'Resume', 'Font', 'Link']:
+            news_df[column] = news_df[column].astype(object).where(news_df[column].notna(), None)
+
+        return news_df.reset_index(drop=True)
+
+
+    def _write_part(self, part_df: pd.DataFrame, date: str, font: str, run_id: str) -> str:
+        """Atomically write one file of a partition"""
+        partition_dir = self._partition_dir(date, font)
+        os.makedirs(partition_dir, exist_ok=True)
+
+        final_path = os.path.join(partition_dir, f'part-{run_id}.parquet')
+        tmp_path = final_path + '.tmp'
+
+        table = pa.Table.from_pandas(part_df, schema=SCHEMA, preserve_index=False)
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, final_path)
+
+        return final_path
+
+
+    def known_titles(self, font: str) -> KnownTitles:
+        """Titles already stored for a font, checked on the index"""
+        return self.index.known(font)
+
+
+    def _read_keys(self) -> pd.DataFrame:
+        """Only the Title, Time, Font and Highlighted columns of the dataset, with the Date of the partitions"""
+        paths = self.list_parts()
+        if len(paths) == 0:
+            return pd.DataFrame(columns=['Title', 'Time', 'Font', 'Highlighted', 'Date'])
+
+        keys_df = pd.concat(
+            [
+                pq.read_table(path, columns=['Title', 'Time', 'Font', 'Highlighted']).to_pandas()
+                .assign(Date=self._partition_of(path)[0])
+                for path in paths
+            ],
+            ignore_index=True
+        )
+        # a crash during a compaction may leave the same news in two files
+        return keys_df.drop_duplicates(subset=['Title', 'Font'], keep='first')
+
+
+    def _recover_runs(self, rebuilt: set = frozenset()):
+        """Index the files of the runs interrupted before recording their keys
+
+        Otherwise the news of these files would not be known, and the next
+        run would write them again. The indexes in rebuilt are skipped.
+        """
+        for run_id, run_time in self.index.pending_runs().items():
+            paths = sorted(glob.glob(os.path.join(self.root, 'date=*', 'font=*', f'part-{run_id}.parquet')))
+            part_dfs = [pq.read_table(path).to_pandas() for path in paths]
+            news_df = pd.concat(part_dfs, ignore_index=True) if part_dfs else pd.DataFrame(columns=COLUMNS)
+
+            self.index.observe(news_df if 'index' not in rebuilt else news_df.iloc[:0], run_time, run_id)
+            if len(news_df) == 0:
+                continue
+
+            dates = pd.Series([self._partition_of(path)[0] for path, part_df in zip(paths, part_dfs)
+                               for _ in range(len(part_df))])
+            self.stories.assign(news_df, run_time)
+            if 'analytics' not in rebuilt:
+                self.analytics.add(news_df, dates)
+            if 'search' not in rebuilt:
+                self.search_index.add(news_df)
+            logger.warning(f"Recovered {len(news_df)} news of the interrupted run {run_id}")
+
+
+    def rebuild_index(self):
+        """Rebuild the dedup index from the key columns of the dataset"""
+        self.index.rebuild(self._read_keys())
+
+
+    def append(self, news_df: pd.DataFrame, run_time: datetime = None, rank_offset: int = 0,
+               timeline: bool = True, page: str = '') -> int:
+        """Add the news of a run to the dataset
+
+        The news already stored, by (Title, Font), are not written again, so
+        the dataset keeps the first observation of each news. All the news
+        of the run are recorded on the index.
+
+        Parameters
+        ----------
+        news_df : pd.DataFrame
+            News scraped, with a Font column
+        run_time : datetime, optional
+            Time of the run, used for the news without Time, by default now
+        rank_offset : int, optional
+            Number of news of each font of the run already appended, so the
+            ranks on the timeline continue from them, by default 0
+        timeline : bool, optional
+            Record the positions of the news on the timeline, by default True.
+            False for news not in the order of a front page, as an import
+        page : str, optional
+            Subpage the news were scraped from, when the run did not scrape
+            all the pages of the font, by default ''
+
+        Returns
+        -------
+        int
+            Number of news written
+        """
+        run_time = datetime.now() if run_time is None else run_time
+        run_id = f"{run_time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        news_df = self._prepare(news_df)
+        if timeline:
+            self.timeline.observe(news_df, run_time, rank_offset, page)
+
+        # duplicates inside the run, with the same normalization of the index
+        keys = pd.DataFrame({'Title': news_df['Title'].map(normalize_title), 'Font': news_df['Font']})
+        news_df = news_df[~keys.duplicated(keep='last')]
+
+        new_df = news_df[self.index.is_new(news_df)]
+        logger.info(f"{len(news_df) - len(new_df)} news are already present on the dataset")
+
+        # the run is pending until its keys are on the index
+        self.index.begin_run(run_id, run_time)
+        dates = new_df['Time'].dt.strftime('%Y-%m-%d').fillna(run_time.strftime('%Y-%m-%d'))
+        for (date, font), part_df in new_df.groupby([dates, 'Font']):
+            self._write_part(part_df, date, font, run_id)
+
+        self.index.observe(news_df, run_time, run_id)
+        self.stories.assign(news_df, run_time)
+        self.analytics.add(new_df, dates)
+        self.search_index.add(new_df)
+
+        logger.info(f"Sucess saving {len(new_df)} news on {self.root}")
+        return len(new_df)
+
+
+    def read(self, fonts: list[str] = None, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """Read the dataset, optionally filtering partitions by font and date
+
+        Parameters
+        ----------
+        fonts : list[str], optional
+            Fonts to read, by default all
+        start_date : str, optional
+            First partition date to read, in YYYY-MM-DD format
+        end_date : str, optional
+            Last partition date to read, in YYYY-MM-DD format
+
+        Returns
+        -------
+        pd.DataFrame
+            The news, with the columns of the CSV dataset and the Story of each one
+        """
+        paths = []
+        for path in self.list_parts():
+            date, font = self._partition_of(path)
+            if fonts is not None and font not in fonts:
+                continue
+            if start_date is not None and date < start_date:
+                continue
+            if end_date is not None and date > end_date:
+                continue
+            paths.append(path)
+
+        if len(paths) == 0:
+            return pd.DataFrame(columns=COLUMNS + ['Story'])
+
+        news_df = pd.concat([pq.read_table(path).to_pandas() for path in paths], ignore_index=True)
+
+        # a crash during a compaction may leave the same news in two files
+        news_df = news_df.drop_duplicates(subset=['Title', 'Font'], keep='first')
+
+        # the files written before the Link column do not have it
+        news_df = news_df.reindex(columns=COLUMNS)
+        news_df['Story'] = self.stories.story_ids(news_df)
+
+        return news_df
+
+
+    def rebuild_stories(self):
+        """Cluster again all the news of the dataset in stories"""
+        self.stories.rebuild(self._read_keys())
+
+
+    def rebuild_analytics(self):
+        """Aggregate again all the news of the dataset on the analytics tables"""
+        keys_df = self._read_keys()
+        self.analytics.rebuild(keys_df, keys_df['Date'])
+
+
+    def rebuild_search(self):
+        """Index again all the news of the dataset for the full-text search"""
+        self.search_index.rebuild(self.read())
+
+
+    def compact(self, min_parts: int = 2) -> int:
+        """Merge the small files of each partition into one file
+
+        Returns
+        -------
+        int
+            Number of partitions compacted
+        """
+        partition_dirs = sorted({os.path.dirname(path) for path in self.list_parts()})
+
+        n_compacted = 0
+        for partition_dir in partition_dirs:
+            parts = sorted(glob.glob(os.path.join(partition_dir, 'part-*.parquet')))
+            if len(parts) < min_parts:
+                continue
+
+            part_df = pd.concat([pq.read_table(path).to_pandas() for path in parts], ignore_index=True)
+            part_df = self._prepare(part_df.drop_duplicates(subset=['Title', 'Font'], keep='first'))
+
+            date, font = self._partition_of(parts[0])
+            run_id = f"compact-{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+            # the new file is complete before the old ones are removed
+            self._write_part(part_df, date, font, run_id)
+            for path in parts:
+                os.remove(path)
+
+            n_compacted += 1
+
+        logger.info(f"Compacted {n_compacted} partitions of {self.root}")
+        return n_compacted
+
+
+    def import_csv(self, csv_file_path: str) -> int:
+        """Add the news of a CSV file, like data/news.csv, to the store"""
+        logger.info(f"Importing {csv_file_path}")
+        news_df = pd.read_csv(csv_file_path)
+
+        was_empty = self.is_empty()
+        n_news = self.append(news_df, timeline=False)
+
+        # the index gets the times of the news instead of the import time
+        if was_empty:
+            self.rebuild_index()
+
+        return n_news
+
+
+    def export_csv(self, csv_file_path: str):
+        """Write the whole dataset as a CSV file, in the format of data/news.csv"""
+        news_df = self.read()
+        news_df.to_csv(csv_file_path, index=False)
+        logger.info(f"Exported {len(news_df)} news to {csv_file_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the news store')
+    parser.add_argument('command', choices=['compact', 'export-csv', 'import-csv', 'rebuild-index', 'rebuild-stories',
+                                            'rebuild-analytics', 'rebuild-search'])
+    parser.add_argument('--root', default=None, help='folder of the store, by default data/store')
+    parser.add_argument('--csv', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'news.csv'),
+                        help='CSV file to import or export, by default data/news.csv')
+    args = parser.parse_args()
+
+    store = NewsStore(args.root)
+    if args.command == 'compact':
+        store.compact()
+    elif args.command == 'export-csv':
+        store.export_csv(args.csv)
+    elif args.command == 'rebuild-index':
+        store.rebuild_index()
+    elif args.command == 'rebuild-stories':
+        store.rebuild_stories()
+    elif args.command == 'rebuild-analytics':
+        store.rebuild_analytics()
+    elif args.command == 'rebuild-search':
+        store.rebuild_search()
+    else:
+        store.import_csv(args.csv)
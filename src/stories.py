@@ -0,0 +1,315 @@
+import numpy as np
+import pandas as pd
+from collections import Counter
+from datetime import datetime, timedelta
+import argparse
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+import zlib
+import os
+import logging
+
+import src.logging_config
+from src.dedup_index import title_hash
+logger = logging.getLogger(__name__)
+
+# the signature has BANDS * ROWS hashes. Two titles become candidates when
+# all the hashes of a band agree, likely above a Jaccard of (1 / BANDS) ** (1 / ROWS)
+BANDS = 32
+ROWS = 4
+# estimated Jaccard of the shingles of two titles of the same story
+DEFAULT_THRESHOLD = 0.5
+# stories not seen for longer do not receive new titles
+DEFAULT_WINDOW_DAYS = 7
+
+# the parameters of the hashes are fixed, so the persisted signatures stay comparable
+_PRIME = np.uint64(4294967311)
+_random = np.random.RandomState(20240713)
+_A = _random.randint(1, 2**31, size=BANDS * ROWS).astype(np.uint64)
+_B = _random.randint(0, 2**32, size=BANDS * ROWS).astype(np.uint64)
+_BAND_MULTIPLIERS = _random.randint(1, 2**62, size=ROWS).astype(np.uint64) | np.uint64(1)
+
+WORD = re.compile(r'\w+')
+
+
+def shingles(title: str) -> set[str]:
+    """Words of a title, without accents and case
+
+    The words of a single letter, mostly articles, are left out. The pairs
+    of words would make a small edit, like an added article, change too
+    many shingles of a short title.
+    """
+    text = unicodedata.normalize('NFKD', title.casefold())
+    words = WORD.findall(''.join(char for char in text if not unicodedata.combining(char)))
+    return {word for word in words if len(word) > 1}
+
+
+def minhash(title: str) -> np.ndarray:
+    """MinHash signature of the shingles of a title"""
+    values = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(title)] or [0], dtype=np.uint64)
+    return ((np.outer(values, _A) + _B) % _PRIME).min(axis=0)
+
+
+def band_buckets(signature: np.ndarray) -> list[int]:
+    """Bucket of the signature on each band, as signed 64 bits integers for sqlite"""
+    bands = signature.reshape(BANDS, ROWS)
+    with np.errstate(over='ignore'):
+        buckets = (bands * _BAND_MULTIPLIERS).sum(axis=1, dtype=np.uint64)
+    return buckets.view(np.int64).tolist()
+
+
+def similarity(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard between a signature and each row of others"""
+    return (others == signature).mean(axis=1)
+
+
+def default_stories_path() -> str:
+    """Path of the index of the stories of the news store"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'store', '_stories.sqlite')
+
+
+class StoryIndex():
+    """Persistent clustering of the news in stories
+
+    The same story appears with slightly different titles on G1, UOL and
+    CNN, and with small edits over time. Each news gets a story id, given
+    incrementally: the MinHash signature of its title is split in bands,
+    and only the news sharing the bucket of a band are compared, so adding
+    a news does not cost the size of the dataset.
+
+    The signatures and the buckets are kept in a sqlite file, keyed like
+    the DedupIndex by font and title hash.
+    """
+
+    def __init__(self, path: str = None, threshold: float = DEFAULT_THRESHOLD,
+                 window_days: float = DEFAULT_WINDOW_DAYS):
+        self.path = default_stories_path() if path is None else path
+        self.threshold = threshold
+        self.window = timedelta(days=window_days)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._assign_lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS news (
+                    font TEXT NOT NULL,
+                    title_hash INTEGER NOT NULL,
+                    story_id INTEGER NOT NULL,
+                    signature BLOB NOT NULL,
+                    PRIMARY KEY (font, title_hash)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS buckets (
+                    band INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    story_id INTEGER NOT NULL,
+                    PRIMARY KEY (band, bucket, story_id)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS stories (
+                    story_id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    last_seen TEXT NOT NULL,
+                    n_news INTEGER NOT NULL
+                )
+            ''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS news_story ON news (story_id)')
+
+
+    def __len__(self) -> int:
+        """Number of stories"""
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM stories').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def _lookup(self, keys: list[tuple]) -> dict:
+        """Story of the (font, title hash) keys already clustered"""
+        with self._lock:
+            rows = self._connection.execute('''
+                SELECT font, title_hash, story_id FROM news
+                WHERE (font, title_hash) IN (SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]')
+                                             FROM json_each(?))
+            ''', (json.dumps(list(set(keys))),)).fetchall()
+        return {(font, key): story_id for font, key, story_id in rows}
+
+
+    def _candidates(self, buckets: list[int], since: str) -> dict:
+        """Signatures of the news of the recent stories sharing a bucket, by story
+
+        The buckets are in the order of the bands, so the band is the
+        position on the list.
+        """
+        with self._lock:
+            rows = self._connection.execute('''
+                SELECT news.story_id, news.signature FROM news
+                JOIN stories ON stories.story_id = news.story_id
+                WHERE stories.last_seen >= ? AND news.story_id IN (
+                    SELECT story_id FROM buckets
+                    WHERE (band, bucket) IN (SELECT key, value FROM json_each(?))
+                )
+            ''', (since, json.dumps(buckets))).fetchall()
+
+        candidates = {}
+        for story_id, signature in rows:
+            candidates.setdefault(story_id, []).append(np.frombuffer(signature, dtype=np.uint64))
+        return candidates
+
+
+    def _best_story(self, signature: np.ndarray, candidates: dict) -> int:
+        best_story, best_similarity = None, self.threshold
+        for story_id, signatures in candidates.items():
+            story_similarity = similarity(signature, np.vstack(signatures)).max()
+            if story_similarity >= best_similarity:
+                best_story, best_similarity = story_id, story_similarity
+        return best_story
+
+
+    def _next_story_id(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COALESCE(MAX(story_id), 0) + 1 FROM stories').fetchone()[0]
+
+
+    def assign(self, news_df: pd.DataFrame, run_time: datetime = None) -> pd.Series:
+        """Give each news the id of its story, creating new stories as needed
+
+        Parameters
+        ----------
+        news_df : pd.DataFrame
+            News with Title and Font columns
+        run_time : datetime, optional
+            Time the news were seen, by default now
+
+        Returns
+        -------
+        pd.Series
+            The story id of each news
+        """
+        # the new story ids are only valid until the end of the assignment
+        with self._assign_lock:
+            run_time = datetime.now() if run_time is None else run_time
+            seen = run_time.isoformat(sep=' ', timespec='seconds')
+            since = (run_time - self.window).isoformat(sep=' ', timespec='seconds')
+
+            keys = [(font, title_hash(title)) for title, font in zip(news_df['Title'], news_df['Font'])]
+            known = self._lookup(keys)
+
+            next_story = self._next_story_id()
+            story_ids = []
+            new_news = []
+            new_buckets = set()
+            new_stories = {}
+            # the news of this batch are candidates of the next ones too
+            batch_candidates = {}
+            batch_buckets = {}
+
+            for key, title in zip(keys, news_df['Title']):
+                if key in known:
+                    story_ids.append(known[key])
+                    continue
+
+                signature = minhash(title)
+                buckets = list(enumerate(band_buckets(signature)))
+
+                candidates = self._candidates([bucket for _, bucket in buckets], since)
+                for bucket in buckets:
+                    for story_id in batch_buckets.get(bucket, ()):
+                        candidates.setdefault(story_id, []).extend(batch_candidates[story_id])
+
+                story_id = self._best_story(signature, candidates)
+                if story_id is None:
+                    story_id = next_story
+                    next_story += 1
+                    new_stories[story_id] = title
+
+                known[key] = story_id
+                story_ids.append(story_id)
+
+                new_news.append((*key, story_id, signature.tobytes()))
+                batch_candidates.setdefault(story_id, []).append(signature)
+                for bucket in buckets:
+                    batch_buckets.setdefault(bucket, set()).add(story_id)
+                    new_buckets.add((*bucket, story_id))
+
+            n_added = Counter(story_id for _, _, story_id, _ in new_news)
+
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    'INSERT INTO stories (story_id, title, first_seen, last_seen, n_news) VALUES (?, ?, ?, ?, 0)',
+                    [(story_id, title, seen, seen) for story_id, title in new_stories.items()]
+                )
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO news (font, title_hash, story_id, signature) VALUES (?, ?, ?, ?)', new_news
+                )
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO buckets (band, bucket, story_id) VALUES (?, ?, ?)', new_buckets
+                )
+                # the stories seen again stay open for new titles
+                self._connection.executemany(
+                    'UPDATE stories SET last_seen = MAX(last_seen, ?), n_news = n_news + ? WHERE story_id = ?',
+                    [(seen, n_added.get(story_id, 0), story_id) for story_id in set(story_ids)]
+                )
+
+        return pd.Series(story_ids, index=news_df.index, dtype='int64')
+
+
+    def story_ids(self, news_df: pd.DataFrame) -> pd.Series:
+        """Story of each news already clustered, missing for the others"""
+        keys = [(font, title_hash(title)) for title, font in zip(news_df['Title'], news_df['Font'])]
+        known = self._lookup(keys)
+        return pd.Series([known.get(key) for key in keys], index=news_df.index, dtype='Int64')
+
+
+    def stories(self) -> pd.DataFrame:
+        """The stories, with their first title, first and last seen times and number of news"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT story_id, title, first_seen, last_seen, n_news FROM stories ORDER BY story_id'
+            ).fetchall()
+        return pd.DataFrame(rows, columns=['Story', 'Title', 'First seen', 'Last seen', 'News'])
+
+
+    def rebuild(self, news_df: pd.DataFrame):
+        """Cluster again a whole dataset, in the order of the Time of the news"""
+        with self._lock, self._connection:
+            for table in ['news', 'buckets', 'stories']:
+                self._connection.execute(f'DELETE FROM {table}')
+
+        news_df = news_df.dropna(subset=['Title', 'Font'])
+        times = pd.to_datetime(news_df['Time'], errors='coerce', format='mixed')
+        news_df = news_df.assign(_time=times.fillna(pd.Timestamp.now())).sort_values('_time', kind='stable')
+
+        # one day at a time, so the window of the stories follows the dataset
+        for day, day_df in news_df.groupby(news_df['_time'].dt.date, sort=True):
+            self.assign(day_df, day_df['_time'].max().to_pydatetime())
+
+        logger.info(f"Clustered {len(news_df)} news in {len(self)} stories on {self.path}")
+
+
+if __name__ == '__main__':
+    from src.store import NewsStore
+
+    parser = argparse.ArgumentParser(description='Cluster the news of the store in stories')
+    parser.add_argument('command', choices=['rebuild', 'stats'])
+    parser.add_argument('--root', default=None, help='folder of the store, by default data/store')
+    args = parser.parse_args()
+
+    store = NewsStore(args.root)
+    if args.command == 'rebuild':
+        store.rebuild_stories()
+    else:
+        stories = store.stories.stories()
+        logger.info(f"{len(stories)} stories, {(stories['News'] > 1).sum()} with more than one news")
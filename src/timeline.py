@@ -0,0 +1,373 @@
+import pandas as pd
+from datetime import datetime, timedelta
+import argparse
+import json
+import sqlite3
+import threading
+import os
+import logging
+
+import src.logging_config
+from src.dedup_index import title_hash
+logger = logging.getLogger(__name__)
+
+
+def default_timeline_path() -> str:
+    """Path of the front page timeline of the news store"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'store', '_timeline.sqlite')
+
+
+def _seconds(end: str, start: str) -> str:
+    """SQL expression of the seconds between two time columns"""
+    return f'CAST(ROUND((julianday({end}) - julianday({start})) * 86400) AS INTEGER)'
+
+
+class FrontPageTimeline():
+    """Position and highlight history of the news on the front pages, across the runs
+
+    The store keeps only the first observation of each news. The timeline
+    keeps where each one was on every run: its rank, the order it was
+    scraped in, with the highlights first, and whether it was highlighted.
+
+    The observations are delta encoded as spans: a news on the same rank
+    and highlight as on the previous run of its font only extends the
+    last_seen of its span, so the timeline grows with the changes of the
+    pages, not with the number of runs. A news missing from a run closes
+    its span. Each span keeps when the news entered the page, and the
+    highlights, so the time on the page does not depend on the rank moves.
+
+    A run can observe a subpage alone, as the daemon and the workers of
+    the cluster do: its news are ranked and their spans closed only among
+    the runs of the same page, so the news of the pages not scraped keep
+    their spans open. The whole front page of a font is the page ''.
+
+    The highlights are also counted per hour, for the top highlights of
+    each hour over months of history.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = default_timeline_path() if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._migrate_pages()
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    font TEXT NOT NULL,
+                    page TEXT NOT NULL,
+                    run_time TEXT NOT NULL,
+                    PRIMARY KEY (font, page, run_time)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS articles (
+                    font TEXT NOT NULL,
+                    title_hash INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    PRIMARY KEY (font, title_hash)
+                ) WITHOUT ROWID
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS spans (
+                    id INTEGER PRIMARY KEY,
+                    font TEXT NOT NULL,
+                    page TEXT NOT NULL,
+                    title_hash INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    highlighted INTEGER NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    last_seen TEXT NOT NULL,
+                    entered_at TEXT NOT NULL,
+                    highlighted_since TEXT
+                )
+            ''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS spans_article ON spans (font, page, title_hash, last_seen)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS spans_last_seen ON spans (last_seen)')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS hourly_highlights (
+                    hour TEXT NOT NULL,
+                    font TEXT NOT NULL,
+                    title_hash INTEGER NOT NULL,
+                    n_runs INTEGER NOT NULL,
+                    best_rank INTEGER NOT NULL,
+                    PRIMARY KEY (hour, font, title_hash)
+                ) WITHOUT ROWID
+            ''')
+
+
+    def _migrate_pages(self):
+        """Add the page to a timeline written before the subpages, all of its runs of the whole front page"""
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(spans)')]
+        if len(columns) == 0 or 'page' in columns:
+            return
+
+        self._connection.execute("ALTER TABLE spans ADD COLUMN page TEXT NOT NULL DEFAULT ''")
+        self._connection.execute('DROP INDEX IF EXISTS spans_article')
+        self._connection.execute('ALTER TABLE runs RENAME TO runs_without_page')
+        self._connection.execute('''
+            CREATE TABLE runs (
+                font TEXT NOT NULL,
+                page TEXT NOT NULL,
+                run_time TEXT NOT NULL,
+                PRIMARY KEY (font, page, run_time)
+            ) WITHOUT ROWID
+        ''')
+        self._connection.execute("INSERT INTO runs SELECT font, '', run_time FROM runs_without_page")
+        self._connection.execute('DROP TABLE runs_without_page')
+        logger.info(f"Added the pages to the timeline {self.path}")
+
+
+    def __len__(self) -> int:
+        """Number of spans"""
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM spans').fetchone()[0]
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def observe(self, news_df: pd.DataFrame, run_time: datetime = None, rank_offset: int = 0, page: str = ''):
+        """Record the news seen on a run, in the order of the page
+
+        Parameters
+        ----------
+        news_df : pd.DataFrame
+            News of the run, with the Title, Font and Highlighted columns, in
+            the order they were scraped. A news seen twice keeps its first rank
+        run_time : datetime, optional
+            Time of the run, by default now
+        rank_offset : int, optional
+            Rank of the news before the first row, when a run is written in
+            many batches, by default 0
+        page : str, optional
+            Subpage the news were scraped from, when the run did not scrape
+            the whole front page, by default '', all the pages of the font
+        """
+        news_df = news_df[news_df['Title'].notna()]
+        if len(news_df) == 0:
+            return
+
+        seen = (datetime.now() if run_time is None else run_time).isoformat(sep=' ', timespec='seconds')
+        hour = seen[:13] + ':00:00'
+
+        ranks = news_df.groupby('Font', sort=False).cumcount() + rank_offset + 1
+
+        with self._lock, self._connection:
+            for font, font_df in news_df.groupby('Font', sort=False):
+                observations = {}
+                for title, highlighted, rank in zip(font_df['Title'], font_df['Highlighted'].fillna(0), ranks[font_df.index]):
+                    observations.setdefault(title_hash(title), (title, int(highlighted > 0), int(rank)))
+
+                self._observe_font(font, page, observations, seen, hour)
+
+
+    def _observe_font(self, font: str, page: str, observations: dict, seen: str, hour: str):
+        """Extend or open the spans of the news of a page of a font seen on a run"""
+        previous = self._connection.execute(
+            'SELECT MAX(run_time) FROM runs WHERE font = ? AND page = ? AND run_time < ?', (font, page, seen)
+        ).fetchone()[0]
+        self._connection.execute('INSERT OR IGNORE INTO runs (font, page, run_time) VALUES (?, ?, ?)',
+                                 (font, page, seen))
+
+        # the spans still open: seen on the previous run, or already on this one by another batch
+        open_spans = {}
+        for row in self._connection.execute('''
+            SELECT title_hash, id, rank, highlighted, last_seen, entered_at, highlighted_since FROM spans
+            WHERE font = ? AND page = ? AND last_seen IN (?, ?)
+              AND title_hash IN (SELECT value FROM json_each(?))
+            ORDER BY last_seen
+        ''', (font, page, previous, seen, json.dumps(list(observations)))):
+            open_spans[row[0]] = row[1:]
+
+        extended, opened, highlights = [], [], []
+        for key, (title, highlighted, rank) in observations.items():
+            span = open_spans.get(key)
+            if span is None:
+                opened.append((font, page, key, rank, highlighted, seen, seen, seen, seen if highlighted else None))
+            elif span[3] == seen:
+                # the higher position on this run was already recorded
+                continue
+            elif (rank, highlighted) == span[1:3]:
+                extended.append((seen, span[0]))
+            else:
+                span_id, span_rank, span_highlighted, last_seen, entered_at, highlighted_since = span
+                since = (highlighted_since if span_highlighted else seen) if highlighted else None
+                opened.append((font, page, key, rank, highlighted, seen, seen, entered_at, since))
+
+            if highlighted:
+                highlights.append((hour, font, key, rank))
+
+        self._connection.executemany('UPDATE spans SET last_seen = ? WHERE id = ?', extended)
+        self._connection.executemany('''
+            INSERT INTO spans (font, page, title_hash, rank, highlighted, first_seen, last_seen, entered_at,
+                               highlighted_since)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', opened)
+        self._connection.executemany(
+            'INSERT OR IGNORE INTO articles (font, title_hash, title) VALUES (?, ?, ?)',
+            [(font, key, title) for key, (title, _, _) in observations.items()]
+        )
+        self._connection.executemany('''
+            INSERT INTO hourly_highlights (hour, font, title_hash, n_runs, best_rank) VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT (hour, font, title_hash) DO UPDATE SET
+                n_runs = n_runs + 1,
+                best_rank = MIN(best_rank, excluded.best_rank)
+        ''', highlights)
+
+
+    @staticmethod
+    def _filters(start_time: str, end_time: str, fonts: list[str]) -> tuple[str, list]:
+        """Conditions of the spans on the page at some moment between start_time and end_time"""
+        conditions, params = [], []
+        if start_time is not None:
+            conditions.append('last_seen >= ?')
+            params.append(str(start_time))
+        if end_time is not None:
+            conditions.append('first_seen <= ?')
+            params.append(str(end_time))
+        if fonts is not None:
+            conditions.append('font IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(fonts)))
+
+        return ' AND '.join(conditions) or '1', params
+
+
+    def history(self, font: str, title: str) -> pd.DataFrame:
+        """The spans of a news, showing how its rank and highlight changed on each page"""
+        with self._lock:
+            rows = self._connection.execute('''
+                SELECT page, first_seen, last_seen, rank, highlighted FROM spans
+                WHERE font = ? AND title_hash = ? ORDER BY first_seen, page
+            ''', (font, title_hash(title))).fetchall()
+        return pd.DataFrame(rows, columns=['Page', 'First Seen', 'Last Seen', 'Rank', 'Highlighted'])
+
+
+    def time_on_front_page(self, start_time: str = None, end_time: str = None, fonts: list[str] = None,
+                           top: int = None) -> pd.DataFrame:
+        """How long each news stayed on the front page, and on the highlights
+
+        The time of each stay is counted from the first to the last run the
+        news was seen on, without leaving the page between them. A news that
+        left and came back has many stays, summed, as its stays on each of
+        the subpages observed alone.
+
+        Parameters
+        ----------
+        start_time : str, optional
+            Only the news on the page after this time, as 'YYYY-MM-DD HH:MM:SS' or a prefix
+        end_time : str, optional
+            Only the news on the page before this time
+        fonts : list[str], optional
+            Fonts of the news, by default all
+        top : int, optional
+            Only the news longer on the page, by default all
+
+        Returns
+        -------
+        pd.DataFrame
+            Title, Font, Entered, Left, Seconds, Seconds Highlighted, Best Rank
+            and Stays of each news, the longest on the page first
+        """
+        conditions, params = self._filters(start_time, end_time, fonts)
+        with self._lock:
+            rows = self._connection.execute(f'''
+                WITH stays AS (
+                    SELECT font, title_hash, entered_at, MAX(last_seen) AS left_at, MIN(rank) AS best_rank
+                    FROM spans WHERE {conditions}
+                    GROUP BY font, page, title_hash, entered_at
+                ), highlights AS (
+                    SELECT font, title_hash, SUM(seconds) AS seconds FROM (
+                        SELECT font, title_hash, {_seconds('MAX(last_seen)', 'highlighted_since')} AS seconds
+                        FROM spans WHERE highlighted = 1 AND {conditions}
+                        GROUP BY font, page, title_hash, highlighted_since
+                    ) GROUP BY font, title_hash
+                )
+                SELECT articles.title, stays.font, MIN(stays.entered_at), MAX(stays.left_at),
+                       SUM({_seconds('stays.left_at', 'stays.entered_at')}) AS seconds,
+                       COALESCE(highlights.seconds, 0), MIN(stays.best_rank), COUNT(*)
+                FROM stays
+                JOIN articles USING (font, title_hash)
+                LEFT JOIN highlights USING (font, title_hash)
+                GROUP BY stays.font, stays.title_hash
+                ORDER BY seconds DESC
+                LIMIT ?
+            ''', [*params, *params, -1 if top is None else top]).fetchall()
+
+        return pd.DataFrame(rows, columns=['Title', 'Font', 'Entered', 'Left', 'Seconds', 'Seconds Highlighted',
+                                           'Best Rank', 'Stays'])
+
+
+    def top_highlights_per_hour(self, start_time: str = None, end_time: str = None, fonts: list[str] = None,
+                                top: int = 5) -> pd.DataFrame:
+        """The news highlighted the most on each hour, from the hourly counts
+
+        Parameters
+        ----------
+        start_time : str, optional
+            First hour, as 'YYYY-MM-DD HH' or a longer time
+        end_time : str, optional
+            Last hour
+        fonts : list[str], optional
+            Fonts of the news, by default all
+        top : int, optional
+            Number of news of each hour and font, by default 5
+
+        Returns
+        -------
+        pd.DataFrame
+            Hour, Font, Title, the number of Runs highlighted on the hour and
+            the Best Rank, the most highlighted first
+        """
+        conditions, params = [], []
+        if start_time is not None:
+            conditions.append('hour >= ?')
+            params.append(str(start_time)[:13])
+        if end_time is not None:
+            conditions.append('hour <= ?')
+            params.append(str(end_time)[:13] + ':59:59')
+        if fonts is not None:
+            conditions.append('font IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(fonts)))
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        with self._lock:
+            rows = self._connection.execute(f'''
+                SELECT hour, font, articles.title, n_runs, best_rank FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY hour, font ORDER BY n_runs DESC, best_rank) AS position
+                    FROM hourly_highlights {where}
+                )
+                JOIN articles USING (font, title_hash)
+                WHERE position <= ?
+                ORDER BY hour, font, position
+            ''', [*params, top]).fetchall()
+
+        return pd.DataFrame(rows, columns=['Hour', 'Font', 'Title', 'Runs', 'Best Rank'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the front page timeline of the news store')
+    parser.add_argument('command', choices=['time-on-page', 'top-highlights', 'history'])
+    parser.add_argument('--path', default=None, help='sqlite file of the timeline, by default data/store/_timeline.sqlite')
+    parser.add_argument('--fonts', nargs='*', default=None, help='fonts of the news, by default all')
+    parser.add_argument('--start-time', default=None, help="first time, as 'YYYY-MM-DD HH:MM:SS' or a prefix")
+    parser.add_argument('--end-time', default=None, help="last time, as 'YYYY-MM-DD HH:MM:SS' or a prefix")
+    parser.add_argument('--top', type=int, default=None, help='number of news, of each hour with top-highlights')
+    parser.add_argument('--title', default=None, help='title of the news, with history')
+    args = parser.parse_args()
+
+    timeline = FrontPageTimeline(args.path)
+    # a day by default, the last hours of the dashboards
+    start_time = args.start_time or (datetime.now() - timedelta(days=1)).isoformat(sep=' ', timespec='seconds')
+    if args.command == 'time-on-page':
+        print(timeline.time_on_front_page(start_time, args.end_time, args.fonts, args.top or 20).to_string(index=False))
+    elif args.command == 'top-highlights':
+        print(timeline.top_highlights_per_hour(start_time, args.end_time, args.fonts, args.top or 5).to_string(index=False))
+    else:
+        if args.fonts is None or args.title is None:
+            parser.error('history needs one font with --fonts and the --title')
+        print(timeline.history(args.fonts[0], args.title).to_string(index=False))
@@ -0,0 +1,129 @@
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from time import perf_counter
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+
+class PageWaiter():
+    """Condition based waits for the page loading
+
+    Replaces fixed sleeps: each wait returns as soon as the page shows new
+    content, or after the timeout. The time spent waiting is accumulated,
+    so the scrapers can report how much of a run was idle.
+    """
+
+    def __init__(self, timeout: float = 10, poll_frequency: float = 0.25):
+        # ceiling of a single wait, in seconds
+        self.timeout = timeout
+        self.poll_frequency = poll_frequency
+
+        self.waiting_time = 0.0
+        self.n_waits = 0
+        self.n_timeouts = 0
+
+
+    def reset(self):
+        """Clear the accumulated waiting time"""
+        self.waiting_time = 0.0
+        self.n_waits = 0
+        self.n_timeouts = 0
+
+
+    def page_state(self, driver, item_selector: str) -> tuple[int, int]:
+        """Current height of the page and number of feed items loaded"""
+        return tuple(driver.execute_script(
+            "return [document.body.scrollHeight, document.querySelectorAll(arguments[0]).length]",
+            item_selector
+        ))
+
+
+    def _until(self, driver, condition, timeout: float = None):
+        """Wait for the condition, returning its value or None on timeout"""
+        timeout = self.timeout if timeout is None else timeout
+
+        start = perf_counter()
+        try:
+            return WebDriverWait(driver, timeout, poll_frequency=self.poll_frequency).until(condition)
+        except TimeoutException:
+            self.n_timeouts += 1
+            return None
+        finally:
+            self.waiting_time += perf_counter() - start
+            self.n_waits += 1
+
+
+    def wait_page_loaded(self, driver, container_selector: str = None, timeout: float = None) -> bool:
+        """Wait for the document to be ready and the news container to exist"""
+        def loaded(driver):
+            if driver.execute_script("return document.readyState") != 'complete':
+                return False
+            if container_selector is None:
+                return True
+            return len(driver.find_elements(By.CSS_SELECTOR, container_selector)) > 0
+
+        is_loaded = self._until(driver, loaded, timeout) is not None
+        if not is_loaded:
+            logger.warning(f"Page not loaded after {self.timeout if timeout is None else timeout}s")
+        return is_loaded
+
+
+    def wait_clickable(self, driver, css_selector: str, timeout: float = None) -> bool:
+        """Wait for an element, like a 'load more' button, to be clickable"""
+        clickable = EC.element_to_be_clickable((By.CSS_SELECTOR, css_selector))
+        return self._until(driver, clickable, timeout) is not None
+
+
+    def wait_for_new_content(self, driver, height: int, n_items: int, item_selector: str,
+                             button_selector: str = None, timeout: float = None) -> str:
+        """Wait until the page grows after a scroll
+
+        Parameters
+        ----------
+        driver : selenium.webdriver
+            Current webdriver
+        height : int
+            Page height before the scroll
+        n_items : int
+            Number of feed items before the scroll
+        item_selector : str
+            CSS selector of the feed items
+        button_selector : str, optional
+            CSS selector of a 'load more' button. If given, the wait also
+            stops when the button becomes clickable
+        timeout : float, optional
+            Ceiling of the wait, by default self.timeout
+
+        Returns
+        -------
+        str
+            What ended the wait: 'height', 'items', 'button', or None on timeout
+        """
+        button_clickable = None
+        if button_selector is not None:
+            button_clickable = EC.element_to_be_clickable((By.CSS_SELECTOR, button_selector))
+
+        def new_content(driver):
+            new_height, new_n_items = self.page_state(driver, item_selector)
+            if new_n_items > n_items:
+                return 'items'
+            if new_height > height:
+                return 'height'
+            if button_clickable is not None and button_clickable(driver):
+                return 'button'
+            return False
+
+        return self._until(driver, new_content, timeout)
+
+
+    def report(self, name: str, total_time: float):
+        """Log the time spent waiting versus working"""
+        working_time = total_time - self.waiting_time
+        logger.info(
+            f"{name}: {total_time:.1f}s total, {self.waiting_time:.1f}s waiting "
+            f"({self.n_waits} waits, {self.n_timeouts} timeouts), {working_time:.1f}s working"
+        )
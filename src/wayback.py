@@ -1,10 +1,31 @@
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import pandas as pd
+import argparse
+import json
 import logging
 
+import src.logging_config
+from src import http_fetch
+from src.html_cache import HtmlCache
 logger = logging.getLogger(__name__)
 
+WAYBACK_URL = 'http://archive.org'
+CDX_URL = 'http://web.archive.org/cdx/search/cdx'
+SNAPSHOT_URL = 'http://web.archive.org/web'
+
+# digits of the timestamp kept by each granularity of the CDX collapse
+GRANULARITIES = {
+    'month': 6,
+    'day': 8,
+    'hour': 10,
+    'minute': 12,
+}
+
+# log the progress every this many requests
+PROGRESS_EVERY = 50
+
 def _generate_timestamps(start_date, end_date, interval_days):
     """
     Generate timestamps in the format YYYYMMDDhhmmss between start_date and end_date with the given interval in days.
@@ -12,7 +33,7 @@ def _generate_timestamps(start_date, end_date, interval_days):
     start = datetime.strptime(start_date, "%Y%m%d")
     end = datetime.strptime(end_date, "%Y%m%d")
     interval = timedelta(days=interval_days)
-    
+
     timestamps = []
     current = start
     while current <= end:
@@ -21,13 +42,44 @@ def _generate_timestamps(start_date, end_date, interval_days):
     return timestamps
 
 
-def _query_wayback(url, timestamp):
+def _query_wayback(session: requests.Session, url: str, timestamp: str, base_url: str = WAYBACK_URL,
+                   limiter: http_fetch.TokenBucket = None, cache: HtmlCache = None) -> dict:
+    """
+    Query the Wayback Machine API with a given URL and timestamp, reusing the cached answers.
+
+    Only the answers with a snapshot are cached: a URL without one may be
+    archived later, so it is queried again.
+    """
+    cache_url = f"{base_url}/wayback/available?url={url}"
+    if cache is not None:
+        cached = cache.get(cache_url, timestamp)
+        if cached is not None:
+            return json.loads(cached)
+
+    response = http_fetch.get_with_backoff(session, f"{base_url}/wayback/available",
+                                           params={'url': url, 'timestamp': timestamp}, limiter=limiter)
+    answer = response.json()
+    if cache is not None and _parse_snapshot(answer) is not None:
+        cache.put(cache_url, timestamp, response.text)
+
+    return answer
+
+
+def _parse_snapshot(response: dict) -> dict:
     """
-    Query the Wayback Machine API with a given URL and timestamp.
+    Obtain the URL and timestamp of the snapshot of a response, None if it is not avaliable
     """
-    api_url = f"http://archive.org/wayback/available?url={url}&timestamp={timestamp}"
-    response = requests.get(api_url)
-    return response.json()
+    try:
+        snapshot = response['archived_snapshots']['closest']
+
+        if snapshot['status'] == '200' and snapshot['available']:
+            return {'url': snapshot['url'], 'timestamp': snapshot['timestamp']}
+
+    # not avaliable snapshot
+    except Exception:
+        pass
+
+    return None
 
 
 def _parse_responses(responses: list[str]) -> pd.DataFrame:
@@ -37,28 +89,85 @@ def _parse_responses(responses: list[str]) -> pd.DataFrame:
     urls = []
     timestamps = []
     for response in responses:
-        try:
-            snapshot = response['archived_snapshots']['closest']
-            
-            if snapshot['status'] == '200' and snapshot['available']:
-                urls.append(snapshot['url'])
-                timestamps.append(snapshot['timestamp'])
-        
-        # not avaliable snapshot
-        except Exception:
-            continue
-        
+        snapshot = _parse_snapshot(response)
+        if snapshot is not None:
+            urls.append(snapshot['url'])
+            timestamps.append(snapshot['timestamp'])
+
     links = pd.DataFrame({
         'url': urls,
         'timestamp': timestamps
     })
 
-    links.drop_duplicates(subset=['timestamp'])
+    links = links.drop_duplicates(subset=['timestamp'])
 
     return links
-    
-    
-def obtain_wayback_links(url: str, start_date: str, end_date: str, interval_days: int) -> pd.DataFrame:
+
+
+def stream_wayback_snapshots(url: str, timestamps: list[str], concurrency: int = 8, rate: float = 5.0,
+                             base_url: str = WAYBACK_URL, session: requests.Session = None,
+                             cache: HtmlCache = None):
+    """Query the snapshots closest to many timestamps concurrently
+
+    The queries share one keep-alive session and one token bucket, and are
+    retried with exponential backoff on 429/5xx responses. The snapshots
+    are yielded as the queries complete, so not in the timestamps order.
+
+    Parameters
+    ----------
+    url : str
+        URL of the page to look for
+    timestamps : list[str]
+        Timestamps in YYYYMMDDhhmmss format
+    concurrency : int, optional
+        Maximum number of queries at the same time, by default 8
+    rate : float, optional
+        Maximum number of queries per second, by default 5.0
+    base_url : str, optional
+        Address of the Wayback Machine, by default WAYBACK_URL
+    session : requests.Session, optional
+        Session used for the queries, by default a new one
+    cache : HtmlCache, optional
+        If given, the answers already cached are not queried again
+
+    Yields
+    ------
+    dict
+        The 'url' and 'timestamp' of each available snapshot
+    """
+    if session is None:
+        # the retries are done by get_with_backoff, respecting the rate limit
+        session = http_fetch.create_session(pool_size=concurrency, retries=0)
+    limiter = http_fetch.TokenBucket(rate)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(_query_wayback, session, url, timestamp, base_url, limiter, cache): timestamp
+            for timestamp in timestamps
+        }
+
+        try:
+            for i, future in enumerate(as_completed(futures)):
+                try:
+                    snapshot = _parse_snapshot(future.result())
+                except (requests.RequestException, ValueError) as e:
+                    logger.error(f"Error querying {url} at {futures[future]}: {e}")
+                    snapshot = None
+
+                if (i + 1) % PROGRESS_EVERY == 0 or i + 1 == len(futures):
+                    logger.info(f'Request {i + 1}/{len(futures)}')
+
+                if snapshot is not None:
+                    yield snapshot
+        finally:
+            # a consumer that stops early does not wait for all the queries
+            for future in futures:
+                future.cancel()
+
+
+def obtain_wayback_links(url: str, start_date: str, end_date: str, interval_days: int,
+                         concurrency: int = 8, rate: float = 5.0, base_url: str = WAYBACK_URL,
+                         cache: HtmlCache = None) -> pd.DataFrame:
     """Obtain Wayback Machine links for the snapshots in a given time period
 
     Parameters
@@ -71,20 +180,181 @@ def obtain_wayback_links(url: str, start_date: str, end_date: str, interval_days
         End of the interval in YYYYMMDD format
     interval_days : int
         the interval of days to split the time period
+    concurrency : int, optional
+        Maximum number of queries at the same time, by default 8
+    rate : float, optional
+        Maximum number of queries per second, by default 5.0
+    base_url : str, optional
+        Address of the Wayback Machine, by default WAYBACK_URL
+    cache : HtmlCache, optional
+        If given, the answers already cached are not queried again
 
     Returns
     -------
     pd.DataFrame
         DataFrame containing 'url' and 'timestamp' as columns
     """
-    responses = []
-
     logger.info('Obtaining links')
 
     timestamps = _generate_timestamps(start_date, end_date, interval_days)
-    for i, timestamp in enumerate(timestamps):
-        response = _query_wayback(url, timestamp)
-        responses.append(response)
-        logger.info(f'Request {i + 1}/{len(timestamps)}', end='\r')
-        
-    return _parse_responses(responses)
\ No newline at end of file
+    snapshots = list(stream_wayback_snapshots(url, timestamps, concurrency, rate, base_url, cache=cache))
+
+    links = pd.DataFrame(snapshots, columns=['url', 'timestamp'])
+
+    # near timestamps have the same closest snapshot
+    links = links.drop_duplicates(subset=['timestamp'])
+
+    return links.sort_values('timestamp', ignore_index=True)
+
+
+def raw_snapshot_url(timestamp: str, original: str, base_url: str = SNAPSHOT_URL) -> str:
+    """URL of the page as archived, without the links rewritten by the Wayback Machine"""
+    return f'{base_url}/{timestamp}id_/{original}'
+
+
+def _collapse(snapshots, granularity: str):
+    """Keep the first snapshot of each period, in one pass over the sorted snapshots"""
+    n_digits = GRANULARITIES[granularity]
+
+    last_period = None
+    for snapshot in snapshots:
+        period = snapshot['timestamp'][:n_digits]
+        if period != last_period:
+            last_period = period
+            yield snapshot
+
+
+def _query_cdx_pages(session: requests.Session, url: str, start_date: str, end_date: str, granularity: str,
+                     page_size: int, base_url: str, limiter: http_fetch.TokenBucket = None):
+    """Yield the snapshots of the CDX API, following the resume keys of its pages"""
+    params = {
+        'url': url,
+        'from': start_date,
+        'to': end_date,
+        'output': 'json',
+        'fl': 'timestamp,original',
+        'filter': 'statuscode:200',
+        'collapse': f'timestamp:{GRANULARITIES[granularity]}',
+        'limit': page_size,
+        'showResumeKey': 'true',
+    }
+
+    n_pages = 0
+    while True:
+        rows = http_fetch.get_with_backoff(session, base_url, params=params, limiter=limiter).json()
+        n_pages += 1
+
+        # the first row is the header, and the resume key comes after an empty row
+        resume_key = None
+        if len(rows) >= 2 and rows[-2] == []:
+            resume_key = rows[-1][0]
+            rows = rows[:-2]
+
+        for timestamp, original in rows[1:]:
+            yield {'url': f'{SNAPSHOT_URL}/{timestamp}/{original}', 'timestamp': timestamp, 'original': original}
+
+        logger.info(f'CDX page {n_pages}: {max(len(rows) - 1, 0)} snapshots')
+
+        if resume_key is None:
+            break
+        params['resumeKey'] = resume_key
+
+
+def stream_cdx_snapshots(url: str, start_date: str, end_date: str, granularity: str = 'day',
+                         page_size: int = 5000, base_url: str = CDX_URL, session: requests.Session = None,
+                         rate: float = 1.0):
+    """Enumerate the snapshots of a page with the CDX API
+
+    All the snapshots of the period come in a few paginated requests,
+    instead of one availability query per interval. The server collapses
+    them to one per period, and the result is collapsed again while
+    streaming, for servers that ignore the collapse.
+
+    Parameters
+    ----------
+    url : str
+        URL of the page to look for
+    start_date : str
+        Start of the period in YYYYMMDD format
+    end_date : str
+        End of the period in YYYYMMDD format
+    granularity : str, optional
+        Keep one snapshot per 'month', 'day', 'hour' or 'minute', by default 'day'
+    page_size : int, optional
+        Snapshots per request, by default 5000
+    base_url : str, optional
+        Address of the CDX API, by default CDX_URL
+    session : requests.Session, optional
+        Session used for the requests, by default a new one
+    rate : float, optional
+        Maximum number of requests per second, by default 1.0
+
+    Yields
+    ------
+    dict
+        The 'url' and 'timestamp' of each snapshot, in chronological order
+    """
+    if session is None:
+        session = http_fetch.create_session(pool_size=1, retries=0)
+    limiter = http_fetch.TokenBucket(rate)
+
+    logger.info(f'Enumerating snapshots of {url} from {start_date} to {end_date}, one per {granularity}')
+
+    snapshots = _query_cdx_pages(session, url, start_date, end_date, granularity, page_size, base_url, limiter)
+    yield from _collapse(snapshots, granularity)
+
+
+def obtain_cdx_links(url: str, start_date: str, end_date: str, granularity: str = 'day',
+                     base_url: str = CDX_URL) -> pd.DataFrame:
+    """Obtain Wayback Machine links for the snapshots in a given time period, with the CDX API
+
+    Parameters
+    ----------
+    url : str
+        URL of the page to look for
+    start_date : str
+        Start of the interval in YYYYMMDD format
+    end_date : str
+        End of the interval in YYYYMMDD format
+    granularity : str, optional
+        Keep one snapshot per 'month', 'day', 'hour' or 'minute', by default 'day'
+    base_url : str, optional
+        Address of the CDX API, by default CDX_URL
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame containing 'url' and 'timestamp' as columns
+    """
+    snapshots = list(stream_cdx_snapshots(url, start_date, end_date, granularity, base_url=base_url))
+
+    return pd.DataFrame(snapshots, columns=['url', 'timestamp'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the Wayback Machine snapshots of a page')
+    parser.add_argument('url', help='URL of the page, like g1.globo.com')
+    parser.add_argument('start_date', help='start of the period, in YYYYMMDD format')
+    parser.add_argument('end_date', help='end of the period, in YYYYMMDD format')
+    parser.add_argument('--mode', choices=['cdx', 'available'], default='cdx',
+                        help='enumerate the snapshots with the CDX API, or probe each interval')
+    parser.add_argument('--granularity', choices=list(GRANULARITIES), default='day',
+                        help='in cdx mode, keep one snapshot per period')
+    parser.add_argument('--interval', type=int, default=1, help='in available mode, days between the snapshots')
+    parser.add_argument('--concurrency', type=int, default=8, help='maximum number of queries at the same time')
+    parser.add_argument('--rate', type=float, default=5.0, help='maximum number of queries per second')
+    parser.add_argument('--base-url', default=None,
+                        help='address of the availability or CDX API, or of a stub server')
+    parser.add_argument('--output', default=None, help='CSV file to save the links, by default only printed')
+    args = parser.parse_args()
+
+    if args.mode == 'cdx':
+        links = obtain_cdx_links(args.url, args.start_date, args.end_date, args.granularity,
+                                 args.base_url or CDX_URL)
+    else:
+        links = obtain_wayback_links(args.url, args.start_date, args.end_date, args.interval,
+                                     args.concurrency, args.rate, args.base_url or WAYBACK_URL)
+    if args.output is None:
+        print(links.to_string())
+    else:
+        links.to_csv(args.output, index=False)
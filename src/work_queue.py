@@ -0,0 +1,190 @@
+from dataclasses import dataclass
+from datetime import datetime
+import sqlite3
+import threading
+import time
+import os
+import logging
+
+import src.logging_config
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_queue_path() -> str:
+    """Path of the work queue inside the data folder"""
+    return os.path.join(os.path.dirname(__file__), '..', 'data', 'queue.sqlite')
+
+
+@dataclass(slots=True)
+class Task():
+    """One scraping task: a subpage of a website, live or of an archived snapshot
+
+    The live tasks have an empty snapshot. The snapshot tasks have the
+    timestamp of the snapshot and the original URL archived.
+    """
+    font: str
+    page: str = ''
+    snapshot: str = ''
+    original: str = None
+    id: int = None
+    attempts: int = 0
+
+
+    @property
+    def name(self) -> str:
+        return f"{self.font} {self.page or '/'}" + (f" at {self.snapshot}" if self.snapshot else '')
+
+
+class WorkQueue():
+    """Queue of scraping tasks shared by the workers, backed by a sqlite file
+
+    A worker leases a task for lease_seconds. If it does not complete or
+    renew the lease in time, as when its machine dies, the task becomes
+    available to the other workers again. A task failing max_attempts
+    times is kept as failed.
+
+    The same task is only enqueued once while it is pending or leased, so
+    a coordinator can enqueue all the pages on every round.
+
+    sqlite serializes the leases between the processes of a machine, or of
+    many machines over a file system with working locks.
+    """
+
+    def __init__(self, path: str = None, max_attempts: int = 3):
+        self.path = default_queue_path() if path is None else path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # many worker processes wait for the lock of the file
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY,
+                    font TEXT NOT NULL,
+                    page TEXT NOT NULL,
+                    snapshot TEXT NOT NULL,
+                    original TEXT,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    enqueued_at TEXT NOT NULL,
+                    finished_at TEXT
+                )
+            ''')
+            # the same task is only once waiting or running
+            self._connection.execute(f'''
+                CREATE UNIQUE INDEX IF NOT EXISTS tasks_active ON tasks (font, page, snapshot)
+                WHERE status IN ('{PENDING}', '{LEASED}')
+            ''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id)')
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def enqueue(self, tasks: list[Task]) -> int:
+        """Add tasks to the queue, ignoring the ones already pending or leased
+
+        Returns
+        -------
+        int
+            Number of tasks added
+        """
+        enqueued_at = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                f"INSERT OR IGNORE INTO tasks (font, page, snapshot, original, status, enqueued_at) "
+                f"VALUES (?, ?, ?, ?, '{PENDING}', ?)",
+                [(task.font, task.page, task.snapshot, task.original, enqueued_at) for task in tasks]
+            )
+            return self._connection.total_changes - before
+
+
+    def lease(self, worker: str, lease_seconds: float = 600) -> Task:
+        """Take the oldest available task, or None if there is none
+
+        The tasks whose lease expired are available again, unless they
+        already used all their attempts.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(f'''
+                UPDATE tasks SET status = '{FAILED}', error = 'lease expired', worker = NULL
+                WHERE status = '{LEASED}' AND lease_until < ? AND attempts >= ?
+            ''', (now, self.max_attempts))
+
+            # one statement, so two workers never take the same task
+            row = self._connection.execute(f'''
+                UPDATE tasks SET status = '{LEASED}', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM tasks
+                    WHERE status = '{PENDING}' OR (status = '{LEASED}' AND lease_until < ?)
+                    ORDER BY id LIMIT 1
+                )
+                RETURNING id, font, page, snapshot, original, attempts
+            ''', (worker, now + lease_seconds, now)).fetchone()
+
+        if row is None:
+            return None
+
+        task_id, font, page, snapshot, original, attempts = row
+        return Task(font, page, snapshot, original, task_id, attempts)
+
+
+    def renew(self, task: Task, worker: str, lease_seconds: float = 600) -> bool:
+        """Extend the lease of a task still held by the worker"""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                f"UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = '{LEASED}'",
+                (time.time() + lease_seconds, task.id, worker)
+            )
+        return cursor.rowcount == 1
+
+
+    def complete(self, task: Task, worker: str) -> bool:
+        """Mark a task as done, returning False if the worker had lost its lease"""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                f"UPDATE tasks SET status = '{DONE}', finished_at = ?, error = NULL "
+                f"WHERE id = ? AND worker = ? AND status = '{LEASED}'",
+                (datetime.now().isoformat(timespec='seconds'), task.id, worker)
+            )
+        return cursor.rowcount == 1
+
+
+    def fail(self, task: Task, worker: str, error: str):
+        """Give a task back to the queue after an error, or keep it as failed after max_attempts"""
+        status = FAILED if task.attempts >= self.max_attempts else PENDING
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"UPDATE tasks SET status = ?, worker = NULL, lease_until = NULL, error = ?, finished_at = ? "
+                f"WHERE id = ? AND worker = ? AND status = '{LEASED}'",
+                (status, error, datetime.now().isoformat(timespec='seconds') if status == FAILED else None,
+                 task.id, worker)
+            )
+
+
+    def counts(self) -> dict:
+        """Number of tasks of each status"""
+        with self._lock:
+            rows = self._connection.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall()
+        return {status: 0 for status in [PENDING, LEASED, DONE, FAILED]} | dict(rows)
+
+
+    def is_idle(self) -> bool:
+        """Whether no task is pending or leased"""
+        counts = self.counts()
+        return counts[PENDING] == 0 and counts[LEASED] == 0